@@ -0,0 +1,133 @@
+"""
+ワーカー数ごとのスループットを計測する負荷テスト
+
+使い方:
+    # ワーカー数 1, 2, 4 でサーバーを順に起動し、それぞれ16件の要約を8並列で投入する
+    python benchmarks/load_test.py paper.pdf --workers 1 2 4 --requests 16 --concurrency 8
+
+    # 起動済みのサーバーに対して計測する
+    python benchmarks/load_test.py paper.pdf --url http://127.0.0.1:50000 --requests 16
+
+    # 記録済みのカセットを再生して、APIを呼ばずに計測する（記録時の所要時間どおりに待つ）
+    python benchmarks/load_test.py paper.pdf --replay paper --replay-latency 1
+
+--replay を指定しない場合は .env のAPIキーを使って実際にGeminiとNotionを呼び出す点に注意。
+カセットは TRAFFIC_MODE=record で同じPDFを1回アップロードして記録しておく。
+ワーカー数ごとに空の DATA_DIR でサーバーを起動するため、前の計測のキャッシュやジョブの影響を受けない。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_until_ready(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/quota", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"サーバーが起動しません: {url}")
+
+def upload(url: str, pdf_path: str, summary_mode: str, pdf_mode: str) -> dict:
+    start = time.time()
+    with open(pdf_path, "rb") as file:
+        response = requests.post(
+            f"{url}/upload-pdf",
+            files={"pdf_file": (os.path.basename(pdf_path), file, "application/pdf")},
+            data={"summary_mode": summary_mode, "pdf_mode": pdf_mode},
+            timeout=3600,
+        )
+    return {
+        "latency": time.time() - start,
+        "ok": response.status_code == 200 and "完了しました" in response.text,
+    }
+
+def run_load(url: str, args) -> dict:
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda _: upload(url, args.pdf_path, args.summary_mode, args.pdf_mode),
+            range(args.requests)
+        ))
+    elapsed = time.time() - start
+    latencies = sorted(r["latency"] for r in results)
+    return {
+        "elapsed": elapsed,
+        "succeeded": sum(r["ok"] for r in results),
+        "throughput": len(results) / elapsed * 60,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0],
+    }
+
+def server_env(data_dir: str, args) -> dict:
+    """計測ごとのサーバーの環境変数（--replay の場合はカセットを再生する）"""
+    env = dict(os.environ, DATA_DIR=data_dir)
+    if args.replay:
+        cassette = args.replay
+        if os.sep not in cassette and not cassette.endswith(".jsonl"):
+            # カセット名は元の DATA_DIR の cassettes から探す
+            cassette = os.path.join(os.environ.get("DATA_DIR", "data"), "cassettes", f"{cassette}.jsonl")
+        cassette = os.path.abspath(os.path.join(PROJECT_ROOT, cassette))
+        if not os.path.exists(cassette):
+            raise SystemExit(f"カセットが見つかりません: {cassette}")
+        env.update(TRAFFIC_MODE="replay", TRAFFIC_CASSETTE=cassette,
+                   TRAFFIC_REPLAY_LATENCY=str(args.replay_latency))
+    return env
+
+def start_server(workers: int, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=PROJECT_ROOT, env=env,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="ワーカー数ごとのスループット計測")
+    parser.add_argument("pdf_path", help="投入するPDFファイル")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="計測するワーカー数（--url指定時は無視）")
+    parser.add_argument("--url", help="起動済みサーバーのURL")
+    parser.add_argument("--port", type=int, default=50100)
+    parser.add_argument("--requests", type=int, default=16, help="投入する要約ジョブ数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時リクエスト数")
+    parser.add_argument("--summary-mode", default="concise")
+    parser.add_argument("--pdf-mode", default="text")
+    parser.add_argument("--replay", metavar="CASSETTE",
+                        help="APIを呼ばずに再生するカセット名またはファイルのパス（--url指定時は無視）")
+    parser.add_argument("--replay-latency", type=float, default=1.0,
+                        help="再生時に記録時の所要時間の何倍待つか（0で待たない）")
+    args = parser.parse_args()
+
+    rows = []
+    if args.url:
+        rows.append(("-", run_load(args.url, args)))
+    else:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory(prefix="load-test-") as data_dir:
+                server = start_server(workers, args.port, server_env(data_dir, args))
+                try:
+                    url = f"http://127.0.0.1:{args.port}"
+                    wait_until_ready(url)
+                    rows.append((workers, run_load(url, args)))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    print(f"{'workers':>8} {'ok':>6} {'elapsed[s]':>11} {'jobs/min':>9} {'p50[s]':>8} {'p95[s]':>8}")
+    for workers, r in rows:
+        print(f"{workers:>8} {r['succeeded']:>3}/{args.requests:<2} {r['elapsed']:>11.1f} "
+              f"{r['throughput']:>9.2f} {r['p50']:>8.1f} {r['p95']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
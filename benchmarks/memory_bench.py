@@ -0,0 +1,177 @@
+"""
+PDF処理のピークメモリ（RSS）をジョブごとに計測するベンチマーク
+
+合成したPDF（小さい論文、ページ数の多い論文、大きなスキャンPDF）に対して、
+アップロードの保存 → 処理モードの自動判定 → テキスト抽出 を別プロセスで1ジョブずつ実行し、
+従来の処理（legacy）と低メモリモード（low）のピークRSSを比較する。
+GeminiとNotionは呼び出さない。
+
+使い方:
+    python benchmarks/memory_bench.py
+    python benchmarks/memory_bench.py --scale 2 --keep-dir /tmp/bench-pdfs
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOREM = ("Attention mechanisms let the model weigh every token against every other token "
+         "and the resulting representations are combined across layers")
+
+def make_pdf(path: str, pages: int, lines: int = 45, image_size: int = 0):
+    """
+    テキストのみ、または1ページ1枚の画像（スキャン相当）を含むPDFを書き出す
+
+    image_size > 0 の場合は image_size x image_size のグレースケール画像（圧縮なし）を各ページに置く。
+    """
+    offsets = []
+    with open(path, "wb") as out:
+        out.write(b"%PDF-1.4\n")
+
+        def write_object(number: int, body: bytes):
+            offsets.append((number, out.tell()))
+            out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+        # 1: カタログ, 2: ページツリー, 3: フォント, 以降はページごとに (ページ, コンテンツ[, 画像])
+        per_page = 3 if image_size else 2
+        page_numbers = [4 + i * per_page for i in range(pages)]
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = b" ".join(b"%d 0 R" % n for n in page_numbers)
+        write_object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages)
+        write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+        rng = random.Random(0)
+        for i, number in enumerate(page_numbers):
+            content = b""
+            for line in range(lines):
+                words = LOREM.split()
+                rng.shuffle(words)
+                text = " ".join(words[:12]).encode()
+                content += b"BT /F1 10 Tf 60 %d Td (%s) Tj ET\n" % (760 - line * 16, text)
+            resources = b"/Font << /F1 3 0 R >>"
+            if image_size:
+                content = b"q 500 0 0 700 50 50 cm /Im1 Do Q\n"
+                resources += b" /XObject << /Im1 %d 0 R >>" % (number + 2)
+            compressed = zlib.compress(content)
+            write_object(number, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                                 b"/Contents %d 0 R /Resources << " % (number + 1) + resources + b" >> >>")
+            write_object(number + 1, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(compressed)
+                         + compressed + b"\nendstream")
+            if image_size:
+                pixels = bytes(rng.getrandbits(8) for _ in range(256)) * (image_size * image_size // 256)
+                write_object(number + 2, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+                                         b"/ColorSpace /DeviceGray /BitsPerComponent 8 /Length %d >>\nstream\n"
+                             % (image_size, image_size, len(pixels)) + pixels + b"\nendstream")
+
+        xref = out.tell()
+        total = max(n for n, _ in offsets) + 1
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % total)
+        for _, offset in sorted(offsets):
+            out.write(b"%010d 00000 n \n" % offset)
+        out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (total, xref))
+
+def peak_rss_mb() -> float:
+    # Linux の ru_maxrss はKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_job(pdf_path: str, mode: str, work_dir: str):
+    """1ジョブ分の処理を実行して結果を表示する（子プロセスで呼ばれる）"""
+    sys.path.insert(0, PROJECT_ROOT)
+    import PyPDF2
+    from src.pdf_analysis import analyze_pdf
+    from src.pdf_stream import save_upload, write_text
+
+    baseline = peak_rss_mb()
+    start = time.time()
+    saved = os.path.join(work_dir, f"upload-{os.getpid()}.pdf")
+    with open(pdf_path, "rb") as upload:
+        if mode == "low":
+            path, _ = save_upload(upload, work_dir)
+            os.replace(path, saved)
+        else:
+            # 従来の処理: アップロード全体をメモリに読み込んでから保存
+            content = upload.read()
+            with open(saved, "wb") as file:
+                file.write(content)
+
+    if mode == "low":
+        analysis = analyze_pdf(saved)
+        # アプリと同じく、ページごとにファイルへ書き出してから全文を1回だけ読み込む
+        text_path = f"{saved}.txt"
+        with open(text_path, "w", encoding="utf-8") as file:
+            write_text(saved, file)
+        with open(text_path, encoding="utf-8") as file:
+            text = file.read()
+        os.remove(text_path)
+    else:
+        # 従来の処理: 解析済みオブジェクトを保持したまま全ページを処理し、文字列を連結する
+        with open(saved, "rb") as file:
+            reader = PyPDF2.PdfReader(file)
+            analysis = {"page_count": len(reader.pages)}
+            for page in reader.pages:
+                page.extract_text()
+        with open(saved, "rb") as file:
+            reader = PyPDF2.PdfReader(file)
+            text = ""
+            for page_num in range(len(reader.pages)):
+                text += reader.pages[page_num].extract_text()
+    os.remove(saved)
+    print(f"{peak_rss_mb():.1f} {baseline:.1f} {time.time() - start:.2f} {analysis['page_count']} {len(text)}")
+
+def measure(pdf_path: str, mode: str, work_dir: str) -> dict:
+    env = dict(os.environ)
+    # 設定モジュールの必須項目（APIは呼び出さない）
+    for key in ("GOOGLE_API_KEY", "NOTION_API_KEY", "NOTION_DATABASE_ID"):
+        env.setdefault(key, "benchmark")
+    env.setdefault("DATA_DIR", os.path.join(work_dir, "data"))
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--job", pdf_path, mode, work_dir],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+    peak, baseline, elapsed, pages, chars = output[-5:]
+    return {"peak": float(peak), "baseline": float(baseline), "elapsed": float(elapsed),
+            "pages": int(pages), "chars": int(chars)}
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF処理のジョブごとのピークRSSを計測")
+    parser.add_argument("--scale", type=float, default=1.0, help="合成PDFの大きさの倍率")
+    parser.add_argument("--keep-dir", help="合成PDFを保存するディレクトリ（省略時は一時ディレクトリ）")
+    parser.add_argument("--job", nargs=3, metavar=("PDF", "MODE", "WORK_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.job:
+        run_job(*args.job)
+        return
+
+    work_dir = args.keep_dir or tempfile.mkdtemp(prefix="memory-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    cases = [
+        ("small (12 pages)", dict(pages=12)),
+        ("long (1500 pages)", dict(pages=int(1500 * args.scale))),
+        ("scanned (150 pages)", dict(pages=int(150 * args.scale), image_size=1024)),
+    ]
+    try:
+        print(f"{'pdf':<22} {'size[MB]':>9} {'mode':>7} {'peak RSS[MB]':>13} {'job[MB]':>8} {'time[s]':>8}")
+        for name, spec in cases:
+            pdf_path = os.path.join(work_dir, name.split()[0] + ".pdf")
+            if not os.path.exists(pdf_path):
+                make_pdf(pdf_path, **spec)
+            size_mb = os.path.getsize(pdf_path) / (1024 * 1024)
+            for mode in ("legacy", "low"):
+                r = measure(pdf_path, mode, work_dir)
+                print(f"{name:<22} {size_mb:>9.1f} {mode:>7} {r['peak']:>13.1f} "
+                      f"{r['peak'] - r['baseline']:>8.1f} {r['elapsed']:>8.2f}")
+    finally:
+        if not args.keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
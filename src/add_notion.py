@@ -1,24 +1,47 @@
-from notion_client import Client
 from .chat_pdf import get_summary
+from .job_store import JobStore, get_job_store
+from .coordination import is_process_alive
+from .search_index import get_search_index
+from .keyword_taxonomy import KeywordTaxonomy, normalize_keyword
+from .block_packing import legacy_call_count, pack_chunks, pack_section
+from .replay import create_notion_client
+from .quota import NOTION_QUOTA_KEY, get_quota_scheduler
+from .job_context import JobCancelled, JobContext, JobDeadlineExceeded, track_job
+from .scheduler import estimate_job_cost, get_scheduler
+from .memory_budget import estimate_job_memory_mb
+import functools
 import json
 import re
 import os
+import time
 import argparse
 import logging
-from typing import Optional, Dict, Any
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable
 
 logger = logging.getLogger(__name__)
 
+# このプロセスの起動時刻（ジョブストアの updated_at と同じ形式）
+_PROCESS_STARTED_AT = datetime.now().isoformat(timespec="seconds")
+
 class NotionSummaryWriter:
-    def __init__(self, config_module):
+    def __init__(self, config_module, job_store: Optional[JobStore] = None):
         """
         NotionSummaryWriterの初期化
         Args:
             config_module: 設定モジュール（通常はsrc.config）
+            job_store: ジョブの進捗を記録するストア（省略時は記録しない）
         """
         self.config = config_module
-        self.notion = Client(auth=self.config.NOTION_API_KEY)
+        self.notion = create_notion_client(self.config.NOTION_API_KEY)
         self.database_id = self.config.database_id
+        self.job_store = job_store
+        self.keyword_taxonomy = KeywordTaxonomy(self.notion, self.database_id)
+
+    def _update_job(self, job_id: Optional[str], **fields):
+        """ジョブストアに進捗を記録（ジョブなしで実行された場合は何もしない）"""
+        if job_id and self.job_store:
+            self.job_store.update_job(job_id, **fields)
 
     def _sanitize_keyword(self, keyword: str, max_length: int = 100) -> str:
         """
@@ -41,6 +64,8 @@ class NotionSummaryWriter:
         """キーワードリストを処理し、Notionの制限に適合させる"""
         processed_keywords = []
         seen = set()
+        # 既存オプションにない新しいキーワード（同じ論文内の表記ゆれは最初の表記にまとめる）
+        new_keywords = {}
 
         for keyword in keywords:
             if not keyword:
@@ -52,13 +77,34 @@ class NotionSummaryWriter:
                 if not sub_key:
                     continue
                 sanitized = self._sanitize_keyword(sub_key)
+                if not sanitized:
+                    continue
+
+                # 既存のオプションに表記ゆれで一致する場合はそちらを使う
+                canonical = self.keyword_taxonomy.resolve(sanitized)
+                if canonical:
+                    if canonical != sanitized:
+                        logger.info(f"キーワードを既存オプションに統一: {sanitized} → {canonical}")
+                    sanitized = canonical
+                elif not self.config.KEYWORD_ALLOW_NEW:
+                    logger.info(f"既存オプションに一致しないキーワードを除外: {sanitized}")
+                    continue
+                else:
+                    # 索引への登録はページの作成・更新に成功してから行う（_register_keywords）
+                    sanitized = new_keywords.setdefault(normalize_keyword(sanitized), sanitized)
+
                 # 重複チェックと長さ制限（Notionの制限に合わせて）
-                if sanitized and sanitized.lower() not in seen and len(sanitized) <= 100:
+                if sanitized.lower() not in seen and len(sanitized) <= 100:
                     processed_keywords.append(sanitized)
                     seen.add(sanitized.lower())
         
         return processed_keywords
 
+    def _register_keywords(self, properties: Dict[str, Any]):
+        """書き込みに成功したページのキーワードを索引に加え、後続の論文のキーワードをそちらに寄せる"""
+        for option in properties.get("Keywords", {}).get("multi_select", []):
+            self.keyword_taxonomy.register(option["name"])
+
     def _convert_markdown_to_blocks(self, text: str) -> list:
         """マークダウンテキストをNotionブロックに変換"""
         blocks = []
@@ -247,12 +293,15 @@ class NotionSummaryWriter:
 
         return blocks
 
-    def _create_notion_properties(self, sections: Dict[str, Any]) -> Dict[str, Any]:
-        """Notionのプロパティを生成"""
+    def _create_notion_properties(self, sections: Dict[str, Any],
+                                  columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Notionのプロパティを生成（columns を指定した場合はその列のみ）"""
         properties = {}
         for column, config in self.config.column_configs.items():
             if not config.get("database_property", False):
                 continue
+            if columns is not None and column not in columns:
+                continue
                 
             if column not in sections:
                 logger.warning(f"セクション {column} が見つかりません")
@@ -278,6 +327,10 @@ class NotionSummaryWriter:
 
         return properties
 
+    def _section_blocks(self, column: str, content: Any) -> list:
+        """セクション1つ分のブロック（見出し・本文・区切り線、長いセクションはトグル見出し）"""
+        return pack_section(column, self._convert_markdown_to_blocks(str(content)))
+
     def _create_subpage_blocks(self, title: str, blocks: list) -> dict:
         """サブページを作成するためのデータを生成"""
         return {
@@ -289,15 +342,65 @@ class NotionSummaryWriter:
             "children": blocks
         }
 
+    def _discard_partial_page(self, page_id: str) -> bool:
+        """書き込み途中のページをアーカイブする（成功した場合は True）"""
+        try:
+            get_quota_scheduler().acquire(NOTION_QUOTA_KEY)
+            self.notion.pages.update(page_id=page_id, archived=True)
+        except Exception as e:
+            logger.error(f"書き込み途中のNotionページをアーカイブできません: {page_id}: {e}")
+            return False
+        logger.info(f"書き込み途中のNotionページをアーカイブ: {page_id}")
+        return True
+
     def add_summary(self, pdf_path: str, model_name: Optional[str] = None, 
-                   summary_mode: str = "concise", pdf_mode: str = "text") -> Optional[Dict]:
+                   summary_mode: str = "concise", pdf_mode: str = "text",
+                   job_id: Optional[str] = None, context: Optional[JobContext] = None) -> Optional[Dict]:
+        """
+        PDFを要約してNotionページを作成する
+
+        job_id を指定した場合は各ステージの完了をジョブストアに記録し、
+        中断されたジョブは完了済みのステージから再開する。
+        context（省略時は JOB_TIMEOUT_SECONDS の期限で作成）が取り消された・期限を過ぎた場合は
+        次の確認時点で処理を打ち切り、アップロードしたファイルなどを片付ける。
+        """
+        context = context or JobContext(job_id)
+        with track_job(context):
+            try:
+                return self._add_summary(pdf_path, model_name, summary_mode, pdf_mode, job_id, context)
+            except JobCancelled as e:
+                context.run_cleanups()
+                if isinstance(e, JobDeadlineExceeded):
+                    logger.error(f"ジョブの期限切れ: {job_id or pdf_path}: {e}")
+                    self._update_job(job_id, state="failed", error=str(e))
+                else:
+                    logger.info(f"ジョブを取り消しました: {job_id or pdf_path}: {e}")
+                    self._update_job(job_id, state="cancelled", error=str(e))
+                return {"success": False, "cancelled": True, "error": str(e)}
+
+    def _add_summary(self, pdf_path: str, model_name: Optional[str], summary_mode: str, pdf_mode: str,
+                     job_id: Optional[str], context: JobContext) -> Optional[Dict]:
+        job = self.job_store.get_job(job_id) if job_id and self.job_store else None
+        context.check()
         try:
-            logger.info(f"PDFの要約を開始: {pdf_path}, モデル: {model_name or 'デフォルト'}, "
-                       f"モード: {summary_mode}, PDF処理: {pdf_mode}")
-            
-            sections = get_summary(pdf_path, model_name, summary_mode, pdf_mode)
-            if sections is None:
-                return None
+            if job and job.get("sections"):
+                # 要約は生成済み（Notionへの書き込み中に中断された）
+                logger.info(f"保存済みの要約を使ってジョブを再開: {job_id}")
+                sections = job["sections"]
+            else:
+                logger.info(f"PDFの要約を開始: {pdf_path}, モデル: {model_name or 'デフォルト'}, "
+                           f"モード: {summary_mode}, PDF処理: {pdf_mode}")
+                self._update_job(job_id, state="summarizing")
+
+                # 期限の一部はNotionへの書き込み用に残しておく
+                with context.stage(self.config.JOB_SUMMARY_TIME_SHARE):
+                    sections = get_summary(pdf_path, model_name, summary_mode, pdf_mode, context=context,
+                                           input_hash=(job or {}).get("input_hash"))
+                if sections is None:
+                    self._update_job(job_id, state="failed", error="要約の生成に失敗しました")
+                    return None
+                self._update_job(job_id, state="summarized", sections=sections,
+                                 token_info=sections['_debug_info']['token_counts'])
 
             # プロセス情報ブロックを作成
             token_counts = sections['_debug_info']['token_counts']
@@ -305,6 +408,21 @@ class NotionSummaryWriter:
             prompt_tokens = token_counts.get('prompt', 0)
             total_input_tokens = token_counts.get('total_input', 0)
 
+            # autoモードの場合は実際に使われた処理モードを表示する
+            resolved_pdf_mode = sections['_debug_info'].get('pdf_mode', pdf_mode)
+            if resolved_pdf_mode != pdf_mode:
+                resolved_pdf_mode = f"{resolved_pdf_mode} (自動判定)"
+            pdf_mode_reasons = sections['_debug_info'].get('pdf_mode_reasons', [])
+            pdf_mode_reason_lines = ''.join(f"\n  - {reason}" for reason in pdf_mode_reasons)
+            model_usage = sections['_debug_info'].get('model_usage', {})
+            model_usage_lines = ''.join(f"\n  - {label}: {used}" for label, used in model_usage.items())
+            title_extraction = sections['_debug_info'].get('title_extraction')
+            title_line = ""
+            if title_extraction:
+                title_line = ("\n• タイトル: ローカル抽出" if title_extraction["source"] == "local" else "\n• タイトル: PDF全体から抽出")
+                if "confidence" in title_extraction:
+                    title_line += f" ({title_extraction['method']}, 確信度 {title_extraction['confidence']})"
+
             process_info = {
                 "object": "block",
                 "type": "callout",
@@ -314,9 +432,9 @@ class NotionSummaryWriter:
                         "type": "text",
                         "text": {
                             "content": f"""処理情報:
-• モデル: {model_name or 'デフォルト (gemini-1.5-flash-002)'}
+• モデル: {model_name or 'デフォルト (gemini-1.5-flash-002)'}{model_usage_lines}
 • 要約モード: {summary_mode}
-• PDF処理モード: {pdf_mode}
+• PDF処理モード: {resolved_pdf_mode}{pdf_mode_reason_lines}{title_line}
 • トークン使用状況:
   - PDF本文: {pdf_content_tokens:,} トークン
   - プロンプト: {prompt_tokens:,} トークン
@@ -328,13 +446,6 @@ class NotionSummaryWriter:
                 }
             }
 
-            # プロパティの作成を先に実行
-            properties = self._create_notion_properties(sections)
-            if not properties.get("Name"):  # タイトルプロパティがない場合
-                properties["Name"] = {
-                    "title": [{"text": {"content": "Untitled"}}]
-                }
-
             # ブロック作成
             all_blocks = [process_info]
 
@@ -352,49 +463,80 @@ class NotionSummaryWriter:
             ])
 
             # セクションのコンテンツをブロックとして追加
+            unpacked_block_count = len(all_blocks)
             for column, content in sections.items():
                 if column != "Keywords" and column != "Name" and column != "_debug_info":
-                    all_blocks.extend([
-                        {
-                            "object": "block",
-                            "type": "heading_2",
-                            "heading_2": {"rich_text": [{"text": {"content": column}}]}
-                        },
-                        *self._convert_markdown_to_blocks(str(content)),
-                        {
-                            "object": "block",
-                            "type": "divider",
-                            "divider": {}
-                        }
-                    ])
-
-            # プロパティの作成
-            properties = self._create_notion_properties(sections)
+                    all_blocks.extend(self._section_blocks(column, content))
+                    # パッキング前は1行1ブロック + 見出し + 区切り線
+                    unpacked_block_count += len(self._convert_markdown_to_blocks(str(content))) + 2
 
             # メインページを作成
+            main_page_id = None
             try:
-                # 100ブロックごとに分割して保存
-                MAX_BLOCKS = 90  # 余裕を持って90に設定
-                block_chunks = [all_blocks[i:i + MAX_BLOCKS] for i in range(0, len(all_blocks), MAX_BLOCKS)]
-                
-                # メインページを作成
-                main_page = {
-                    "parent": {"database_id": self.database_id},
-                    "properties": properties,
-                    "children": block_chunks[0] if block_chunks else []
+                resuming = bool(job and job.get("notion_page_id"))
+                if resuming:
+                    # 最初の実行で分割したチャンクをそのまま使う。プロパティ（キーワードの表記など）は
+                    # 他のジョブによって変わることがあり、分割し直すと書き込み済みの位置とずれるため
+                    block_chunks = job["block_chunks"]
+                else:
+                    properties = self._create_notion_properties(sections)
+                    if not properties.get("Name"):  # タイトルプロパティがない場合
+                        properties["Name"] = {
+                            "title": [{"text": {"content": "Untitled"}}]
+                        }
+                    # リクエストの上限（ブロック数・バイト数）まで詰めて分割して保存
+                    properties_bytes = len(json.dumps(properties, ensure_ascii=False).encode("utf-8"))
+                    block_chunks = pack_chunks(all_blocks, first_chunk_overhead=properties_bytes)
+                notion_api_calls = {
+                    "before": legacy_call_count(unpacked_block_count),
+                    "after": max(len(block_chunks), 1),
                 }
+                logger.info(f"NotionへのAPI呼び出し数: {notion_api_calls['before']} → {notion_api_calls['after']} "
+                           f"(ブロック数 {unpacked_block_count} → {len(all_blocks)})")
                 
-                main_response = self.notion.pages.create(**main_page)
-                main_page_id = main_response["id"]
-                logger.info(f"Notionページを作成: {main_page_id}")
+                if resuming:
+                    # ページ作成済みの場合は未追加のブロックから再開
+                    main_page_id = job["notion_page_id"]
+                    chunks_written = job.get("blocks_written", 0)
+                    logger.info(f"Notionページへの書き込みを再開: {main_page_id} "
+                               f"({chunks_written}/{len(block_chunks)} チャンク完了済み)")
+                else:
+                    context.check()
+                    # メインページを作成
+                    main_page = {
+                        "parent": {"database_id": self.database_id},
+                        "properties": properties,
+                        "children": block_chunks[0] if block_chunks else []
+                    }
+                    
+                    # 対話的な書き込みもエクスポートやバックフィルと同じNotionのRPMに従う
+                    get_quota_scheduler().acquire(NOTION_QUOTA_KEY, context=context)
+                    main_response = self.notion.pages.create(**main_page)
+                    main_page_id = main_response["id"]
+                    self._register_keywords(properties)
+                    chunks_written = 1
+                    logger.info(f"Notionページを作成: {main_page_id}")
+                    self._update_job(job_id, state="writing", notion_page_id=main_page_id,
+                                     blocks_written=chunks_written, block_chunks=block_chunks)
+
+                # 書き込み途中で取り消された場合は不完全なページを残さない
+                context.add_cleanup(
+                    f"書き込み途中のNotionページをアーカイブ ({main_page_id})",
+                    functools.partial(self._discard_partial_page, main_page_id)
+                )
                 
                 # 残りのブロックがあれば、メインページに追加
-                for chunk in block_chunks[1:]:
+                for index in range(max(chunks_written, 1), len(block_chunks)):
+                    chunk = block_chunks[index]
+                    context.check()
+                    get_quota_scheduler().acquire(NOTION_QUOTA_KEY, context=context)
                     self.notion.blocks.children.append(block_id=main_page_id, children=chunk)
                     logger.info(f"追加ブロックを追加: {len(chunk)} ブロック")
+                    self._update_job(job_id, blocks_written=index + 1)
 
-                return {
+                result = {
                     "success": True,
+                    "notion_page_id": main_page_id,
                     "token_info": {
                         "pdf_content": pdf_content_tokens,
                         "prompt": prompt_tokens,
@@ -403,30 +545,148 @@ class NotionSummaryWriter:
                     "process_info": {
                         "model": model_name or 'デフォルト',
                         "summary_mode": summary_mode,
-                        "pdf_mode": pdf_mode
+                        "pdf_mode": resolved_pdf_mode,
+                        "pdf_mode_reasons": pdf_mode_reasons,
+                        "model_usage": model_usage,
+                        "title_extraction": title_extraction,
+                        "notion_api_calls": notion_api_calls
                     }
                 }
+                self._update_job(job_id, state="completed", token_info=result["token_info"],
+                                 process_info=result["process_info"], block_chunks=None)
+
+                # ローカルの検索インデックスに追加（失敗しても要約自体は成功扱い）
+                try:
+                    get_search_index().add(main_page_id, sections)
+                except Exception as index_error:
+                    logger.warning(f"検索インデックスへの追加に失敗: {index_error}")
+                return result
 
+            except JobCancelled:
+                raise
             except Exception as notion_error:
                 logger.error(f"Notionページの作成に失敗: {notion_error}")
+                error = f"Notionページの作成に失敗: {notion_error}"
+                if main_page_id and not self._discard_partial_page(main_page_id):
+                    # 書き込み途中のページを片付けられない場合は、再起動時に続きから書き込む
+                    self._update_job(job_id, state="writing", error=error)
+                else:
+                    # 失敗したジョブは再開も重複判定もされないため、不完全なページを残さない
+                    self._update_job(job_id, state="failed", error=error, notion_page_id=None,
+                                     blocks_written=0, block_chunks=None)
                 return {
                     "success": False,
                     "error": f"Notionページの作成に失敗: {str(notion_error)}"
                 }
 
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"予期せぬエラーが発生: {e}")
+            self._update_job(job_id, state="failed", error=str(e))
             return {
                 "success": False,
                 "error": str(e)
             }
 
 def add_summary2notion(pdf_path: str, model_name: Optional[str] = None, 
-                      summary_mode: str = "concise", pdf_mode: str = "text") -> Optional[Dict]:
+                      summary_mode: str = "concise", pdf_mode: str = "text",
+                      job_id: Optional[str] = None, context: Optional[JobContext] = None) -> Optional[Dict]:
     """レガシー互換性のための関数"""
     from . import config
-    writer = NotionSummaryWriter(config)
-    return writer.add_summary(pdf_path, model_name, summary_mode, pdf_mode)
+    writer = NotionSummaryWriter(config, job_store=get_job_store() if job_id else None)
+    return writer.add_summary(pdf_path, model_name, summary_mode, pdf_mode, job_id=job_id, context=context)
+
+def remove_job_file(pdf_path: Optional[str]):
+    """ジョブの一時PDFを削除"""
+    if pdf_path and os.path.exists(pdf_path):
+        os.remove(pdf_path)
+        logger.info(f"一時ファイルを削除: {pdf_path}")
+
+def _resume_job(writer: NotionSummaryWriter, job: Dict[str, Any], pdf_path: Optional[str]):
+    writer.add_summary(pdf_path, job.get("model_name"), job.get("summary_mode") or "concise",
+                       job.get("pdf_mode") or "text", job_id=job["id"])
+    remove_job_file(pdf_path)
+
+def _owned_by_live_worker(job: Dict[str, Any]) -> bool:
+    owner = job.get("owner_pid")
+    if not owner:
+        return False
+    if owner == os.getpid():
+        # コンテナの再起動などで前回と同じPIDになった場合、起動前に更新されたジョブは前回のプロセスのもの
+        # （登録・引き継ぎの際に updated_at が更新されるため、起動後に扱ったジョブは対象外になる）
+        return job["updated_at"] >= _PROCESS_STARTED_AT
+    return is_process_alive(owner)
+
+def resume_interrupted_jobs(submitter: Optional[str] = None) -> int:
+    """
+    再起動や異常終了で中断されたジョブを、バックグラウンドのジョブとしてスケジューラに投入して
+    完了済みのステージから再開する
+
+    担当プロセスが終了しているジョブだけを claim_job で引き継ぐため、複数のワーカーが
+    同時に呼び出しても同じジョブを二重に再開しない。
+
+    Args:
+        submitter: 指定した場合は、その投入元が作ったジョブだけを再開する（フォルダ監視など）
+
+    Returns:
+        int: 再開したジョブ数
+    """
+    from . import config
+    store = get_job_store()
+    writer = NotionSummaryWriter(config, job_store=store)
+    resumed = 0
+    for job in store.interrupted_jobs(submitter):
+        # 生存中のワーカー（自分を含む）が処理しているジョブには触れない
+        owner = job.get("owner_pid")
+        if _owned_by_live_worker(job):
+            continue
+        if not store.claim_job(job["id"], owner):
+            continue
+
+        pdf_path = job.get("pdf_path")
+        if job.get("cancel_requested"):
+            # 取り消し要求の後に担当ワーカーが終了した
+            store.update_job(job["id"], state="cancelled", error="APIから取り消されました")
+            remove_job_file(pdf_path)
+            logger.info(f"取り消されたジョブは再開しません: {job['id']}")
+            continue
+        if not job.get("sections") and not (pdf_path and os.path.exists(pdf_path)):
+            store.update_job(job["id"], state="failed", error="PDFが見つからないため再開できません")
+            logger.warning(f"ジョブを再開できません（PDFなし）: {job['id']}")
+            continue
+
+        logger.info(f"中断されたジョブを再開: {job['id']} ({job.get('filename')}, 状態: {job['state']})")
+        summary_mode = job.get("summary_mode") or "concise"
+        # 要約が生成済みのジョブはNotionへの書き込みだけなので最も軽い
+        if job.get("sections"):
+            cost, memory_mb = 0.0, 0.0
+        else:
+            cost = estimate_job_cost(pdf_path, summary_mode, job.get("input_hash"))
+            memory_mb = estimate_job_memory_mb(pdf_path)
+        get_scheduler().submit(functools.partial(_resume_job, writer, job, pdf_path),
+                               summary_mode=summary_mode, submitter="resume", cost=cost, label=job["id"],
+                               memory_mb=memory_mb)
+        resumed += 1
+    return resumed
+
+def sweep_interrupted_jobs(interval: float):
+    """
+    担当ワーカーが終了したジョブの再開を interval 秒ごとに繰り返す（0以下の場合は1回だけ）
+
+    起動時の1回だけでは、稼働中に異常終了したワーカーのジョブが次の再起動まで残るため、
+    各ワーカーがバックグラウンドのスレッドで呼び出す。
+    """
+    while True:
+        try:
+            resumed = resume_interrupted_jobs()
+            if resumed:
+                logger.info(f"中断されたジョブを再開: {resumed}件")
+        except Exception as e:
+            logger.error(f"中断されたジョブの再開に失敗: {e}")
+        if interval <= 0:
+            return
+        time.sleep(interval)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="論文要約をNotionに追加")
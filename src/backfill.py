@@ -0,0 +1,345 @@
+from . import config
+from .add_notion import NotionSummaryWriter
+from .block_packing import pack_chunks
+from .chat_pdf import get_needed_sections, get_summary
+from .db import connect
+from .export_notion import NotionExporter, properties_to_sections
+from .quota import NOTION_QUOTA_KEY
+from .job_store import get_job_store, hash_file
+from .pdf_cache import get_pdf_cache
+from .search_index import get_search_index
+from .title_extraction import extract_title
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ページ本文には書き出さないセクション（プロパティのみ）
+PROPERTY_ONLY_SECTIONS = ("Name", "Keywords")
+
+def _property_is_empty(prop: Optional[Dict[str, Any]]) -> bool:
+    if not prop:
+        return True
+    value = prop.get(prop.get("type"))
+    return not value
+
+def find_missing_sections(page: Dict[str, Any], headings: Optional[Set[str]],
+                          targets: Iterable[str]) -> List[str]:
+    """
+    ページに存在しないセクションを返す
+
+    データベースのプロパティとして持つ列はプロパティの値、それ以外は本文の見出し（heading_2）で判定する。
+    """
+    missing = []
+    for name in targets:
+        column = config.column_configs[name]
+        if column.get("database_property", False):
+            if _property_is_empty(page.get("properties", {}).get(name)):
+                missing.append(name)
+        elif headings is not None and name not in headings:
+            missing.append(name)
+    return missing
+
+def _comparable_title(title: str) -> str:
+    """タイトルの照合用キー（Name の末尾の「(日本語訳)」・記号・大文字小文字を無視する）"""
+    title = re.sub(r"\s*[(（][^()（）]*[)）]\s*$", "", title)
+    return re.sub(r"[^0-9a-z぀-ヿ一-鿿]", "", title.casefold())
+
+class LocalPdfIndex:
+    """
+    フォルダ内のPDFをハッシュとタイトルで引く索引
+
+    PDFキャッシュにないページ（キャッシュ導入前に作成された・キャッシュから削除された）の元PDFを探す。
+    ジョブの記録があればハッシュで、なければページの Name とPDFから抽出したタイトルの完全一致で照合する
+    （別の論文のPDFで補完しないよう、似ているだけのタイトルには一致させない）。
+    初めて照合するときに全ファイルを読むため、フォルダは論文のPDFを置いた場所に絞ること。
+    """
+
+    def __init__(self, directories: Iterable[str]):
+        self.directories = [d for d in directories if d and os.path.isdir(d)]
+        self._lock = threading.Lock()
+        self._by_hash: Optional[Dict[str, str]] = None
+        self._by_title: Dict[str, str] = {}
+
+    def _build(self):
+        self._by_hash = {}
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if not name.lower().endswith(".pdf"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        self._by_hash.setdefault(hash_file(path), path)
+                        extracted = extract_title(path)
+                    except Exception as e:
+                        logger.debug(f"PDFを読み込めません: {path}: {e}")
+                        continue
+                    if extracted:
+                        self._by_title.setdefault(_comparable_title(extracted["title"]), path)
+        logger.info(f"元PDFの候補: {len(self._by_hash)} 件 ({', '.join(self.directories)})")
+
+    def find(self, input_hash: Optional[str], title: Optional[str]) -> Optional[Tuple[str, str]]:
+        """一致したPDFの (パス, ハッシュ)。見つからなければ None"""
+        if not self.directories:
+            return None
+        with self._lock:
+            if self._by_hash is None:
+                self._build()
+        if input_hash and input_hash in self._by_hash:
+            return self._by_hash[input_hash], input_hash
+        key = _comparable_title(title or "")
+        if key and key in self._by_title:
+            path = self._by_title[key]
+            return path, hash_file(path)
+        return None
+
+class BackfillStore:
+    """
+    補完処理の進捗（SQLite）
+
+    生成済みのセクションと追加済みのブロック数をページごとに記録し、
+    中断した補完は再生成せずに書き込みから再開する。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.BACKFILL_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS backfill_pages (
+                    page_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    sections TEXT,
+                    blocks_written INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            yield conn
+
+    def get(self, page_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM backfill_pages WHERE page_id = ?", (page_id,)).fetchone()
+        if not row:
+            return None
+        record = dict(row)
+        if record["sections"]:
+            record["sections"] = json.loads(record["sections"])
+        return record
+
+    def save(self, page_id: str, state: str, sections: Optional[Dict[str, Any]] = None,
+             blocks_written: int = 0, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO backfill_pages "
+                "(page_id, state, sections, blocks_written, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (page_id, state, json.dumps(sections, ensure_ascii=False) if sections is not None else None,
+                 blocks_written, error, datetime.now().isoformat(timespec="seconds"))
+            )
+
+class SectionBackfiller:
+    """
+    column_configs に後から追加した列を既存のページに補完する
+
+    ページごとに不足しているセクションだけを生成し、該当するプロパティの更新と
+    末尾へのブロック追加のみを行う。元のPDFはジョブストアの入力ハッシュからPDFキャッシュを引いて使い、
+    キャッシュにない場合は pdf_dirs 内のPDFをハッシュ・タイトルで探す。
+    """
+
+    def __init__(self, targets: Optional[List[str]] = None, concurrency: int = 4,
+                 pdf_dirs: Optional[List[str]] = None):
+        self.targets = targets
+        self.concurrency = concurrency
+        if pdf_dirs is None:
+            pdf_dirs = config.BACKFILL_PDF_DIRS or [config.PAPERS_DIR, config.WATCH_DIR]
+        self.local_pdfs = LocalPdfIndex(pdf_dirs)
+        self.writer = NotionSummaryWriter(config)
+        self.exporter = NotionExporter(self.writer.notion, self.writer.database_id, concurrency)
+        self.job_store = get_job_store()
+        self.pdf_cache = get_pdf_cache()
+        self.store = BackfillStore()
+
+    def _request(self, call, **kwargs):
+        self.exporter.quota.acquire(NOTION_QUOTA_KEY)
+        return call(**kwargs)
+
+    def _targets_for(self, job: Optional[Dict[str, Any]]) -> List[str]:
+        if self.targets:
+            return self.targets
+        # 指定がなければ元の要約モードで生成されるはずのセクション
+        summary_mode = (job or {}).get("summary_mode") or "concise"
+        return [name for name in config.column_configs if name in get_needed_sections(summary_mode)]
+
+    def _missing_for(self, page: Dict[str, Any], targets: List[str]) -> List[str]:
+        headings = None
+        if any(not config.column_configs[name].get("database_property", False) for name in targets):
+            blocks = self.exporter.fetch_blocks(page["id"], recursive=False)
+            headings = {
+                "".join(t.get("plain_text", "") for t in block["heading_2"]["rich_text"])
+                for block in blocks if block.get("type") == "heading_2"
+            }
+        return find_missing_sections(page, headings, targets)
+
+    def _find_source(self, page: Dict[str, Any], job: Optional[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+        """元PDFの (パス, ハッシュ)。PDFキャッシュ → pdf_dirs の順に探す"""
+        input_hash = (job or {}).get("input_hash")
+        if input_hash:
+            pdf_path = self.pdf_cache.pdf_path(input_hash)
+            if pdf_path:
+                return pdf_path, input_hash
+        title = properties_to_sections(page.get("properties", {})).get("Name")
+        found = self.local_pdfs.find(input_hash, title)
+        if found:
+            logger.info(f"PDFキャッシュにない元PDFをフォルダから取得: {page['id']} {found[0]}")
+            # 次回以降はキャッシュから使う
+            self.pdf_cache.store_pdf(*found)
+        return found
+
+    def _write(self, page_id: str, sections: Dict[str, Any], blocks_written: int):
+        properties = self.writer._create_notion_properties(sections, columns=sections.keys())
+        if properties and blocks_written == 0:
+            self._request(self.writer.notion.pages.update, page_id=page_id, properties=properties)
+            self.writer._register_keywords(properties)
+
+        blocks = []
+        for column, content in sections.items():
+            if column not in PROPERTY_ONLY_SECTIONS:
+                blocks.extend(self.writer._section_blocks(column, content))
+        chunks = pack_chunks(blocks)
+        # blocks_written: 0 = 未着手、1 = プロパティ更新済み、n + 1 = n チャンク追加済み
+        self.store.save(page_id, "writing", sections, max(blocks_written, 1))
+        for index in range(max(blocks_written - 1, 0), len(chunks)):
+            self._request(self.writer.notion.blocks.children.append, block_id=page_id, children=chunks[index])
+            self.store.save(page_id, "writing", sections, index + 2)
+
+    def backfill_page(self, page: Dict[str, Any], dry_run: bool = False) -> Dict[str, Any]:
+        """1ページ分を補完して結果を返す"""
+        page_id = page["id"]
+        result = {"page_id": page_id, "sections": []}
+        try:
+            progress = self.store.get(page_id)
+            job = self.job_store.find_job_by_page(page_id)
+
+            if progress and progress["state"] in ("generated", "writing") and not dry_run:
+                # 生成済み（書き込み中に中断された）
+                sections = progress["sections"]
+                blocks_written = progress["blocks_written"]
+            else:
+                missing = self._missing_for(page, self._targets_for(job))
+                result["sections"] = missing
+                if not missing:
+                    result["status"] = "complete"
+                    return result
+                if dry_run:
+                    result["status"] = "missing"
+                    return result
+
+                source = self._find_source(page, job)
+                if not source:
+                    error = ("元のPDFが見つかりません（PDFキャッシュになく、"
+                             f"{', '.join(self.local_pdfs.directories) or 'PDFを探すフォルダの指定なし'} にも一致するPDFがありません）")
+                    self.store.save(page_id, "skipped", error=error)
+                    result["status"] = "no_source"
+                    result["error"] = error
+                    return result
+
+                pdf_path, input_hash = source
+                job = job or {}
+                logger.info(f"不足セクションを生成: {page_id} {missing}")
+                generated = get_summary(pdf_path, job.get("model_name"), job.get("summary_mode") or "concise",
+                                        job.get("pdf_mode") or "text", sections_to_generate=missing,
+                                        input_hash=input_hash)
+                sections = {name: generated[name] for name in missing if generated and name in generated}
+                if not sections:
+                    self.store.save(page_id, "failed", error="セクションの生成に失敗しました")
+                    result["status"] = "failed"
+                    return result
+                self.store.save(page_id, "generated", sections)
+                blocks_written = 0
+
+            result["sections"] = list(sections)
+            self._write(page_id, sections, blocks_written)
+            self.store.save(page_id, "done", sections, blocks_written=0)
+
+            # ジョブの記録と検索インデックスにも反映
+            if job and job.get("sections"):
+                self.job_store.update_job(job["id"], sections={**job["sections"], **sections})
+            try:
+                get_search_index().merge(page_id, sections)
+            except Exception as index_error:
+                logger.warning(f"検索インデックスの更新に失敗: {index_error}")
+
+            result["status"] = "filled"
+            return result
+
+        except Exception as e:
+            logger.error(f"ページの補完に失敗: {page_id}: {e}")
+            progress = self.store.get(page_id)
+            if progress and progress["state"] in ("generated", "writing"):
+                # 生成済みのセクションは残し、次回は書き込みから再開する
+                self.store.save(page_id, progress["state"], progress["sections"],
+                                progress["blocks_written"], error=str(e))
+            else:
+                self.store.save(page_id, "failed", error=str(e))
+            result["status"] = "failed"
+            result["error"] = str(e)
+            return result
+
+    def run(self, dry_run: bool = False, limit: Optional[int] = None) -> Counter:
+        """全ページを並列に補完し、結果の件数を返す"""
+        counts = Counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+
+            def collect(future):
+                result = future.result()
+                counts[result["status"]] += 1
+                if result["status"] != "complete":
+                    logger.info(f"{result['page_id']}: {result['status']} {result['sections']}")
+
+            for number, page in enumerate(self.exporter.iter_pages()):
+                if limit is not None and number >= limit:
+                    break
+                pending.add(executor.submit(self.backfill_page, page, dry_run))
+                if len(pending) >= self.concurrency * 4:
+                    done = next(as_completed(pending))
+                    pending.remove(done)
+                    collect(done)
+            for future in as_completed(pending):
+                collect(future)
+        if counts["no_source"]:
+            logger.warning(f"元のPDFが見つからないページが {counts['no_source']} 件あります。"
+                           f"PDFを置いたフォルダを --pdf-dir（BACKFILL_PDF_DIRS）で指定すると補完できます")
+        return counts
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="既存のNotionページに不足しているセクションを補完する")
+    parser.add_argument("--sections", nargs="+", choices=list(config.column_configs),
+                        help="補完するセクション（省略時は各ページの要約モードで生成されるはずのセクション）")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, help="処理するページ数の上限")
+    parser.add_argument("--dry-run", action="store_true", help="不足しているセクションを表示するだけ")
+    parser.add_argument("--pdf-dir", action="append", dest="pdf_dirs",
+                        help="PDFキャッシュにない元PDFを探すフォルダ（複数指定可。省略時は BACKFILL_PDF_DIRS、"
+                             "未設定なら PAPERS_DIR と WATCH_DIR）")
+    args = parser.parse_args()
+
+    counts = SectionBackfiller(args.sections, args.concurrency, args.pdf_dirs).run(args.dry_run, args.limit)
+    print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
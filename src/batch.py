@@ -0,0 +1,114 @@
+from . import config
+from .add_notion import NotionSummaryWriter, remove_job_file
+from .job_store import get_job_store
+from .memory_budget import estimate_job_memory_mb
+from .scheduler import estimate_job_cost, get_scheduler
+import functools
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 完了・失敗・取り消し以外はすべて処理中として扱う
+TERMINAL_STATES = ("completed", "failed", "cancelled")
+
+_writer: Optional[NotionSummaryWriter] = None
+_lock = threading.Lock()
+
+def _get_writer() -> NotionSummaryWriter:
+    """バッチ全体で共有する書き込み用オブジェクト（Notionの接続とキーワードのキャッシュを使い回す）"""
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = NotionSummaryWriter(config, job_store=get_job_store())
+        return _writer
+
+def run_job(job_id: str, pdf_path: str, model_name: Optional[str], summary_mode: str, pdf_mode: str):
+    try:
+        _get_writer().add_summary(pdf_path, model_name, summary_mode, pdf_mode, job_id=job_id)
+    except Exception as e:
+        logger.error(f"バッチのジョブでエラーが発生: {job_id}: {e}")
+        get_job_store().update_job(job_id, state="failed", error=str(e))
+    finally:
+        remove_job_file(pdf_path)
+
+def submit_batch(files: List[Tuple[str, str, str]], model_name: Optional[str],
+                 summary_mode: str, pdf_mode: str, papers_dir: str, submitter: str = "anonymous") -> str:
+    """
+    保存済みのPDFをまとめて登録し、重複を除いてからバックグラウンドのジョブとしてスケジューラに投入する
+
+    Args:
+        files: (ファイル名, 一時ファイルのパス, ハッシュ値) のリスト
+        papers_dir: ジョブのPDFを保存するディレクトリ
+        submitter: 投入者（スケジューラが投入者の間で処理を公平に分ける）
+
+    Returns:
+        str: バッチID
+    """
+    store = get_job_store()
+    items: List[Dict[str, Any]] = []
+    jobs_by_hash: Dict[str, str] = {}
+    to_run = []
+
+    # 処理を始める前に全ファイルの重複を判定する
+    for filename, upload_path, input_hash in files:
+        if input_hash in jobs_by_hash:
+            items.append({"filename": filename, "job_id": jobs_by_hash[input_hash], "duplicate": "batch"})
+            os.remove(upload_path)
+            continue
+        existing = store.find_job_by_hash(input_hash, summary_mode)
+        if existing:
+            jobs_by_hash[input_hash] = existing["id"]
+            items.append({"filename": filename, "job_id": existing["id"], "duplicate": "history"})
+            os.remove(upload_path)
+            continue
+
+        job_id = store.create_job(filename, input_hash, model_name, summary_mode, pdf_mode, submitter=submitter)
+        pdf_path = os.path.join(papers_dir, f"{job_id}.pdf")
+        os.replace(upload_path, pdf_path)
+        store.update_job(job_id, pdf_path=pdf_path)
+        jobs_by_hash[input_hash] = job_id
+        items.append({"filename": filename, "job_id": job_id, "duplicate": None})
+        to_run.append((job_id, pdf_path, estimate_job_cost(pdf_path, summary_mode, input_hash)))
+
+    batch_id = store.create_batch(items)
+    logger.info(f"バッチを登録: {batch_id} ({len(files)} ファイル, 処理対象 {len(to_run)} 件)")
+
+    scheduler = get_scheduler()
+    for job_id, pdf_path, cost in to_run:
+        scheduler.submit(
+            functools.partial(run_job, job_id, pdf_path, model_name, summary_mode, pdf_mode),
+            summary_mode=summary_mode, submitter=submitter, cost=cost, label=job_id,
+            memory_mb=estimate_job_memory_mb(pdf_path)
+        )
+    return batch_id
+
+def get_batch_status(batch_id: str) -> Optional[Dict[str, Any]]:
+    """バッチ内のファイルごとの状態"""
+    store = get_job_store()
+    batch = store.get_batch(batch_id)
+    if batch is None:
+        return None
+
+    files = []
+    for item in batch["items"]:
+        job = store.get_job(item["job_id"]) or {}
+        files.append({
+            "filename": item["filename"],
+            "job_id": item["job_id"],
+            "duplicate": item["duplicate"],
+            "state": job.get("state", "failed"),
+            "error": job.get("error"),
+            "cancel_requested": bool(job.get("cancel_requested")),
+            "notion_page_id": job.get("notion_page_id"),
+            "total_input": (job.get("token_info") or {}).get("total_input"),
+            "pdf_mode": (job.get("process_info") or {}).get("pdf_mode") or job.get("pdf_mode"),
+        })
+    return {
+        "id": batch["id"],
+        "created_at": batch["created_at"],
+        "files": files,
+        "done": all(f["state"] in TERMINAL_STATES for f in files),
+    }
@@ -0,0 +1,130 @@
+from . import config
+import json
+import math
+from typing import Any, Dict, List
+
+# Notion APIの制限
+MAX_RICH_TEXT_ITEMS = 100  # rich_text 配列の要素数
+MAX_TEXT_CONTENT = 2000  # text.content の文字数
+MAX_CHILDREN_PER_REQUEST = 100  # 1リクエストの children（最上位）の数
+MAX_BLOCKS_PER_REQUEST = 1000  # 1リクエストに含まれるブロックの総数（入れ子を含む）
+
+# 従来の分割単位（パッキング前のAPI呼び出し数の算出に使う）
+LEGACY_CHUNK_SIZE = 90
+
+def _split_text_item(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """2000文字を超えるテキスト要素を分割する（装飾は引き継ぐ）"""
+    if item.get("type", "text") != "text":
+        return [item]
+    content = item["text"]["content"]
+    if len(content) <= MAX_TEXT_CONTENT:
+        return [item]
+    return [
+        {**item, "text": {**item["text"], "content": content[i:i + MAX_TEXT_CONTENT]}}
+        for i in range(0, len(content), MAX_TEXT_CONTENT)
+    ]
+
+def normalize_rich_text(rich_text: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [part for item in rich_text for part in _split_text_item(item)]
+
+def _paragraph(rich_text: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"object": "block", "type": "paragraph", "paragraph": {"rich_text": rich_text}}
+
+def merge_paragraphs(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    連続する段落を、改行を挟んだ1つの段落（複数のrich_text要素）にまとめる
+
+    1ブロックのrich_textが100要素を超えないように区切る。
+    """
+    merged: List[Dict[str, Any]] = []
+    current: List[Dict[str, Any]] = []
+
+    for block in blocks:
+        if block.get("type") != "paragraph" or block.get("children"):
+            if current:
+                merged.append(_paragraph(current))
+                current = []
+            merged.append(block)
+            continue
+
+        rich_text = normalize_rich_text(block["paragraph"]["rich_text"])
+        separator = 1 if current else 0
+        if current and len(current) + separator + len(rich_text) > MAX_RICH_TEXT_ITEMS:
+            merged.append(_paragraph(current))
+            current, separator = [], 0
+        if separator:
+            current.append({"type": "text", "text": {"content": "\n"}})
+        current.extend(rich_text)
+        # 1段落だけで上限を超える場合はそのまま分割する
+        while len(current) > MAX_RICH_TEXT_ITEMS:
+            merged.append(_paragraph(current[:MAX_RICH_TEXT_ITEMS]))
+            current = current[MAX_RICH_TEXT_ITEMS:]
+
+    if current:
+        merged.append(_paragraph(current))
+    return merged
+
+def pack_section(heading: str, content: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    セクション1つ分のブロックを作る
+
+    段落をまとめた後もブロック数が NOTION_TOGGLE_MIN_BLOCKS 以上のセクションは、
+    本文をトグル見出しの子ブロックにして最上位のブロック数を減らす。
+    """
+    content = merge_paragraphs(content)
+    heading_text = [{"text": {"content": heading}}]
+    # 子ブロックは見出しと同じリクエストで送るため、1リクエストに収まる場合のみトグルにする
+    fits_in_request = (len(content) <= MAX_CHILDREN_PER_REQUEST
+                       and sum(_payload_bytes(block) for block in content) <= config.NOTION_MAX_REQUEST_BYTES)
+    if len(content) >= config.NOTION_TOGGLE_MIN_BLOCKS and fits_in_request:
+        return [{
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {"rich_text": heading_text, "is_toggleable": True, "children": content},
+        }]
+    return [
+        {"object": "block", "type": "heading_2", "heading_2": {"rich_text": heading_text}},
+        *content,
+        {"object": "block", "type": "divider", "divider": {}},
+    ]
+
+def count_blocks(block: Dict[str, Any]) -> int:
+    """入れ子の子ブロックを含めたブロック数"""
+    children = block.get(block.get("type"), {}).get("children", [])
+    return 1 + sum(count_blocks(child) for child in children)
+
+def _payload_bytes(block: Dict[str, Any]) -> int:
+    return len(json.dumps(block, ensure_ascii=False).encode("utf-8"))
+
+def pack_chunks(blocks: List[Dict[str, Any]], first_chunk_overhead: int = 0) -> List[List[Dict[str, Any]]]:
+    """
+    ブロックを1リクエストあたりの上限（最上位のブロック数・総ブロック数・ペイロードのバイト数）
+    いっぱいまで詰めて分割する
+
+    Args:
+        first_chunk_overhead: 最初のリクエスト（ページ作成）に含まれるプロパティなどのバイト数
+    """
+    chunks: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_blocks = 0
+    current_bytes = first_chunk_overhead
+
+    for block in blocks:
+        size = _payload_bytes(block)
+        nested = count_blocks(block)
+        if current and (len(current) + 1 > MAX_CHILDREN_PER_REQUEST
+                        or current_blocks + nested > MAX_BLOCKS_PER_REQUEST
+                        or current_bytes + size > config.NOTION_MAX_REQUEST_BYTES):
+            chunks.append(current)
+            current, current_blocks, current_bytes = [], 0, 0
+        current.append(block)
+        current_blocks += nested
+        current_bytes += size
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+def legacy_call_count(block_count: int) -> int:
+    """パッキング前（1行1ブロック・90ブロックごとに分割）のAPI呼び出し数"""
+    return max(1, math.ceil(block_count / LEGACY_CHUNK_SIZE))
@@ -1,57 +1,79 @@
-import PyPDF2
 import google.generativeai as genai
 from . import config
+from .pdf_analysis import resolve_pdf_mode
+from .model_router import ModelRouter, get_section_tier
+from .job_store import hash_file
+from .pdf_cache import get_pdf_cache
+from .pdf_stream import extract_text, write_text
+from .memory_budget import estimate_job_memory_mb, get_memory_budget
+from . import replay
+from .job_context import JobCancelled, JobContext
+from .title_extraction import generate_local_name
 import logging
+import os
 import re
-from typing import Union, Any
+from typing import Union, Any, Optional
 
 logger = logging.getLogger(__name__)
 
 # Configure Google Gemini
 genai.configure(api_key=config.GOOGLE_API_KEY)
 
-def get_model(model_name=None):
-    """モデルのインスタンスを取得"""
-    model_name = model_name or config.GOOGLE_MODEL
-    try:
-        return genai.GenerativeModel(model_name=model_name)
-    except Exception as e:
-        logger.error(f"モデルの初期化に失敗: {e}")
-        return None
-
-def get_pdf_content(pdf_path: str, mode: str = "text") -> Union[str, Any]:
+def get_pdf_content(pdf_path: str, mode: str = "text", context: Optional[JobContext] = None,
+                    digest: Optional[str] = None) -> Union[str, Any]:
     """
     PDFの内容を取得（モードに応じて処理方法を変更）
     
     Args:
         pdf_path: PDFファイルのパス
-        mode: 処理モード ("text" or "full")
+        mode: 処理モード ("text" or "full")。"auto" は get_summary 側で解決済みであること
+        context: ジョブの取り消し状態。新たにアップロードしたファイルは取り消し時に削除する
+        digest: PDFのハッシュ（計算済みの場合。省略時はここで計算する）
     
     Returns:
         str: テキストモードの場合は抽出されたテキスト
         Any: PDF全体モードの場合はGemini File APIのアップロード結果
+
+    抽出テキストとアップロードはPDFのハッシュごとにキャッシュし、同じPDFの再処理では使い回す。
     """
+    digest = digest or hash_file(pdf_path)
+    cache = get_pdf_cache()
+    cache.store_pdf(pdf_path, digest)
+
     if mode == "text":
         # テキストのみモード
-        with open(pdf_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page_num in range(len(reader.pages)):
-                text += reader.pages[page_num].extract_text()
+        text = cache.get_text(digest)
+        if text is None:
+            # ページごとにキャッシュのファイルへ書き出し、全文は送信用に最後に1回だけ読み込む
+            cache.put_text(digest, lambda file: write_text(pdf_path, file))
+            text = cache.get_text(digest)
+        if text is None:
+            # キャッシュの上限より大きく、書き込み直後に削除された
+            text = extract_text(pdf_path)
         return text
     else:
         # PDF全体モード
-        return genai.upload_file(pdf_path)
+        upload_name = cache.get_upload_name(digest)
+        if upload_name:
+            try:
+                return replay.get_file(upload_name)
+            except Exception as e:
+                logger.info(f"キャッシュ済みのアップロードを取得できないため再アップロード: {e}")
+        uploaded = replay.upload_file(pdf_path)
+        cache.put_upload(digest, uploaded)
+        if context:
+            def delete_upload():
+                # 別のジョブが使い回している場合はリモートのファイルを残す（有効期限で消える）
+                if cache.release_upload(digest, uploaded.name):
+                    replay.delete_file(uploaded.name)
+                else:
+                    logger.info(f"アップロードは他のジョブと共有されているため削除しません: {uploaded.name}")
+            context.add_cleanup(f"アップロードしたファイルを削除 ({uploaded.name})", delete_upload)
+        return uploaded
 
 def read_pdf(file_path):
     """PDFファイルからテキストを抽出（レガシー）"""
-    with open(file_path, "rb") as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            text += page.extract_text()
-    return text
+    return extract_text(file_path)
 
 def create_prompt(sections_to_generate=None, is_title_only=False):
     """マークダウン形式のプロンプトを作成"""
@@ -118,42 +140,92 @@ def extract_sections_from_markdown(text, needed_sections=None):
     
     return sections
 
-def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="text"):
-    model = get_model(model_name)
-    if not model:
-        return None
+def get_needed_sections(summary_mode="concise"):
+    """要約モードで生成するセクション"""
+    return {
+        name for name, cfg in config.column_configs.items()
+        if (summary_mode == "detailed" or cfg.get("required", False))
+    }
+
+def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="text",
+                sections_to_generate=None, context: Optional[JobContext] = None,
+                input_hash: Optional[str] = None):
+    """
+    PDFを要約してセクションごとのマークダウンを返す
+
+    sections_to_generate を指定した場合はそのセクションだけを生成する（既存ページの列の補完用）。
+    input_hash にジョブ登録時に計算したPDFのハッシュを渡すと、キャッシュの参照で再計算しない。
+    同時に処理するジョブのメモリ合計が上限を超えないよう、予約できるまで待ってから開始する。
+    context を指定した場合、取り消し・期限切れで JobCancelled を送出する。
+    """
+    memory_mb = estimate_job_memory_mb(pdf_path)
+    with get_memory_budget().reserve(memory_mb, os.path.basename(pdf_path), context):
+        return _generate_summary(pdf_path, model_name, summary_mode, pdf_mode, sections_to_generate, context,
+                                 input_hash)
+
+def _generate_summary(pdf_path, model_name, summary_mode, pdf_mode, sections_to_generate, context, input_hash):
+    # セクションごとのモデル割り当てとフォールバックはルーターに任せる
+    router = ModelRouter(model_name, context=context)
 
     try:
-        pdf_content = get_pdf_content(pdf_path, pdf_mode)
+        # 必要なセクションを特定
+        if sections_to_generate:
+            needed_sections = set(sections_to_generate) & set(config.column_configs)
+        else:
+            needed_sections = get_needed_sections(summary_mode)
+
+        # autoモードの場合はPDFを解析して処理モードを決定
+        pdf_mode_reasons = []
+        if pdf_mode == "auto":
+            pdf_mode, pdf_mode_reasons = resolve_pdf_mode(pdf_path, needed_sections)
+
+        # キャッシュのキーはジョブ全体で1回だけ計算する
+        digest = input_hash or hash_file(pdf_path)
+        pdf_content = get_pdf_content(pdf_path, "full" if pdf_mode == "full" else "text", context, digest)
         sections = {}
         token_counts = {}
+
+        # hybridモードでは図表が必要なセクションのみPDF全体を使用
+        figure_sections = set()
+        if pdf_mode == "hybrid":
+            figure_sections = {
+                name for name in needed_sections
+                if config.column_configs[name].get("needs_figures", False)
+            }
+        figure_content = get_pdf_content(pdf_path, "full", context, digest) if figure_sections else None
+
+        def content_for(section):
+            return figure_content if section in figure_sections else pdf_content
         
         # トークンカウント用のヘルパー関数
-        def count_input_tokens(content_list):
-            count_response = model.count_tokens(content_list)
-            return count_response.total_tokens
-
-        # 必要なセクションを特定
-        needed_sections = {
-            name for name, cfg in config.column_configs.items()
-            if (summary_mode == "detailed" or cfg.get("required", False))
-        }
+        def count_input_tokens(content_list, tier="strong"):
+            return router.count_tokens(content_list, tier)
 
         # process_first フラグのあるセクションを先に処理
         priority_sections = {
             name for name in needed_sections 
             if config.column_configs[name].get("process_first", False)
         }
-        regular_sections = needed_sections - priority_sections
+        regular_sections = needed_sections - priority_sections - figure_sections
 
         # 優先セクションの処理
+        title_extraction = None
         for section in priority_sections:
+            if section == "Name" and config.TITLE_LOCAL_EXTRACTION:
+                # タイトルはローカルで抽出して翻訳だけを依頼し、PDF全体を送る呼び出しを省く
+                name, title_extraction = generate_local_name(pdf_path, router)
+                if name:
+                    sections[section] = name
+                    continue
+
             prompt = create_prompt([section])
-            tokens = count_input_tokens([pdf_content, prompt])
+            tokens = count_input_tokens([pdf_content, prompt], get_section_tier([section]))
             # トークンカウントのキーを修正
             token_counts["name" if section == "Name" else section.lower()] = tokens
             
-            response = model.generate_content([pdf_content, prompt])
+            response = router.generate(
+                [pdf_content, prompt], get_section_tier([section]), section, input_tokens=tokens
+            )
             result = extract_sections_from_markdown(response.text, [section])
             
             if result and section in result:
@@ -165,15 +237,33 @@ def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="tex
         # 残りのセクションを一括処理
         if regular_sections:
             main_prompt = create_prompt(regular_sections)
-            main_tokens = count_input_tokens([pdf_content, main_prompt])
+            main_tokens = count_input_tokens([pdf_content, main_prompt], get_section_tier(regular_sections))
             token_counts["main_content"] = main_tokens
             
-            main_response = model.generate_content([pdf_content, main_prompt])
+            main_response = router.generate(
+                [pdf_content, main_prompt], get_section_tier(regular_sections), "main_content",
+                input_tokens=main_tokens
+            )
             main_sections = extract_sections_from_markdown(main_response.text, regular_sections)
             
             if main_sections:
                 sections.update(main_sections)
 
+        # 図表セクションはPDF全体を使って別途処理
+        if figure_sections:
+            figure_prompt = create_prompt(figure_sections)
+            figure_tokens = count_input_tokens([figure_content, figure_prompt], get_section_tier(figure_sections))
+            token_counts["figures"] = figure_tokens
+
+            figure_response = router.generate(
+                [figure_content, figure_prompt], get_section_tier(figure_sections), "figures",
+                input_tokens=figure_tokens
+            )
+            figure_results = extract_sections_from_markdown(figure_response.text, figure_sections)
+
+            if figure_results:
+                sections.update(figure_results)
+
         # 不足しているセクションを特定
         missing_sections = needed_sections - set(sections.keys())
 
@@ -191,7 +281,11 @@ def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="tex
                 for attempt in range(max_attempts):
                     try:
                         section_prompt = create_prompt([missing_section])
-                        response = model.generate_content([pdf_content, section_prompt])
+                        response = router.generate(
+                            [content_for(missing_section), section_prompt],
+                            get_section_tier([missing_section]),
+                            missing_section
+                        )
                         section_result = extract_sections_from_markdown(
                             response.text, 
                             needed_sections=[missing_section]
@@ -203,6 +297,8 @@ def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="tex
                             break
                         else:
                             logger.warning(f"セクション {missing_section} の再取得に失敗 (試行 {attempt + 1}/{max_attempts})")
+                    except JobCancelled:
+                        raise
                     except Exception as e:
                         logger.warning(f"セクション {missing_section} の生成エラー (試行 {attempt + 1}/{max_attempts}): {e}")
 
@@ -226,7 +322,11 @@ def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="tex
 
         # トークン数情報を追加
         sections['_debug_info'] = {
-            'token_counts': token_counts
+            'token_counts': token_counts,
+            'pdf_mode': pdf_mode,
+            'pdf_mode_reasons': pdf_mode_reasons,
+            'model_usage': router.usage,
+            'title_extraction': title_extraction
         }
 
         # 必須セクションの確認
@@ -241,6 +341,8 @@ def get_summary(pdf_path, model_name=None, summary_mode="concise", pdf_mode="tex
 
         return sections
 
+    except JobCancelled:
+        raise
     except Exception as e:
         logger.error(f"An error occurred with Gemini: {e}")
         return None
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import json
 import os
 
 # Load environment variables from .env file
@@ -14,6 +15,127 @@ database_id = os.getenv('NOTION_DATABASE_ID')
 if not all([GOOGLE_API_KEY, NOTION_API_KEY, database_id]):
     raise ValueError("Missing required environment variables. Please check your .env file.")
 
+# 選択可能なモデル
+AVAILABLE_MODELS = ["gemini-1.5-pro-002", "gemini-1.5-flash-002", "gemini-2.0-flash-exp"]
+# 要約モードとPDF処理モード
+SUMMARY_MODES = ("concise", "detailed")
+PDF_MODES = ("text", "full", "auto")
+
+# モデルのルーティング設定（階層 -> 優先するモデル候補）
+# 空リストの場合はユーザーが選択したモデルを使用する
+MODEL_ROUTING = {
+    "fast": [m for m in os.getenv('FAST_MODELS', 'gemini-1.5-flash-002').split(',') if m],
+    "strong": [m for m in os.getenv('STRONG_MODELS', '').split(',') if m],
+}
+# 429・クォータ超過・タイムアウト時のフォールバック先（優先順）
+MODEL_FALLBACKS = [m for m in os.getenv('MODEL_FALLBACKS', 'gemini-1.5-flash-002,gemini-2.0-flash-exp').split(',') if m]
+MODEL_COOLDOWN_SECONDS = int(os.getenv('MODEL_COOLDOWN_SECONDS', '60'))  # クォータ切れモデルを後回しにする時間
+MODEL_MIN_SUCCESS_RATE = float(os.getenv('MODEL_MIN_SUCCESS_RATE', '0.5'))
+MODEL_MIN_CALLS_FOR_STATS = int(os.getenv('MODEL_MIN_CALLS_FOR_STATS', '5'))
+MODEL_LATENCY_EWMA_ALPHA = 0.3
+GEMINI_TIMEOUT_SECONDS = float(os.getenv('GEMINI_TIMEOUT_SECONDS', '600'))  # generate_content 1回のタイムアウト
+GEMINI_COUNT_TOKENS_TIMEOUT_SECONDS = 60
+NOTION_TIMEOUT_SECONDS = float(os.getenv('NOTION_TIMEOUT_SECONDS', '60'))  # Notion APIの1リクエストのタイムアウト
+
+# ジョブの期限と取り消し
+JOB_TIMEOUT_SECONDS = float(os.getenv('JOB_TIMEOUT_SECONDS', '1800'))  # 1ジョブ（要約〜Notionへの書き込み）の期限（0で無期限）
+JOB_SUMMARY_TIME_SHARE = 0.8  # 期限のうち要約の生成に使える割合（残りはNotionへの書き込み用）
+JOB_CANCEL_POLL_SECONDS = 1.0  # 別ワーカーからの取り消し要求を確認する間隔
+DISCONNECT_POLL_SECONDS = 1.0  # クライアントの切断を確認する間隔
+
+# ローカルの状態保存先（クォータ・ジョブなど、プロセス間で共有する情報）
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+QUOTA_DB_PATH = os.path.join(DATA_DIR, 'quota.sqlite3')
+JOB_DB_PATH = os.path.join(DATA_DIR, 'jobs.sqlite3')
+ROUTING_DB_PATH = os.path.join(DATA_DIR, 'routing.sqlite3')
+SEARCH_DB_PATH = os.path.join(DATA_DIR, 'search.sqlite3')
+PAPERS_DIR = os.getenv('PAPERS_DIR', 'src/papers')  # アップロードされたPDFの一時保存先
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))  # バックグラウンドのジョブ（複数ファイルのアップロード・中断したジョブの再開）を同時に処理する数（ワーカーごと）
+ORPHAN_SWEEP_SECONDS = float(os.getenv('ORPHAN_SWEEP_SECONDS', '60'))  # 担当ワーカーが終了したジョブを探して再開する間隔（0で起動時のみ）
+
+# ジョブのスケジューリング（ワーカーごと）
+SCHEDULER_INTERACTIVE_SLOTS = int(os.getenv('SCHEDULER_INTERACTIVE_SLOTS', '2'))  # 画面で結果を待つジョブ専用に空けておくスレッド数
+# 要約モードごとの重み（処理量の配分比）。SCHEDULER_WEIGHTS にJSONを指定すると上書きできる
+SCHEDULER_WEIGHTS = {"concise": 4.0, "detailed": 1.0}
+SCHEDULER_WEIGHTS.update(json.loads(os.getenv('SCHEDULER_WEIGHTS', '{}')))
+SCHEDULER_OUTPUT_TOKEN_WEIGHT = 4  # コスト見積もりで出力トークンを入力トークンの何倍とみなすか
+SUBMITTER_HEADER = os.getenv('SUBMITTER_HEADER', '')  # 投入者を識別するヘッダー（例: X-Forwarded-User）。未設定の場合は接続元のIPアドレス
+SCHEDULER_DB_PATH = os.path.join(DATA_DIR, 'scheduler.sqlite3')
+SCHEDULER_METRICS_WINDOW_SECONDS = 3600  # 待ち時間の統計の対象期間
+SCHEDULER_METRICS_RETENTION_SECONDS = 86400
+# 入力PDF・抽出テキスト・Geminiアップロードのキャッシュ（列を追加したときの再生成に使う）
+PDF_CACHE_DIR = os.path.join(DATA_DIR, 'pdf_cache')
+PDF_CACHE_KEEP_PDF = os.getenv('PDF_CACHE_KEEP_PDF', 'true').lower() == 'true'
+PDF_CACHE_MAX_MB = float(os.getenv('PDF_CACHE_MAX_MB', '2048'))  # PDFと抽出テキストの合計の上限。超えたら最後に使ったのが古いものから削除する
+BACKFILL_DB_PATH = os.path.join(DATA_DIR, 'backfill.sqlite3')
+# PDFキャッシュにない（キャッシュ導入前・削除済みの）ページの元PDFを探すフォルダ（カンマ区切り）
+BACKFILL_PDF_DIRS = [d for d in os.getenv('BACKFILL_PDF_DIRS', '').split(',') if d]
+
+# メモリ使用量の制御
+# 保存済みPDFは必要な部分だけを読み、テキストは1ページずつ抽出してPDFキャッシュのファイルへ書き出す
+MEMORY_DB_PATH = os.path.join(DATA_DIR, 'memory.sqlite3')
+MEMORY_LIMIT_MB = int(os.getenv('MEMORY_LIMIT_MB', '2048'))  # 全ワーカーで同時に処理するジョブのメモリ予約の合計（0で無制限）
+JOB_MEMORY_BUDGET_MB = int(os.getenv('JOB_MEMORY_BUDGET_MB', '512'))  # 1ジョブの予約の上限
+JOB_MEMORY_BASE_MB = 64  # 見積もりの固定分（モデル呼び出し・Notionブロックなど）
+JOB_MEMORY_PER_PDF_MB = 1.0  # PDF 1MBあたりの見積もり（1ページ分の解析済みオブジェクトと送信するテキスト）
+MEMORY_POLL_SECONDS = 0.5
+
+# Gemini・Notionの通信の記録と再生（オフラインでの性能比較・回帰確認用）
+TRAFFIC_MODE = os.getenv('TRAFFIC_MODE', 'off')  # off / record / replay
+CASSETTE_DIR = os.path.join(DATA_DIR, 'cassettes')
+TRAFFIC_CASSETTE = os.getenv('TRAFFIC_CASSETTE', 'default')  # カセット名（CASSETTE_DIR 内）またはファイルのパス
+TRAFFIC_REPLAY_LATENCY = float(os.getenv('TRAFFIC_REPLAY_LATENCY', '0'))  # 再生時に記録時の所要時間の何倍待つか（0で待たない）
+TRAFFIC_REPLAY_STRICT = os.getenv('TRAFFIC_REPLAY_STRICT', 'false').lower() == 'true'  # trueの場合はリクエストが完全に一致する記録のみ再生
+
+# 監視フォルダからの取り込み（python -m src.watch_folder）
+WATCH_DIR = os.getenv('WATCH_DIR', '')  # 監視するフォルダ（コマンドの引数で上書きできる）
+WATCH_SETTLE_SECONDS = float(os.getenv('WATCH_SETTLE_SECONDS', '5'))  # サイズと更新時刻がこの間変わらなければ書き込み完了とみなす
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '10'))  # inotify が使えない場合にディレクトリを確認する間隔
+WATCH_USE_INOTIFY = os.getenv('WATCH_USE_INOTIFY', 'true').lower() == 'true'
+WATCH_RECURSIVE = os.getenv('WATCH_RECURSIVE', 'true').lower() == 'true'  # サブフォルダも監視するか
+WATCH_MAX_PENDING = int(os.getenv('WATCH_MAX_PENDING', '8'))  # 投入済みで完了していないジョブの上限（残りのファイルはハッシュ計算もせずに待たせる）
+
+# モデルごとのレート制限（requests/min, tokens/min）。GEMINI_RATE_LIMITS にJSONを指定すると上書きできる
+GEMINI_RATE_LIMITS = {
+    "default": {"rpm": 15, "tpm": 1_000_000},
+    "gemini-1.5-pro-002": {"rpm": 2, "tpm": 32_000},
+    "gemini-1.5-flash-002": {"rpm": 15, "tpm": 1_000_000},
+    "gemini-2.0-flash-exp": {"rpm": 10, "tpm": 4_000_000},
+}
+GEMINI_RATE_LIMITS.update(json.loads(os.getenv('GEMINI_RATE_LIMITS', '{}')))
+COUNT_TOKENS_RPM = int(os.getenv('COUNT_TOKENS_RPM', '3000'))
+NOTION_RPM = int(os.getenv('NOTION_RPM', '180'))  # Notion APIの平均3リクエスト/秒の制限
+NOTION_MAX_REQUEST_BYTES = 450_000  # 1リクエストのペイロード上限（Notionの制限500KBに余裕を持たせる）
+NOTION_TOGGLE_MIN_BLOCKS = int(os.getenv('NOTION_TOGGLE_MIN_BLOCKS', '10'))  # これ以上のブロックになるセクションはトグル見出しにまとめる
+NOTION_MAX_RETRIES = int(os.getenv('NOTION_MAX_RETRIES', '5'))  # 429・5xx を受けた場合の再試行回数（エクスポート）
+NOTION_RETRY_BASE_SECONDS = 1.0  # Retry-After がない場合の待機時間（再試行ごとに倍にする）
+NOTION_RETRY_MAX_SECONDS = 60.0
+QUOTA_POLL_SECONDS = 0.2  # キューの先頭以外が状態を確認する間隔
+QUOTA_MAX_SLEEP_SECONDS = 1.0
+QUOTA_STALE_WAITER_SECONDS = 30  # これより長く応答のない待機者は異常終了とみなす
+
+# Keywords（multi_select）の既存オプションへの寄せ
+KEYWORD_TAXONOMY_CACHE_PATH = os.path.join(DATA_DIR, 'keyword_taxonomy.json')
+KEYWORD_TAXONOMY_TTL = int(os.getenv('KEYWORD_TAXONOMY_TTL', '3600'))  # 既存オプションのキャッシュ有効期間（秒）
+KEYWORD_ALLOW_NEW = os.getenv('KEYWORD_ALLOW_NEW', 'false').lower() == 'true'  # trueの場合は既存オプションに一致しないキーワードを新しいオプションとして作る（falseでは捨てる）
+# 表記の別名（正規化後に比較される）。頭字語はここに登録したものだけを同一視する
+KEYWORD_ALIASES = {
+    "llm": "Large Language Model",
+    "nlp": "Natural Language Processing",
+    "rl": "Reinforcement Learning",
+    "gnn": "Graph Neural Network",
+}
+
+# PDF処理モード "auto" の判定しきい値
+PDF_AUTO_MIN_CHARS_PER_PAGE = int(os.getenv('PDF_AUTO_MIN_CHARS_PER_PAGE', '200'))  # これ未満ならテキスト層が不十分とみなす
+PDF_AUTO_SCANNED_PAGE_CHARS = int(os.getenv('PDF_AUTO_SCANNED_PAGE_CHARS', '20'))  # これ未満の画像ページはスキャンとみなす
+PDF_AUTO_MAX_SCANNED_RATIO = float(os.getenv('PDF_AUTO_MAX_SCANNED_RATIO', '0.2'))
+PDF_AUTO_MAX_FULL_SIZE_MB = float(os.getenv('PDF_AUTO_MAX_FULL_SIZE_MB', '50'))
+
+# タイトル（Name）のローカル抽出。PDFのメタデータと1ページ目の最も大きい文字から推定し、翻訳だけをモデルに依頼する
+TITLE_LOCAL_EXTRACTION = os.getenv('TITLE_LOCAL_EXTRACTION', 'true').lower() == 'true'
+TITLE_LOCAL_MIN_CONFIDENCE = float(os.getenv('TITLE_LOCAL_MIN_CONFIDENCE', '0.7'))  # これ未満ならPDF全体を送って抽出する
+
 # 列名、プロンプト、Notionデータ型の定義
 column_configs = {
     "Name": {
@@ -36,7 +158,8 @@ Rules:
         "notion_type": "title",
         "database_property": True,
         "required": True,
-        "process_first": True  # タイトルを最初に処理することを示すフラグ
+        "process_first": True,  # タイトルを最初に処理することを示すフラグ（TITLE_LOCAL_EXTRACTION が有効な場合はまずローカルで抽出する）
+        "model_tier": "fast"  # 短い抽出タスクは高速なモデルで処理
     },
     "どんな研究？": {
         "prompt": "この研究は何を目的とし、どのような成果を上げたのか",
@@ -77,7 +200,8 @@ Rules:
         "prompt": "List 3-5 important technical keywords from the paper in English. Use commas to separate keywords. Example: deep learning, computer vision, neural networks",
         "notion_type": "multi_select",
         "database_property": True,  # データベースの列として追加
-        "required": True
+        "required": True,
+        "model_tier": "fast"
     },
     "研究の目的と背景": {
         "prompt": "研究の目的と背景を2000文字以上でまとめるためのプロンプト: <purpose> 本研究の目的について、以下の観点を踏まえて詳細に説明してください: - 研究で解決しようとしている問題や達成しようとしている目標 - 研究の意義や重要性 - 研究の新規性や独自性 </purpose> <background> 本研究の背景について、以下の観点を踏まえて詳細に説明してください: - 研究分野の現状と課題 - 関連する先行研究とその限界や問題点 - 本研究の位置づけ </background> <note> - 論文の内容に忠実に、論文に書かれていない情報や著者の意図を超えた解釈は避けてください。 - 論文から直接引用する場合は、引用部分を明示してください。 - 読み手にわかりやすい文章構成を心がけ、段落構成を適切に行い、論理的な流れを意識してください。 - 専門用語には説明を加えてください。 - 簡潔かつ明瞭な表現を使用してください。 </note>",
@@ -108,7 +232,8 @@ Rules:
         """.strip(),
         "notion_type": "rich_text",
         "database_property": False,
-        "required": False
+        "required": False,
+        "needs_figures": True  # autoモードでは図表を含むPDF全体を使って生成する
     },
     "論文内で結果の解釈や考察": {
         "prompt": "論文内で結果の解釈や考察がどのようにまとめられているかを3000文字以上でまとめるためのプロンプト: <structure> 結果の解釈や考察の全体的な構成について、以下の観点を踏まえて説明してください: - 結果の解釈や考察が論文のどの部分で行われているか - 解釈や考察の流れや論理構成 - 著者が重要視している点や強調している内容 </structure> <interpretations> 個々の結果に対する解釈や考察について、以下の観点を踏まえて詳細に説明してください: - 各結果が持つ意味や示唆についての著者の解釈 - 結果が研究の目的や仮説とどのように関連しているか - 結果の解釈が先行研究や関連分野の知見とどのように関連しているか </interpretations> <arguments> 結果の解釈や考察における著者の主張や論点について、以下の観点を踏まえて明確に述べてください: - 著者が結果から導き出した主要な主張や結論 - 著者が提示する新しい知見や洞察 - 著者が結果の解釈を通じて示唆する今後の研究の方向性 </arguments> <validity> 結果の解釈や考察の妥当性や限界について、以下の観点を踏まえて議論してください: - 著者の解釈や主張を裏付けるエビデンスの強さ - 結果の解釈における仮定や前提条件 - 結果の解釈が持つ限界や対象となる範囲 </validity> <note> - 論文の内容に忠実に、論文に明示的に書かれている解釈や考察のみを扱ってください。 - 論文に書かれていない推測や主観的な評価は避けてください。 - 必ず論文から直接引用してください。引用部分を明示してください。 - 読み手にわかりやすい文章構成を心がけ、段落構成を適切に行い、論理的な流れを意識してください。 - 専門用語には説明を加えてください。 - 著者の主張や論点を明確に伝える文章表現を使用してください。 </note>",
@@ -0,0 +1,52 @@
+from . import config
+import fcntl
+import logging
+import os
+from typing import Dict, IO
+
+logger = logging.getLogger(__name__)
+
+# 取得したロックはプロセスが終了するまで保持する
+_held_locks: Dict[str, IO] = {}
+
+def try_acquire_leadership(name: str = "startup") -> bool:
+    """
+    複数ワーカーのうち1プロセスだけがロックを取得できる
+
+    ロックはプロセスの終了（異常終了を含む）で自動的に解放されるため、
+    リーダーが落ちた場合は次に起動したワーカーが引き継ぐ。
+    """
+    if name in _held_locks:
+        return True
+    lock_dir = os.path.join(config.DATA_DIR, "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_file = open(os.path.join(lock_dir, f"{name}.lock"), "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _held_locks[name] = lock_file
+    return True
+
+def is_process_alive(pid: int) -> bool:
+    """同一ホスト上のプロセスが生存しているか"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def worker_papers_dir() -> str:
+    """ワーカーごとの一時PDF保存先（ワーカー間でファイル名が衝突しないようにする）"""
+    path = os.path.join(config.PAPERS_DIR, f"worker-{os.getpid()}")
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,53 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+BUSY_TIMEOUT_SECONDS = 30  # 他のプロセスが書き込み中の場合に待つ秒数
+
+def open_connection(db_path: str, autocommit: bool = False) -> sqlite3.Connection:
+    """
+    WALモードの接続を開く（閉じるのは呼び出し側。通常は connect() を使う）
+
+    autocommit=True の場合は暗黙のトランザクションを張らないため、BEGIN IMMEDIATE などで明示的に張る。
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None if autocommit else "")
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+@contextmanager
+def connect(db_path: str, autocommit: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    with で使う接続。抜けるときに確定（例外の場合は取り消し）して閉じる
+
+    sqlite3 の接続自体の with は確定するだけで閉じないため、各ストアはこちらを使う。
+    """
+    conn = open_connection(db_path, autocommit)
+    try:
+        if autocommit:
+            yield conn
+        else:
+            with conn:
+                yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    autocommit の接続で BEGIN IMMEDIATE のトランザクションを張り、抜けるときに確定する
+
+    例外の場合は取り消す。BEGIN 自体が失敗した（ロック待ちのタイムアウトなど）場合は
+    トランザクションが始まっていないため取り消さず、元の例外をそのまま送出する。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
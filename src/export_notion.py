@@ -0,0 +1,378 @@
+from notion_client import Client
+from notion_client.errors import RequestTimeoutError
+from . import config
+from .quota import NOTION_QUOTA_KEY, get_quota_scheduler
+from .replay import create_notion_client
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 再試行するHTTPステータス（レート制限とサーバー側の一時的なエラー）
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# チェックポイントを保存する間隔（ページ数）
+EXPORT_CHECKPOINT_INTERVAL = 50
+
+# 本文として書き出さないブロック
+SKIPPED_BLOCK_TYPES = ("divider", "table_of_contents", "callout", "child_page", "child_database")
+
+def is_retryable_notion_error(error: Exception) -> bool:
+    return isinstance(error, RequestTimeoutError) or getattr(error, "status", None) in RETRYABLE_STATUSES
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """レスポンスの Retry-After ヘッダー（秒数）。ない・日時形式の場合は None"""
+    headers = getattr(error, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def rich_text_to_markdown(rich_text: List[Dict[str, Any]]) -> str:
+    """Notionのrich_textをマークダウン（_convert_markdown_to_blocks の逆変換）に戻す"""
+    parts = []
+    for item in rich_text:
+        if item.get("type") == "equation":
+            parts.append(f"${item['equation']['expression']}$")
+            continue
+        content = item.get("text", {}).get("content", item.get("plain_text", ""))
+        annotations = item.get("annotations", {})
+        if annotations.get("bold") and annotations.get("italic"):
+            content = f"***{content}***"
+        elif annotations.get("bold"):
+            content = f"**{content}**"
+        elif annotations.get("italic"):
+            content = f"*{content}*"
+        parts.append(content)
+    return "".join(parts)
+
+def blocks_to_sections(blocks: List[Dict[str, Any]]) -> Dict[str, str]:
+    """heading_2 を区切りとしてブロックをセクションごとのマークダウンに戻す"""
+    sections: Dict[str, List[str]] = {}
+    current = None
+
+    def visit(block_list, depth=0):
+        nonlocal current
+        for block in block_list:
+            block_type = block.get("type")
+            if block_type in SKIPPED_BLOCK_TYPES:
+                continue
+            data = block.get(block_type, {})
+            text = rich_text_to_markdown(data.get("rich_text", []))
+
+            if block_type == "heading_2" and depth == 0:
+                current = text
+                sections.setdefault(current, [])
+            elif current is not None:
+                if block_type == "heading_3":
+                    sections[current].append(f"### {text}")
+                elif block_type == "heading_1":
+                    sections[current].append(f"# {text}")
+                elif block_type == "bulleted_list_item":
+                    sections[current].append(f"{'  ' * depth}- {text}")
+                elif block_type == "numbered_list_item":
+                    sections[current].append(f"{'  ' * depth}1. {text}")
+                elif text:
+                    sections[current].append(text)
+            # トグル見出しなどの子ブロックは同じセクションに含める
+            visit(block.get("children", []), depth + 1 if block_type != "heading_2" else depth)
+
+    visit(blocks)
+    return {name: "\n".join(lines).strip() for name, lines in sections.items()}
+
+def properties_to_sections(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """データベースのプロパティを get_summary と同じ形の値に戻す"""
+    sections = {}
+    for name, prop in properties.items():
+        prop_type = prop.get("type")
+        if prop_type == "title":
+            sections[name] = "".join(t.get("plain_text", "") for t in prop["title"])
+        elif prop_type == "rich_text":
+            sections[name] = "".join(t.get("plain_text", "") for t in prop["rich_text"])
+        elif prop_type == "multi_select":
+            sections[name] = [option["name"] for option in prop["multi_select"]]
+    return sections
+
+class NotionExporter:
+    """Notionデータベースの要約をローカルファイルに一括で書き出す"""
+
+    def __init__(self, notion: Client, database_id: str, concurrency: int = 8):
+        self.notion = notion
+        self.database_id = database_id
+        self.concurrency = concurrency
+        self.quota = get_quota_scheduler()
+
+    def _request(self, call, **kwargs):
+        """
+        クォータを取得してAPIを呼び出す
+
+        429・5xx・タイムアウトの場合は Retry-After（なければ指数バックオフ）だけ待って再試行する。
+        429 の場合は共有のバケットを空にして、他のスレッド・プロセスの呼び出しも待たせる。
+        """
+        for attempt in range(config.NOTION_MAX_RETRIES + 1):
+            # 全スレッド・全プロセスで共有するレート制限を守る
+            self.quota.acquire(NOTION_QUOTA_KEY)
+            try:
+                return call(**kwargs)
+            except Exception as e:
+                if attempt >= config.NOTION_MAX_RETRIES or not is_retryable_notion_error(e):
+                    raise
+                if getattr(e, "status", None) == 429:
+                    self.quota.report_throttled(NOTION_QUOTA_KEY)
+                wait = retry_after_seconds(e)
+                if wait is None:
+                    wait = config.NOTION_RETRY_BASE_SECONDS * 2 ** attempt * random.uniform(1.0, 1.5)
+                wait = min(wait, config.NOTION_RETRY_MAX_SECONDS)
+                logger.warning(f"Notion APIの呼び出しに失敗したため {wait:.1f} 秒後に再試行します "
+                               f"({attempt + 1}/{config.NOTION_MAX_RETRIES}): {e}")
+                time.sleep(wait)
+
+    def iter_pages(self, since: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """データベースのページを更新日時の古い順に返す（since 以降に更新されたもののみ）"""
+        query: Dict[str, Any] = {
+            "page_size": 100,
+            "sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}],
+        }
+        if since:
+            query["filter"] = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}}
+        while True:
+            # notion_client のバージョンによって databases.query が無いため直接呼び出す
+            response = self._request(self.notion.request, path=f"databases/{self.database_id}/query",
+                                     method="POST", body=query)
+            yield from response["results"]
+            if not response.get("has_more"):
+                break
+            query["start_cursor"] = response["next_cursor"]
+
+    def fetch_blocks(self, block_id: str, recursive: bool = True) -> List[Dict[str, Any]]:
+        """ページ（ブロック）の子ブロックを取得（recursive の場合は孫以下も）"""
+        blocks = []
+        kwargs: Dict[str, Any] = {"block_id": block_id, "page_size": 100}
+        while True:
+            response = self._request(self.notion.blocks.children.list, **kwargs)
+            for block in response["results"]:
+                if recursive and block.get("has_children") and block["type"] not in SKIPPED_BLOCK_TYPES:
+                    block["children"] = self.fetch_blocks(block["id"])
+                blocks.append(block)
+            if not response.get("has_more"):
+                break
+            kwargs["start_cursor"] = response["next_cursor"]
+        return blocks
+
+    def export_page(self, page: Dict[str, Any]) -> Dict[str, Any]:
+        """1ページ分のレコードを作成"""
+        sections = properties_to_sections(page.get("properties", {}))
+        # 本文のセクションはプロパティより詳しいため優先する
+        sections.update({k: v for k, v in blocks_to_sections(self.fetch_blocks(page["id"])).items() if v})
+        return {
+            "page_id": page["id"],
+            "url": page.get("url"),
+            "created_time": page.get("created_time"),
+            "last_edited_time": page.get("last_edited_time"),
+            "sections": sections,
+        }
+
+    def iter_records(self, since: Optional[str] = None, skip: Optional[set] = None) -> Iterator[Dict[str, Any]]:
+        """ページの子ブロックを並列に取得し、完了したものから順に返す"""
+        skip = skip or set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for page in self.iter_pages(since):
+                if page["id"] in skip:
+                    continue
+                pending.add(executor.submit(self.export_page, page))
+                # 先読みしすぎてメモリを使わないよう、同時に抱えるページ数を制限
+                if len(pending) >= self.concurrency * 4:
+                    done = next(as_completed(pending))
+                    pending.remove(done)
+                    yield done.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+class JsonlSink:
+    """
+    レコードをJSONLに書き出す（append=Trueの場合は既存ファイルに追記）
+
+    committed には出力ファイルに書き込んだページIDを記録する（チェックポイント用）。
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        self.committed: List[str] = []
+        self._buffered: List[str] = []
+
+    def write(self, record: Dict[str, Any]):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._buffered.append(record["page_id"])
+
+    def flush(self):
+        self.file.flush()
+        self.committed.extend(self._buffered)
+        self._buffered = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class ParquetSink:
+    """
+    レコードを rows_per_file 件ごとにParquetのパートファイルとして書き出す（pyarrowが必要）
+
+    flush() では書き出さない（小さなパートファイルが増えないように、件数に達するか close() するまでまとめる）。
+    committed にはパートファイルに書き出した行のページIDだけを記録する。
+    """
+
+    def __init__(self, path: str, append: bool = False, rows_per_file: int = 1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet形式での書き出しには pyarrow が必要です: pip install pyarrow") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self.rows: List[Dict[str, Any]] = []
+        self.committed: List[str] = []
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for filename in os.listdir(path):
+                if filename.endswith(".parquet"):
+                    os.remove(os.path.join(path, filename))
+
+    def write(self, record: Dict[str, Any]):
+        sections = record["sections"]
+        keywords = sections.get("Keywords", [])
+        self.rows.append({
+            "page_id": record["page_id"],
+            "url": record["url"],
+            "created_time": record["created_time"],
+            "last_edited_time": record["last_edited_time"],
+            "title": sections.get("Name", ""),
+            "keywords": keywords if isinstance(keywords, list) else [keywords],
+            "sections": json.dumps(sections, ensure_ascii=False),
+        })
+        if len(self.rows) >= self.rows_per_file:
+            self._write_part()
+
+    def _write_part(self):
+        if not self.rows:
+            return
+        part = len([f for f in os.listdir(self.path) if f.endswith(".parquet")])
+        table = self.pa.Table.from_pylist(self.rows)
+        self.pq.write_table(table, os.path.join(self.path, f"part-{part:05d}.parquet"))
+        self.committed.extend(row["page_id"] for row in self.rows)
+        self.rows = []
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._write_part()
+
+def _load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def export_database(output: str, fmt: str = "jsonl", checkpoint_path: Optional[str] = None,
+                    incremental: bool = False, concurrency: int = 8) -> int:
+    """
+    データベースをローカルファイルに書き出す
+
+    チェックポイントには実行開始時刻と書き出し済みのページIDを記録する。
+    中断された実行は書き出し済みのページを飛ばして再開し、
+    incremental の場合は前回完了した実行の開始時刻以降に更新されたページだけを取得する。
+
+    Returns:
+        int: 書き出したページ数
+    """
+    checkpoint_path = checkpoint_path or f"{output.rstrip('/')}.checkpoint.json"
+    checkpoint = _load_checkpoint(checkpoint_path)
+
+    # 再開時と差分実行時は既存の出力に追記する（利用側はページIDごとに最後のレコードを使う）
+    append = bool(checkpoint.get("in_progress")) or incremental
+    if checkpoint.get("in_progress"):
+        logger.info(f"中断されたエクスポートを再開: {len(checkpoint['done'])} ページ書き出し済み")
+    else:
+        checkpoint = {
+            "in_progress": True,
+            "run_started": datetime.now(timezone.utc).isoformat(),
+            "last_completed_run": checkpoint.get("last_completed_run"),
+            "since": None,
+            "done": [],
+        }
+        if incremental and checkpoint["last_completed_run"]:
+            # last_edited_time は分単位に丸められるため余裕を持たせる
+            last_run = datetime.fromisoformat(checkpoint["last_completed_run"])
+            checkpoint["since"] = (last_run - timedelta(minutes=2)).isoformat()
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    exporter = NotionExporter(create_notion_client(config.NOTION_API_KEY), config.database_id, concurrency)
+    sink = ParquetSink(output, append) if fmt == "parquet" else JsonlSink(output, append)
+    done = set(checkpoint["done"])
+    count = 0
+
+    def save_progress():
+        # 出力ファイルに書き込まれたページだけを記録する（Parquetはパートファイルに書き出した行のみ）
+        checkpoint["done"] = sorted(done.union(sink.committed))
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    try:
+        for record in exporter.iter_records(checkpoint["since"], skip=done):
+            sink.write(record)
+            count += 1
+            if count % EXPORT_CHECKPOINT_INTERVAL == 0:
+                sink.flush()
+                save_progress()
+                logger.info(f"{count} ページを書き出しました")
+        sink.close()
+    except BaseException:
+        # 書き出し済みの分だけ記録して中断（次回はそこから再開）
+        try:
+            sink.close()
+        finally:
+            save_progress()
+        raise
+
+    checkpoint.update({
+        "in_progress": False,
+        "last_completed_run": checkpoint["run_started"],
+        "done": [],
+    })
+    _save_checkpoint(checkpoint_path, checkpoint)
+    logger.info(f"エクスポート完了: {count} ページ → {output}")
+    return count
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Notionデータベースの要約をローカルに書き出す")
+    parser.add_argument("output", help="出力先（jsonlはファイル、parquetはディレクトリ）")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--checkpoint", help="チェックポイントファイル（省略時は出力先の隣）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回の完了後に更新されたページだけを書き出す")
+    parser.add_argument("--concurrency", type=int, default=8, help="子ブロックを並列に取得する数")
+    args = parser.parse_args()
+
+    export_database(args.output, args.format, args.checkpoint, args.incremental, args.concurrency)
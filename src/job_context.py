@@ -0,0 +1,152 @@
+from . import config
+from .job_store import get_job_store
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    """ジョブが取り消された（クライアントの切断・APIからの取り消し）"""
+
+class JobDeadlineExceeded(JobCancelled):
+    """ジョブの期限を過ぎた"""
+
+class JobContext:
+    """
+    1ジョブ分の期限と取り消し状態
+
+    処理の各段階（モデル呼び出し・クォータ待ち・メモリ予約待ち・Notionへの書き込み）で check() を呼び、
+    取り消された・期限を過ぎた場合は JobCancelled を送出して処理を打ち切る。
+    APIからの取り消しは別のワーカーで行われることがあるため、ジョブストアの取り消し要求も定期的に確認する。
+    """
+
+    def __init__(self, job_id: Optional[str] = None, timeout: Optional[float] = None):
+        timeout = config.JOB_TIMEOUT_SECONDS if timeout is None else timeout
+        self.job_id = job_id
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout and timeout > 0 else None
+        self.reason: Optional[str] = None
+        self._stage_deadline: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._last_poll = 0.0
+        self._cleanups: List[Tuple[str, Callable[[], None]]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "取り消されました"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+            logger.info(f"ジョブを取り消します: {self.job_id or '-'} ({reason})")
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled.is_set():
+            return True
+        now = time.monotonic()
+        if self.job_id and now - self._last_poll >= config.JOB_CANCEL_POLL_SECONDS:
+            self._last_poll = now
+            if get_job_store().is_cancel_requested(self.job_id):
+                self.cancel("APIから取り消されました")
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """現在のステージの残り時間（期限なしの場合は None）"""
+        deadlines = [d for d in (self.deadline, self._stage_deadline) if d is not None]
+        if not deadlines:
+            return None
+        return min(deadlines) - time.monotonic()
+
+    def check(self):
+        """取り消し・期限切れの場合は JobCancelled を送出する"""
+        if self.is_cancelled():
+            raise JobCancelled(self.reason)
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise JobDeadlineExceeded(
+                f"ジョブの期限（{self.timeout:g}秒）を過ぎました"
+                if self.deadline is not None and self.deadline <= time.monotonic()
+                else "処理段階の期限を過ぎました"
+            )
+
+    def call_timeout(self, limit: float) -> float:
+        """1回のAPI呼び出しのタイムアウト（上限 limit とステージの残り時間の小さい方）"""
+        self.check()
+        remaining = self.remaining()
+        return limit if remaining is None else min(limit, remaining)
+
+    def sleep(self, seconds: float):
+        """取り消されたらすぐに起きる待機"""
+        self._cancelled.wait(seconds)
+        self.check()
+
+    @contextmanager
+    def stage(self, share: float) -> Iterator[None]:
+        """
+        ジョブ全体の残り時間のうち share の割合をこのステージの期限とする
+
+        後の段階（Notionへの書き込みなど）の時間を前の段階が使い切らないようにする。
+        """
+        remaining = None if self.deadline is None else self.deadline - time.monotonic()
+        previous = self._stage_deadline
+        if remaining is not None:
+            self._stage_deadline = time.monotonic() + max(remaining, 0) * share
+        try:
+            yield
+        finally:
+            self._stage_deadline = previous
+
+    def add_cleanup(self, description: str, cleanup: Callable[[], None]):
+        """取り消し時に実行する後片付け（リモートにアップロードしたファイルの削除など）を登録する"""
+        with self._lock:
+            self._cleanups.append((description, cleanup))
+
+    def run_cleanups(self):
+        """登録された後片付けを新しい順に実行する（失敗しても残りは実行する）"""
+        with self._lock:
+            cleanups, self._cleanups = self._cleanups, []
+        for description, cleanup in reversed(cleanups):
+            try:
+                cleanup()
+                logger.info(f"後片付け: {description}")
+            except Exception as e:
+                logger.warning(f"後片付けに失敗: {description}: {e}")
+
+def sleep(context: Optional[JobContext], seconds: float):
+    """context があれば取り消し可能な待機、なければ通常の待機"""
+    if context is None:
+        time.sleep(seconds)
+    else:
+        context.sleep(seconds)
+
+# このプロセスで実行中のジョブ（同じワーカーへの取り消し要求はすぐに反映する）
+_active: Dict[str, JobContext] = {}
+_active_lock = threading.Lock()
+
+@contextmanager
+def track_job(context: JobContext) -> Iterator[JobContext]:
+    if context.job_id:
+        with _active_lock:
+            _active[context.job_id] = context
+    try:
+        yield context
+    finally:
+        if context.job_id:
+            with _active_lock:
+                if _active.get(context.job_id) is context:
+                    del _active[context.job_id]
+
+def cancel_job(job_id: str, reason: str = "APIから取り消されました") -> bool:
+    """
+    ジョブの取り消しを要求する
+
+    Returns:
+        bool: 未完了のジョブに取り消しを要求できた場合は True
+    """
+    requested = get_job_store().request_cancel(job_id)
+    with _active_lock:
+        context = _active.get(job_id)
+    if requested and context:
+        context.cancel(reason)
+    return requested
@@ -0,0 +1,244 @@
+from . import config
+from .db import connect
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態（この順に進む）
+JOB_STATES = ("queued", "summarizing", "summarized", "writing", "completed", "failed", "cancelled")
+# 再起動時に再開する対象の状態
+INTERRUPTED_STATES = ("queued", "summarizing", "summarized", "writing")
+
+# JSONとして保存する列
+JSON_COLUMNS = ("sections", "token_info", "process_info", "block_chunks")
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイルのSHA-256を計算"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class JobStore:
+    """
+    要約ジョブの永続ストア（SQLite, WALモード）
+
+    ジョブごとに状態・入力ハッシュ・生成済みセクション・トークン使用量・NotionページIDを記録し、
+    再起動時に中断したステージから再開できるようにする。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.JOB_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    filename TEXT,
+                    pdf_path TEXT,
+                    input_hash TEXT,
+                    model_name TEXT,
+                    summary_mode TEXT,
+                    pdf_mode TEXT,
+                    sections TEXT,
+                    token_info TEXT,
+                    process_info TEXT,
+                    notion_page_id TEXT,
+                    blocks_written INTEGER NOT NULL DEFAULT 0,
+                    block_chunks TEXT,
+                    error TEXT,
+                    owner_pid INTEGER,
+                    submitter TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_notion_page_id ON jobs (notion_page_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_input_hash ON jobs (input_hash)")
+            # 複数ファイルをまとめてアップロードした単位（ファイルごとのジョブIDと重複の記録）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id TEXT PRIMARY KEY,
+                    items TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            yield conn
+
+    # created_at は秒単位のため、同じ秒に登録されたジョブは rowid（登録順）で並べる
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec="seconds")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for column in JSON_COLUMNS:
+            if job.get(column):
+                job[column] = json.loads(job[column])
+        return job
+
+    def create_job(self, filename: str, input_hash: Optional[str] = None,
+                   model_name: Optional[str] = None, summary_mode: str = "concise",
+                   pdf_mode: str = "text", pdf_path: Optional[str] = None,
+                   submitter: Optional[str] = None) -> str:
+        """ジョブを登録してIDを返す（submitter は投入元。中断したジョブを投入元ごとに再開するために使う）"""
+        job_id = uuid.uuid4().hex
+        now = self._now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, state, filename, pdf_path, input_hash, model_name, "
+                "summary_mode, pdf_mode, owner_pid, submitter, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, pdf_path, input_hash, model_name, summary_mode, pdf_mode,
+                 os.getpid(), submitter, now, now)
+            )
+        return job_id
+
+    def update_job(self, job_id: str, **fields):
+        """指定した列を更新（JSON列は自動でシリアライズ）"""
+        if not fields:
+            return
+        if "state" in fields and fields["state"] not in JOB_STATES:
+            raise ValueError(f"不正なジョブ状態: {fields['state']}")
+        values = []
+        for column, value in fields.items():
+            if column in JSON_COLUMNS and value is not None:
+                value = json.dumps(value, ensure_ascii=False)
+            values.append(value)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*values, self._now(), job_id)
+            )
+
+    def claim_job(self, job_id: str, previous_owner: Optional[int]) -> bool:
+        """
+        ジョブの担当プロセスを自分に切り替える
+
+        previous_owner が変わっていない場合のみ成功するため、
+        複数のワーカーが同じジョブを同時に再開することはない。
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET owner_pid = ?, updated_at = ? "
+                "WHERE id = ? AND owner_pid IS ?",
+                (os.getpid(), self._now(), job_id, previous_owner)
+            )
+            return cursor.rowcount == 1
+
+    def request_cancel(self, job_id: str) -> bool:
+        """未完了のジョブに取り消し要求を記録する（実行中のワーカーが次の確認時に打ち切る）"""
+        placeholders = ", ".join("?" for _ in INTERRUPTED_STATES)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET cancel_requested = 1, updated_at = ? "
+                f"WHERE id = ? AND state IN ({placeholders})",
+                (self._now(), job_id, *INTERRUPTED_STATES)
+            )
+            return cursor.rowcount == 1
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def find_job_by_page(self, notion_page_id: str) -> Optional[Dict[str, Any]]:
+        """Notionページを作成したジョブ（複数ある場合は最新のもの）を返す"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE notion_page_id = ? ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                (notion_page_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def find_job_by_hash(self, input_hash: str, summary_mode: str) -> Optional[Dict[str, Any]]:
+        """同じPDF・同じ要約モードで失敗・取り消しされていない最新のジョブを返す"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE input_hash = ? AND summary_mode = ? "
+                "AND state NOT IN ('failed', 'cancelled') AND cancel_requested = 0 "
+                "ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                (input_hash, summary_mode)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def create_batch(self, items: List[Dict[str, Any]]) -> str:
+        """
+        バッチを登録してIDを返す
+
+        Args:
+            items: ファイルごとの {"filename", "job_id", "duplicate"} のリスト
+        """
+        batch_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO batches (id, items, created_at) VALUES (?, ?, ?)",
+                (batch_id, json.dumps(items, ensure_ascii=False), self._now())
+            )
+        return batch_id
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if not row:
+            return None
+        batch = dict(row)
+        batch["items"] = json.loads(batch["items"])
+        return batch
+
+    def list_jobs(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """新しい順にジョブを返す（履歴表示用、セクション本文は含めない）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, state, filename, input_hash, model_name, summary_mode, pdf_mode, "
+                "token_info, process_info, notion_page_id, error, created_at, updated_at "
+                "FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def interrupted_jobs(self, submitter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """完了・失敗していないジョブを古い順に返す（submitter を指定した場合はその投入元のジョブだけ）"""
+        placeholders = ", ".join("?" for _ in INTERRUPTED_STATES)
+        query = f"SELECT * FROM jobs WHERE state IN ({placeholders})"
+        params: List[Any] = list(INTERRUPTED_STATES)
+        if submitter is not None:
+            query += " AND submitter = ?"
+            params.append(submitter)
+        with self._connect() as conn:
+            rows = conn.execute(f"{query} ORDER BY created_at, rowid", params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+_job_store: Optional[JobStore] = None
+
+def get_job_store() -> JobStore:
+    """プロセス内で共有するジョブストアを取得"""
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore()
+    return _job_store
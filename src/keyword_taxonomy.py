@@ -0,0 +1,176 @@
+from . import config
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 単語の区切りとして扱う記号
+SEPARATOR_PATTERN = re.compile(r"[\s\-_/・]+")
+# 比較時に無視する記号
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+# s で終わるが複数形ではない単語（-ss・-us・-is・-ics で終わるものは規則で除外する）
+SINGULAR_WORDS = {"bayes", "series", "species", "news", "lens", "diabetes", "sars", "mers", "aids"}
+
+def _singularize(word: str) -> str:
+    """英単語の簡易的な単数形化（LLMs → llm, networks → network）"""
+    if word in SINGULAR_WORDS:
+        return word
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    # physics, robotics, corpus, analysis, loss などは単数形のまま
+    if len(word) > 2 and word.endswith("s") and not word.endswith(("ss", "us", "is", "ics")):
+        return word[:-1]
+    return word
+
+def normalize_keyword(keyword: str) -> str:
+    """表記ゆれを吸収した比較用のキーを作る"""
+    text = unicodedata.normalize("NFKC", keyword).lower()
+    text = SEPARATOR_PATTERN.sub(" ", text)
+    text = PUNCTUATION_PATTERN.sub("", text)
+    return " ".join(_singularize(word) for word in text.split())
+
+def _spelling_key(normalized: str) -> str:
+    """
+    綴りの違いだけを吸収したキー（単語の区切りの有無と複数形の -es を無視する）
+
+    pre training / pretraining、approach / approaches は同じキーになるが、
+    単語自体が違うもの（image augmentation / image segmentation）は別のキーのまま。
+    """
+    words = []
+    for word in normalized.split():
+        # _singularize は approaches → approache までなので、-ches/-shes/-xes/-sses/-zes の e も落とす
+        if word.endswith(("che", "she", "xe", "sse", "ze")):
+            word = word[:-1]
+        words.append(word)
+    return "".join(words)
+
+class KeywordTaxonomy:
+    """
+    Keywords（multi_select）の既存オプションをローカルにキャッシュし、
+    新しいキーワードを既存のオプションに寄せる
+
+    キャッシュはDATA_DIR以下のJSONに保存し、TTLが切れたらデータベースのスキーマから取り直す。
+    照合は 正規化キーの完全一致 → 別名（KEYWORD_ALIASES） → 綴りの違いだけのキーの一致 の順に行う。
+    頭字語や文字列の類似度では寄せない（Active Inference と AI、Image Augmentation と
+    Image Segmentation のように別の概念がまとめられてしまうため）。
+    """
+
+    def __init__(self, notion, database_id: str, property_name: str = "Keywords",
+                 cache_path: Optional[str] = None, ttl: Optional[int] = None):
+        self.notion = notion
+        self.database_id = database_id
+        self.property_name = property_name
+        self.cache_path = cache_path or config.KEYWORD_TAXONOMY_CACHE_PATH
+        self.ttl = config.KEYWORD_TAXONOMY_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._options: List[str] = []
+        self._by_key: Dict[str, str] = {}
+        self._by_alias: Dict[str, str] = {}
+        self._by_spelling: Dict[str, str] = {}
+        self._alias_groups = self._build_alias_groups()
+
+    def _fetch_options(self) -> List[str]:
+        """データベースのスキーマからオプション一覧を取得"""
+        database = self.notion.databases.retrieve(database_id=self.database_id)
+        prop = database.get("properties", {}).get(self.property_name, {})
+        return [option["name"] for option in prop.get("multi_select", {}).get("options", [])]
+
+    def _read_cache(self) -> Optional[dict]:
+        try:
+            with open(self.cache_path, encoding="utf-8") as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if cache.get("database_id") != self.database_id:
+            return None
+        if time.time() - cache.get("fetched_at", 0) > self.ttl:
+            return None
+        return cache
+
+    def _write_cache(self, options: List[str]):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "database_id": self.database_id,
+                "fetched_at": time.time(),
+                "options": options,
+            }, file, ensure_ascii=False)
+        # 他のワーカーが読みかけのファイルを壊さないよう置き換えで保存
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _build_alias_groups() -> Dict[str, List[str]]:
+        """別名の組（llm ↔ large language model）を正規化キーから同じ組の他のキーへの対応にする"""
+        groups: Dict[str, List[str]] = {}
+        for alias, target in config.KEYWORD_ALIASES.items():
+            alias_key, target_key = normalize_keyword(alias), normalize_keyword(target)
+            if alias_key and target_key and alias_key != target_key:
+                groups.setdefault(alias_key, []).append(target_key)
+                groups.setdefault(target_key, []).append(alias_key)
+        return groups
+
+    def _build_index(self, options: List[str]):
+        self._options = []
+        self._by_key = {}
+        self._by_alias = {}
+        self._by_spelling = {}
+        for option in options:
+            self._add_to_index(option)
+
+    def _add_to_index(self, option: str):
+        key = normalize_keyword(option)
+        if not key or key in self._by_key:
+            return
+        self._options.append(option)
+        self._by_key[key] = option
+        self._by_spelling.setdefault(_spelling_key(key), option)
+        # どちらの表記が既存のオプションでも、もう一方の表記をそちらに寄せる（LLM ↔ Large Language Model）
+        for other in self._alias_groups.get(key, ()):
+            self._by_alias.setdefault(other, option)
+
+    def _ensure_loaded(self):
+        if time.time() - self._loaded_at <= self.ttl and self._loaded_at:
+            return
+        cache = self._read_cache()
+        if cache is not None:
+            options = cache["options"]
+        else:
+            options = self._fetch_options()
+            self._write_cache(options)
+            logger.info(f"キーワードの既存オプションを取得: {len(options)} 件")
+        self._build_index(options)
+        self._loaded_at = time.time()
+
+    def resolve(self, keyword: str) -> Optional[str]:
+        """既存のオプションに一致するものがあればその名前を返す"""
+        key = normalize_keyword(keyword)
+        if not key:
+            return None
+        with self._lock:
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                logger.warning(f"キーワードの既存オプションを取得できません: {e}")
+                return None
+
+            if key in self._by_key:
+                return self._by_key[key]
+            if key in self._by_alias:
+                return self._by_alias[key]
+            return self._by_spelling.get(_spelling_key(key))
+
+    def register(self, option: str):
+        """新しく作られるオプションを索引に加え、後続のキーワードをそちらに寄せる"""
+        with self._lock:
+            if self._loaded_at:
+                self._add_to_index(option)
@@ -1,12 +1,28 @@
 from fastapi import FastAPI, Form, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
-from .add_notion import add_summary2notion
+from fastapi.concurrency import run_in_threadpool
+from .add_notion import add_summary2notion, remove_job_file, sweep_interrupted_jobs
+import asyncio
+import functools
 import os
 import logging
+import threading
+from concurrent.futures import Future
+from typing import List, Tuple
 from . import config
 from .add_columns import initialize_database
+from .model_router import model_stats
+from .quota import get_quota_scheduler
+from .job_store import get_job_store
+from .coordination import try_acquire_leadership, worker_papers_dir
+from .search_index import get_search_index
+from .pdf_stream import save_upload
+from .memory_budget import estimate_job_memory_mb, get_memory_budget
+from .batch import get_batch_status, submit_batch
+from .job_context import JobContext, cancel_job
+from .scheduler import estimate_job_cost, get_scheduler
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +34,15 @@ templates = Jinja2Templates(directory="src/templates")
 # 起動時にデータベースの初期化を実行
 @app.on_event("startup")
 async def startup_event():
+    # 中断されたジョブの再開は全ワーカーで定期的に行う（担当ワーカーが終了したジョブだけを引き継ぐ）
+    threading.Thread(target=sweep_interrupted_jobs, args=(config.ORPHAN_SWEEP_SECONDS,),
+                     daemon=True).start()
+
+    # 複数ワーカー構成では、ロックを取得した1プロセスだけがデータベースを初期化する
+    if not try_acquire_leadership("startup"):
+        logger.info("データベースの初期化は別のワーカーが担当します")
+        return
+
     try:
         result = initialize_database()
         if result:
@@ -27,9 +52,46 @@ async def startup_event():
     except Exception as e:
         logger.error(f"データベース初期化エラー: {e}")
 
-# papersディレクトリが存在しない場合は作成
-if not os.path.exists('src/papers'):
-    os.makedirs('src/papers')
+def get_submitter(request: Request) -> str:
+    """スケジューラで公平に処理を分ける単位（SUBMITTER_HEADER のヘッダー、なければ接続元）"""
+    if config.SUBMITTER_HEADER and request.headers.get(config.SUBMITTER_HEADER):
+        return request.headers[config.SUBMITTER_HEADER]
+    return request.client.host if request.client else "anonymous"
+
+def validate_summary_mode(summary_mode: str):
+    """未知の要約モードはジョブを登録する前に拒否する（必要なセクションが決まらないため）"""
+    if summary_mode not in config.SUMMARY_MODES:
+        raise HTTPException(status_code=400,
+                            detail=f"不明な要約モード: {summary_mode}（{', '.join(config.SUMMARY_MODES)} のいずれか）")
+
+def register_upload(upload_path: str, filename: str, input_hash: str, model_name: str,
+                    summary_mode: str, pdf_mode: str, submitter: str) -> Tuple[str, str]:
+    """
+    保存したアップロードをジョブとして登録し、ジョブIDの名前に移す
+
+    SQLiteへの書き込みとファイル操作を含むため、イベントループの外（スレッドプール）で呼び出す。
+    """
+    job_store = get_job_store()
+    job_id = job_store.create_job(filename, input_hash, model_name, summary_mode, pdf_mode, submitter=submitter)
+    # 再起動後に再開できるよう、PDFはジョブ完了まで保持する
+    file_location = os.path.join(worker_papers_dir(), f"{job_id}.pdf")
+    os.replace(upload_path, file_location)
+    job_store.update_job(job_id, pdf_path=file_location)
+    return job_id, file_location
+
+async def run_until_disconnected(request: Request, job_context: JobContext, future: Future):
+    """
+    スケジューラに投入したジョブの完了を待ち、その間にクライアントが切断されたらジョブを取り消す
+
+    処理は次の確認時点で打ち切られ、後片付けが終わるまで待ってから戻る。
+    """
+    task = asyncio.wrap_future(future)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=config.DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if not job_context.is_cancelled() and await request.is_disconnected():
+            job_context.cancel("クライアントが切断されました")
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -46,21 +108,38 @@ async def upload_pdf(
     summary_mode: str = Form("concise"),
     pdf_mode: str = Form("text")  # デフォルトはテキストのみ
 ):
+    validate_summary_mode(summary_mode)
     try:
         # モデル名のバリデーション
-        valid_models = ["gemini-1.5-pro-002", "gemini-1.5-flash-002", "gemini-2.0-flash-exp"]
-        if not model_name or model_name not in valid_models:
+        if not model_name or model_name not in config.AVAILABLE_MODELS:
             model_name = config.GOOGLE_MODEL
         
         logger.info(f"選択されたモデル: {model_name}")
+
+        # PDF処理モードのバリデーション
+        if pdf_mode not in config.PDF_MODES:
+            pdf_mode = "text"
         
-        file_location = f"src/papers/{pdf_file.filename}"
-        with open(file_location, "wb") as file:
-            file.write(pdf_file.file.read())
+        # アップロードはメモリに載せず、チャンク単位でディスクに書き出しながらハッシュを計算する
+        upload_path, input_hash = await run_in_threadpool(save_upload, pdf_file.file, worker_papers_dir())
+        job_id, file_location = await run_in_threadpool(
+            register_upload, upload_path, pdf_file.filename, input_hash, model_name, summary_mode, pdf_mode,
+            get_submitter(request)
+        )
         
-        logger.info(f"PDFファイルを保存: {file_location}")
+        logger.info(f"PDFファイルを保存: {file_location} (ジョブ: {job_id})")
         
-        result = add_summary2notion(file_location, model_name, summary_mode, pdf_mode)
+        # 画面で結果を待つジョブとしてスケジューラに投入し、バックグラウンドのジョブより先に処理する
+        # クライアントが切断された場合は取り消して、ワーカーとクォータをすぐに空ける
+        context = JobContext(job_id)
+        cost = await run_in_threadpool(estimate_job_cost, file_location, summary_mode, input_hash)
+        future = get_scheduler().submit(
+            functools.partial(add_summary2notion, file_location, model_name, summary_mode, pdf_mode,
+                              job_id=job_id, context=context),
+            summary_mode=summary_mode, submitter=get_submitter(request), cost=cost,
+            interactive=True, label=job_id, memory_mb=estimate_job_memory_mb(file_location)
+        )
+        result = await run_until_disconnected(request, context, future)
         
         if result is None:
             output = "要約の生成に失敗しました。Geminiのエラーを確認してください。"
@@ -78,8 +157,7 @@ async def upload_pdf(
             token_info = result.get("token_info", {})
             process_info = result.get("process_info", {})
         
-        os.remove(file_location)
-        logger.info(f"一時ファイルを削除: {file_location}")
+        await run_in_threadpool(remove_job_file, file_location)
         
         total_tokens = sum(token_info.values()) if token_info else 0
         
@@ -109,9 +187,122 @@ async def upload_pdf(
             }
         )
 
+@app.post("/upload-pdfs")
+async def upload_pdfs(
+    request: Request,
+    pdf_files: List[UploadFile] = File(...),
+    model_name: str = Form(None),
+    summary_mode: str = Form("concise"),
+    pdf_mode: str = Form("auto")
+):
+    """複数のPDFをまとめて受け付け、バックグラウンドで並列に要約する"""
+    validate_summary_mode(summary_mode)
+    if not model_name or model_name not in config.AVAILABLE_MODELS:
+        model_name = config.GOOGLE_MODEL
+    if pdf_mode not in config.PDF_MODES:
+        pdf_mode = "text"
+
+    # 全ファイルをディスクに書き出してハッシュを計算してから、重複を除いて登録する
+    papers_dir = worker_papers_dir()
+    files = []
+    try:
+        for pdf_file in pdf_files:
+            if not pdf_file.filename:
+                continue
+            upload_path, input_hash = await run_in_threadpool(save_upload, pdf_file.file, papers_dir)
+            files.append((pdf_file.filename, upload_path, input_hash))
+    except Exception:
+        for _, upload_path, _ in files:
+            await run_in_threadpool(remove_job_file, upload_path)
+        raise
+    if not files:
+        raise HTTPException(status_code=400, detail="PDFファイルが指定されていません")
+
+    batch_id = await run_in_threadpool(submit_batch, files, model_name, summary_mode, pdf_mode, papers_dir,
+                                       get_submitter(request))
+    return RedirectResponse(url=f"/batches/{batch_id}", status_code=303)
+
+# 以下のエンドポイントはSQLiteの読み書きだけを行うため、通常の def で定義して
+# FastAPI のスレッドプールで実行させる（イベントループを止めない）
+
+@app.get("/batches/{batch_id}", response_class=HTMLResponse)
+def batch_progress(request: Request, batch_id: str):
+    """バッチ内のファイルごとの進捗ページ"""
+    batch = get_batch_status(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません")
+    return templates.TemplateResponse("batch.html", {
+        "request": request,
+        "batch": batch
+    })
+
+@app.get("/batches/{batch_id}/status")
+def batch_status(batch_id: str):
+    """バッチ内のファイルごとの状態（進捗ページからポーリングされる）"""
+    batch = get_batch_status(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません")
+    return batch
+
+@app.get("/jobs", response_class=HTMLResponse)
+def job_history(request: Request, limit: int = 100):
+    """ジョブ履歴の一覧"""
+    return templates.TemplateResponse("jobs.html", {
+        "request": request,
+        "jobs": get_job_store().list_jobs(limit)
+    })
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """ジョブの状態（生成済みセクションを含む）"""
+    job = get_job_store().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_summary_job(job_id: str):
+    """
+    ジョブを取り消す
+
+    実行中のワーカーは次の確認時点（モデル呼び出し・クォータ待ち・Notionへの書き込みの前）で処理を打ち切り、
+    アップロードしたファイルと一時PDFを片付ける。
+    """
+    store = get_job_store()
+    if store.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    requested = cancel_job(job_id)
+    job = store.get_job(job_id)
+    return {"job_id": job_id, "cancel_requested": requested, "state": job["state"]}
+
+@app.get("/search")
+def search_summaries(q: str, limit: int = 20):
+    """生成済み要約をローカルの全文検索インデックスから検索"""
+    return {"query": q, "hits": get_search_index().search(q, limit)}
+
+@app.get("/model-stats")
+def get_model_stats():
+    """モデルごとのレイテンシと成功率（ルーティングの判断材料）"""
+    return model_stats.snapshot()
+
+@app.get("/quota")
+def get_quota_status():
+    """モデルごとのクォータ待ち行列の長さとバケット残量"""
+    return get_quota_scheduler().status()
+
+@app.get("/scheduler")
+def get_scheduler_status():
+    """クラス（優先度:要約モード）ごとの待ち行列の長さと待ち時間の統計"""
+    return get_scheduler().status()
+
+@app.get("/memory")
+def get_memory_status():
+    """要約ジョブのメモリ予約状況"""
+    return get_memory_budget().status()
+
 # /initialize-dbエンドポイントは残しておく（APIとして利用可能）
 @app.post("/initialize-db")
-async def initialize_notion_db():
+def initialize_notion_db():
     try:
         result = initialize_database()
         if result:
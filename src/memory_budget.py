@@ -0,0 +1,153 @@
+from . import config
+from .coordination import is_process_alive
+from .db import connect, immediate_transaction, open_connection
+from .job_context import JobContext, sleep
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+def estimate_job_memory_mb(pdf_path: str) -> float:
+    """PDFのサイズから1ジョブが使うメモリを見積もる"""
+    size_mb = os.path.getsize(pdf_path) / (1024 * 1024)
+    return config.JOB_MEMORY_BASE_MB + size_mb * config.JOB_MEMORY_PER_PDF_MB
+
+class MemoryBudget:
+    """
+    要約ジョブのメモリ予約（SQLite, 全ワーカーで共有）
+
+    ジョブは見積もったメモリ（ジョブごとの予算 JOB_MEMORY_BUDGET_MB が上限）を予約してから処理を始め、
+    予約の合計が MEMORY_LIMIT_MB を超える場合は空くまで待つ。スケジューラ経由のジョブは、
+    取り出す時点で予約できたものだけを開始する（予約できないジョブがスレッドを占有しない）。
+    異常終了したプロセスの予約は次の予約時に破棄する。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.MEMORY_DB_PATH
+        self._local = threading.local()  # スレッドごとの、スケジューラが開始時に取得した予約
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reservations (
+                    id TEXT PRIMARY KEY,
+                    pid INTEGER NOT NULL,
+                    mb REAL NOT NULL,
+                    label TEXT,
+                    created REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return connect(self.db_path, autocommit=True)
+
+    def _remove_stale(self, conn: sqlite3.Connection):
+        pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM reservations")]
+        for pid in pids:
+            if not is_process_alive(pid):
+                conn.execute("DELETE FROM reservations WHERE pid = ?", (pid,))
+
+    def try_reserve(self, reservation_id: str, mb: float, label: str = "") -> bool:
+        """予約できた場合はTrue（他に予約がなければ上限を超えていても許可する）"""
+        conn = open_connection(self.db_path, autocommit=True)
+        try:
+            with immediate_transaction(conn):
+                self._remove_stale(conn)
+                used = conn.execute("SELECT COALESCE(SUM(mb), 0) FROM reservations").fetchone()[0]
+                if used > 0 and used + mb > config.MEMORY_LIMIT_MB:
+                    return False
+                conn.execute(
+                    "INSERT INTO reservations (id, pid, mb, label, created) VALUES (?, ?, ?, ?, ?)",
+                    (reservation_id, os.getpid(), mb, label, time.time())
+                )
+                return True
+        finally:
+            conn.close()
+
+    def release(self, reservation_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+
+    @contextmanager
+    def reserve(self, mb: float, label: str = "", context: Optional[JobContext] = None) -> Iterator[None]:
+        """
+        メモリを予約してから処理を行う（MEMORY_LIMIT_MB=0 の場合は制限しない）
+
+        context のジョブが取り消された場合は待機をやめて JobCancelled を送出する。
+        """
+        if config.MEMORY_LIMIT_MB <= 0 or getattr(self._local, "reservation_id", None):
+            # スケジューラがジョブの開始時に予約済みの場合は二重に予約しない
+            yield
+            return
+
+        mb = min(mb, config.JOB_MEMORY_BUDGET_MB)
+        reservation_id = uuid.uuid4().hex
+        start = time.time()
+        waiting_logged = False
+        while not self.try_reserve(reservation_id, mb, label):
+            if not waiting_logged:
+                logger.info(f"メモリの空きを待機: {label} ({mb:.0f} MB)")
+                waiting_logged = True
+            sleep(context, config.MEMORY_POLL_SECONDS)
+        if waiting_logged:
+            logger.info(f"メモリを確保: {label} ({mb:.0f} MB, 待機 {time.time() - start:.1f} 秒)")
+        try:
+            yield
+        finally:
+            self.release(reservation_id)
+
+    def try_admit(self, mb: float, label: str = "") -> Optional[str]:
+        """
+        ジョブを開始する前に予約する（スケジューラ用）。予約できた場合は予約ID、できない場合は None
+
+        予約は hold() で処理中のスレッドに引き渡し、処理が終わったら解放する。
+        """
+        if config.MEMORY_LIMIT_MB <= 0 or mb <= 0:
+            return ""
+        reservation_id = uuid.uuid4().hex
+        if self.try_reserve(reservation_id, min(mb, config.JOB_MEMORY_BUDGET_MB), label):
+            return reservation_id
+        return None
+
+    @contextmanager
+    def hold(self, reservation_id: Optional[str]) -> Iterator[None]:
+        """try_admit で取得した予約をこのスレッドの処理中に保持し、終わったら解放する"""
+        if not reservation_id:
+            yield
+            return
+        self._local.reservation_id = reservation_id
+        try:
+            yield
+        finally:
+            self._local.reservation_id = None
+            self.release(reservation_id)
+
+    def status(self) -> Dict[str, Any]:
+        """現在の予約状況"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT pid, mb, label, created FROM reservations ORDER BY created"
+            ).fetchall()
+        return {
+            "limit_mb": config.MEMORY_LIMIT_MB,
+            "job_budget_mb": config.JOB_MEMORY_BUDGET_MB,
+            "reserved_mb": sum(row[1] for row in rows),
+            "reservations": [
+                {"pid": pid, "mb": mb, "label": label, "age": round(time.time() - created, 1)}
+                for pid, mb, label, created in rows
+            ],
+        }
+
+_memory_budget: Optional[MemoryBudget] = None
+
+def get_memory_budget() -> MemoryBudget:
+    """プロセス内で共有するメモリ予約を取得"""
+    global _memory_budget
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget()
+    return _memory_budget
@@ -0,0 +1,251 @@
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from . import config
+from .db import connect
+from .quota import get_quota_scheduler
+from . import replay
+from .job_context import JobContext
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# フォールバック対象とする一時的なエラー（レート制限・クォータ超過・タイムアウト）
+RETRYABLE_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    TimeoutError,
+)
+# このうちレート制限そのもの（共有のRPM枠を空にして他のプロセスも待たせる対象）
+THROTTLING_EXCEPTIONS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+def is_retryable_error(error: Exception) -> bool:
+    """別モデルへのフォールバックで回避できるエラーかどうかを例外の型で判定（メッセージの文言では判定しない）"""
+    return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+def is_throttling_error(error: Exception) -> bool:
+    """レート制限（429・クォータ超過）によるエラーか。タイムアウトや一時的な障害は含めない"""
+    return isinstance(error, THROTTLING_EXCEPTIONS)
+
+class ModelStats:
+    """
+    モデルごとのレイテンシと成功率を記録し、ルーティングに反映する
+
+    統計はローカルのSQLiteに保存し、全ワーカープロセスで共有する。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.ROUTING_DB_PATH
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized:
+            # インポート時にファイルを作らないよう、初回利用時にテーブルを作成する
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with connect(self.db_path) as conn:
+            if not self._initialized:
+                with self._init_lock:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS model_stats (
+                            model TEXT PRIMARY KEY,
+                            calls INTEGER NOT NULL DEFAULT 0,
+                            successes INTEGER NOT NULL DEFAULT 0,
+                            failures INTEGER NOT NULL DEFAULT 0,
+                            avg_latency REAL,
+                            cooldown_until REAL NOT NULL DEFAULT 0
+                        )
+                    """)
+                    self._initialized = True
+            yield conn
+
+    def record_success(self, model_name: str, latency: float):
+        # 指数移動平均で直近のレイテンシを重視する
+        alpha = config.MODEL_LATENCY_EWMA_ALPHA
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO model_stats (model, calls, successes, avg_latency) VALUES (?, 1, 1, ?) "
+                "ON CONFLICT(model) DO UPDATE SET calls = calls + 1, successes = successes + 1, "
+                "avg_latency = CASE WHEN avg_latency IS NULL THEN excluded.avg_latency "
+                "ELSE ? * excluded.avg_latency + (1 - ?) * avg_latency END",
+                (model_name, latency, alpha, alpha)
+            )
+
+    def record_failure(self, model_name: str, retryable: bool):
+        # クォータ切れのモデルはしばらく後回しにする
+        cooldown_until = time.time() + config.MODEL_COOLDOWN_SECONDS if retryable else 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO model_stats (model, calls, failures, cooldown_until) VALUES (?, 1, 1, ?) "
+                "ON CONFLICT(model) DO UPDATE SET calls = calls + 1, failures = failures + 1, "
+                "cooldown_until = MAX(cooldown_until, excluded.cooldown_until)",
+                (model_name, cooldown_until)
+            )
+
+    def _get(self, model_name: str):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT calls, successes, avg_latency, cooldown_until FROM model_stats WHERE model = ?",
+                (model_name,)
+            ).fetchone()
+
+    def is_healthy(self, model_name: str) -> bool:
+        row = self._get(model_name)
+        if row is None:
+            return True
+        calls, successes, _, cooldown_until = row
+        if cooldown_until > time.time():
+            return False
+        if calls >= config.MODEL_MIN_CALLS_FOR_STATS:
+            return successes / calls >= config.MODEL_MIN_SUCCESS_RATE
+        return True
+
+    def avg_latency(self, model_name: str) -> Optional[float]:
+        """平均レイテンシ（成功した呼び出しがまだない場合は None）"""
+        row = self._get(model_name)
+        if row is None:
+            return None
+        return row[2]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT model, calls, successes, failures, avg_latency, cooldown_until FROM model_stats"
+            ).fetchall()
+        return {
+            name: {
+                "calls": calls,
+                "successes": successes,
+                "failures": failures,
+                "success_rate": successes / calls if calls else None,
+                "avg_latency": avg_latency,
+                "cooling_down": cooldown_until > now,
+            }
+            for name, calls, successes, failures, avg_latency, cooldown_until in rows
+        }
+
+# 全ワーカーで共有する統計情報
+model_stats = ModelStats()
+
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+def _get_model(model_name: str):
+    """モデルのインスタンスをキャッシュして取得"""
+    with _models_lock:
+        if model_name not in _models:
+            try:
+                _models[model_name] = genai.GenerativeModel(model_name=model_name)
+            except Exception as e:
+                logger.error(f"モデルの初期化に失敗 ({model_name}): {e}")
+                return None
+        return _models[model_name]
+
+def get_section_tier(sections: Iterable[str]) -> str:
+    """セクション群に割り当てるモデル階層を決定（全て fast の場合のみ fast）"""
+    tiers = {config.column_configs.get(name, {}).get("model_tier", "strong") for name in sections}
+    return "fast" if tiers == {"fast"} else "strong"
+
+class ModelRouter:
+    """セクションごとにモデルを割り当て、レート制限時は別モデルへフォールバックする"""
+
+    def __init__(self, selected_model: Optional[str] = None, stats: Optional[ModelStats] = None,
+                 context: Optional[JobContext] = None):
+        self.selected_model = selected_model or config.GOOGLE_MODEL
+        self.stats = stats or model_stats
+        self.context = context  # ジョブの期限と取り消し（呼び出しごとのタイムアウトもここから決める）
+        self.usage: Dict[str, str] = {}  # 処理ラベル -> 実際に使われたモデル
+
+    def candidates(self, tier: str) -> List[str]:
+        """階層に応じたモデル候補を優先順に返す"""
+        primary = list(config.MODEL_ROUTING.get(tier) or [self.selected_model])
+        fallbacks = [self.selected_model] + list(config.MODEL_FALLBACKS)
+
+        # 設定された候補の中ではレイテンシが小さいものを優先する。
+        # まだ計測していないモデルは設定の順番の位置に残す（未計測のモデルが先頭の候補を追い越さない）
+        latencies = {name: self.stats.avg_latency(name) for name in primary}
+        measured = iter(sorted((name for name in primary if latencies[name] is not None), key=latencies.get))
+        primary = [next(measured) if latencies[name] is not None else name for name in primary]
+
+        ordered = []
+        for name in primary + fallbacks:
+            if name and name not in ordered:
+                ordered.append(name)
+
+        # 不調なモデルは最後に回す（全て不調でも候補は残す）
+        healthy = [name for name in ordered if self.stats.is_healthy(name)]
+        return healthy + [name for name in ordered if name not in healthy]
+
+    def _timeout(self, limit: float) -> float:
+        return self.context.call_timeout(limit) if self.context else limit
+
+    def _call(self, tier: str, label: Optional[str], call: Callable[[Any, float], Any],
+              input_tokens: int = 0, quota_suffix: str = "", timeout: Optional[float] = None) -> Any:
+        last_error = None
+        quota = get_quota_scheduler()
+        timeout = timeout or config.GEMINI_TIMEOUT_SECONDS
+        for model_name in self.candidates(tier):
+            model = _get_model(model_name)
+            if model is None:
+                continue
+            # 全プロセス共通のRPM/TPM枠を予約してから呼び出す
+            quota_key = model_name + quota_suffix
+            quota.acquire(quota_key, input_tokens, self.context)
+            start = time.time()
+            try:
+                result = call(model, self._timeout(timeout))
+            except Exception as e:
+                if self.context:
+                    # ジョブの期限切れによるタイムアウトはモデルの不調として記録しない
+                    self.context.check()
+                retryable = is_retryable_error(e)
+                self.stats.record_failure(model_name, retryable)
+                if not retryable:
+                    raise
+                if is_throttling_error(e):
+                    # 遅い応答1回で全プロセス共通の枠を空にしないよう、429・クォータ超過のときだけ報告する
+                    quota.report_throttled(quota_key)
+                logger.warning(f"{model_name} が利用できないためフォールバックします ({label or tier}): {e}")
+                last_error = e
+                continue
+            self.stats.record_success(model_name, time.time() - start)
+            if label:
+                self.usage[label] = model_name
+            return result
+
+        raise last_error or RuntimeError("利用可能なモデルがありません")
+
+    def generate(self, contents: list, tier: str = "strong", label: str = "main_content",
+                 input_tokens: Optional[int] = None):
+        """
+        contents から文章を生成（レスポンスは generate_content の戻り値）
+
+        input_tokens が分かっている場合はそのままTPM枠の予約に使い、
+        不明な場合は事前に数える。
+        """
+        if input_tokens is None:
+            input_tokens = self.count_tokens(contents, tier)
+        logger.info(f"モデル呼び出し ({label}, tier: {tier}, 入力 {input_tokens} トークン)")
+        return self._call(tier, label, lambda model, timeout: replay.generate_content(model, contents, timeout),
+                          input_tokens)
+
+    def count_tokens(self, contents: list, tier: str = "strong") -> int:
+        """
+        入力トークン数を数える
+
+        tier には続けて呼び出す generate と同じ階層を渡す（同じモデルの :count_tokens 枠で数える）。
+        """
+        response = self._call(
+            tier, None, lambda model, timeout: replay.count_tokens(model, contents, timeout),
+            quota_suffix=":count_tokens", timeout=config.GEMINI_COUNT_TOKENS_TIMEOUT_SECONDS
+        )
+        return response.total_tokens
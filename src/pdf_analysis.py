@@ -0,0 +1,136 @@
+from . import config
+from .pdf_stream import open_pdf, release_page_cache
+import logging
+import os
+from typing import Dict, Any, Iterable, Optional, Tuple, List
+
+logger = logging.getLogger(__name__)
+
+def _count_page_images(resources, depth: int = 0) -> int:
+    """ページのリソースに含まれる画像XObjectの数を数える（画像データはデコードしない）"""
+    if resources is None or depth > 3:
+        return 0
+    try:
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            return 0
+        xobjects = xobjects.get_object()
+        count = 0
+        for name in xobjects:
+            xobject = xobjects[name].get_object()
+            subtype = xobject.get("/Subtype")
+            if subtype == "/Image":
+                count += 1
+            elif subtype == "/Form":
+                # フォームXObjectの中に画像が埋め込まれている場合がある
+                count += _count_page_images(xobject.get("/Resources"), depth + 1)
+        return count
+    except Exception as e:
+        logger.debug(f"画像数の取得に失敗: {e}")
+        return 0
+
+def analyze_pdf(pdf_path: str) -> Dict[str, Any]:
+    """
+    PDFをローカルで解析し、処理モードの判定に必要な指標を集める
+
+    Returns:
+        dict: ページ数、ページごとの文字数、画像数、テキスト層のないページ数、ファイルサイズ
+    """
+    analysis = {
+        "file_size_mb": os.path.getsize(pdf_path) / (1024 * 1024),
+        "page_count": 0,
+        "total_chars": 0,
+        "chars_per_page": 0.0,
+        "image_count": 0,
+        "scanned_pages": 0,
+        "error": None,
+    }
+    try:
+        with open_pdf(pdf_path) as reader:
+            analysis["page_count"] = len(reader.pages)
+            for page_num in range(analysis["page_count"]):
+                page = reader.pages[page_num]
+                try:
+                    chars = len((page.extract_text() or "").strip())
+                except Exception:
+                    chars = 0
+                images = _count_page_images(page.get("/Resources"))
+                # 1ページずつ処理し、解析済みのオブジェクトを溜め込まない
+                release_page_cache(reader)
+                analysis["total_chars"] += chars
+                analysis["image_count"] += images
+                # テキストがほぼなく画像だけのページはスキャンとみなす
+                if chars < config.PDF_AUTO_SCANNED_PAGE_CHARS and images > 0:
+                    analysis["scanned_pages"] += 1
+    except Exception as e:
+        logger.warning(f"PDFの解析に失敗: {e}")
+        analysis["error"] = str(e)
+
+    if analysis["page_count"]:
+        analysis["chars_per_page"] = analysis["total_chars"] / analysis["page_count"]
+    return analysis
+
+def choose_pdf_mode(analysis: Dict[str, Any],
+                    sections: Optional[Iterable[str]] = None) -> Tuple[str, List[str]]:
+    """
+    解析結果から内容を失わない最も安価なPDF処理モードを選ぶ
+
+    Returns:
+        (mode, reasons):
+            mode は "text"、"full"、"hybrid"（図表が必要なセクションのみPDF全体を使用）のいずれか
+            reasons は判定理由のリスト
+    """
+    reasons = []
+    page_count = analysis["page_count"]
+
+    if analysis.get("error") or page_count == 0:
+        reasons.append("PDFのテキストを解析できないためPDF全体モードを使用")
+        return "full", reasons
+
+    scanned_ratio = analysis["scanned_pages"] / page_count
+    if scanned_ratio > config.PDF_AUTO_MAX_SCANNED_RATIO:
+        reasons.append(
+            f"テキスト層のないページが多い ({analysis['scanned_pages']}/{page_count} ページ)"
+        )
+        return "full", reasons
+
+    if analysis["chars_per_page"] < config.PDF_AUTO_MIN_CHARS_PER_PAGE:
+        reasons.append(
+            f"ページあたりの文字数が少ない ({analysis['chars_per_page']:.0f} 文字/ページ)"
+        )
+        return "full", reasons
+
+    reasons.append(
+        f"テキスト層あり ({analysis['chars_per_page']:.0f} 文字/ページ, "
+        f"スキャンページ {analysis['scanned_pages']}/{page_count})"
+    )
+
+    figure_sections = [
+        name for name in (sections or [])
+        if config.column_configs.get(name, {}).get("needs_figures", False)
+    ]
+    if not figure_sections:
+        reasons.append("図表を必要とするセクションがないためテキストのみで処理")
+        return "text", reasons
+
+    if analysis["image_count"] == 0:
+        reasons.append("画像が含まれていないためテキストのみで処理")
+        return "text", reasons
+
+    if analysis["file_size_mb"] > config.PDF_AUTO_MAX_FULL_SIZE_MB:
+        reasons.append(
+            f"ファイルサイズが大きいため ({analysis['file_size_mb']:.1f} MB) 図表セクションもテキストで処理"
+        )
+        return "text", reasons
+
+    reasons.append(
+        f"画像 {analysis['image_count']} 件を含むため、{', '.join(figure_sections)} のみPDF全体を使用"
+    )
+    return "hybrid", reasons
+
+def resolve_pdf_mode(pdf_path: str, sections: Optional[Iterable[str]] = None) -> Tuple[str, List[str]]:
+    """PDFを解析して処理モードを決定し、判定内容をログに残す"""
+    analysis = analyze_pdf(pdf_path)
+    mode, reasons = choose_pdf_mode(analysis, sections)
+    logger.info(f"PDF処理モードを自動判定: {mode} ({'; '.join(reasons)})")
+    return mode, reasons
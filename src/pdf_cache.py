@@ -0,0 +1,202 @@
+from . import config
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Callable, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+# Gemini File APIのアップロードは48時間で削除される
+UPLOAD_TTL_SECONDS = 48 * 3600
+# 期限直前のアップロードは使わない（生成中に消えるのを避ける）
+UPLOAD_EXPIRY_MARGIN_SECONDS = 3600
+
+class PdfCache:
+    """
+    入力PDFのハッシュをキーにしたキャッシュ（DATA_DIR/pdf_cache）
+
+    - <hash>.pdf: 元のPDF（後から列を追加したときの再生成用）
+    - <hash>.txt: 抽出済みのテキスト
+    - <hash>.upload.json: Gemini File APIのアップロード名と有効期限
+    - <hash>.upload.<アップロード名>.shared: 別のジョブが使い回した印（取り消し時にリモートのファイルを消さない）
+
+    PDFと抽出テキストの合計は PDF_CACHE_MAX_MB までとし、超えた場合は最後に使った時刻
+    （読み出すたびに更新日時を更新する）が古いものから削除する。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or config.PDF_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}{suffix}")
+
+    def _write_atomic(self, path: str, write):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        """最後に使った時刻として更新日時を更新する（ファイルがなければ False）"""
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def prune(self):
+        """PDFと抽出テキストの合計が PDF_CACHE_MAX_MB を超えていれば、最後に使ったのが古いものから削除する"""
+        limit = config.PDF_CACHE_MAX_MB * 1024 * 1024
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith((".pdf", ".txt")):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= limit:
+            return
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.info(f"PDFキャッシュの上限を超えたため削除: {os.path.basename(path)}")
+
+    def pdf_path(self, digest: str) -> Optional[str]:
+        """キャッシュ済みのPDFのパス（なければNone）"""
+        path = self._path(digest, ".pdf")
+        return path if self._touch(path) else None
+
+    def store_pdf(self, pdf_path: str, digest: str):
+        """元のPDFを保存（PDF_CACHE_KEEP_PDF=false の場合は何もしない）"""
+        if not config.PDF_CACHE_KEEP_PDF or self.pdf_path(digest):
+            return
+        self._write_atomic(self._path(digest, ".pdf"), lambda tmp: shutil.copyfile(pdf_path, tmp))
+        self.prune()
+
+    def text_path(self, digest: str) -> Optional[str]:
+        """抽出済みのテキストのパス（なければNone）"""
+        path = self._path(digest, ".txt")
+        return path if self._touch(path) else None
+
+    def get_text(self, digest: str) -> Optional[str]:
+        path = self.text_path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put_text(self, digest: str, write_text: Callable[[TextIO], None]):
+        """
+        抽出したテキストを保存する
+
+        write_text には書き込み先のファイルが渡される（ページごとに書き込み、全文を文字列にしない）。
+        """
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as file:
+                write_text(file)
+        self._write_atomic(self._path(digest, ".txt"), write)
+        self.prune()
+
+    def _shared_marker(self, digest: str, name: str) -> str:
+        return self._path(digest, f".upload.{name.replace('/', '_')}.shared")
+
+    def _read_upload(self, digest: str) -> Optional[dict]:
+        try:
+            with open(self._path(digest, ".upload.json"), encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def get_upload_name(self, digest: str) -> Optional[str]:
+        """
+        有効期限内のアップロード名を返す
+
+        使い回す前に共有の印を付け、アップロードしたジョブが取り消されてもリモートのファイルを消させない。
+        印を付けた後に記録を読み直し、その間に release_upload で外された（削除される）アップロードは返さない。
+        """
+        upload = self._read_upload(digest)
+        if upload is None or time.time() > upload["expires_at"] - UPLOAD_EXPIRY_MARGIN_SECONDS:
+            return None
+        with open(self._shared_marker(digest, upload["name"]), "a"):
+            pass
+        current = self._read_upload(digest)
+        if current is None or current.get("name") != upload["name"]:
+            return None
+        return upload["name"]
+
+    def put_upload(self, digest: str, uploaded: Any):
+        expiration = getattr(uploaded, "expiration_time", None)
+        expires_at = expiration.timestamp() if expiration else time.time() + UPLOAD_TTL_SECONDS
+
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as file:
+                json.dump({"name": uploaded.name, "expires_at": expires_at}, file)
+        # 以前のアップロードに付いた共有の印は不要になる
+        for marker in glob.glob(glob.escape(self._path(digest, ".upload.")) + "*.shared"):
+            self._remove(marker)
+        self._write_atomic(self._path(digest, ".upload.json"), write)
+
+    def release_upload(self, digest: str, name: str) -> bool:
+        """
+        取り消されたジョブがアップロードしたファイルの記録を消す
+
+        Returns:
+            リモートのファイルを削除してよい場合は True。別のジョブが使い回している場合は記録を残して
+            False を返す（ファイルはGeminiの有効期限で消える）。
+        """
+        path = self._path(digest, ".upload.json")
+        claimed = f"{path}.{os.getpid()}.{threading.get_ident()}.release"
+        try:
+            # 先に記録を外してから共有の印を確認する（以降に get_upload_name を呼んだジョブには渡らない）
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return False
+        try:
+            with open(claimed, encoding="utf-8") as file:
+                upload = json.load(file)
+        except (OSError, ValueError):
+            upload = {}
+        # 別のジョブがアップロードし直した記録や、使い回されているアップロードの記録は戻す
+        if upload.get("name") != name or os.path.exists(self._shared_marker(digest, name)):
+            try:
+                # 外している間に新しく書かれた記録は上書きしない
+                os.link(claimed, path)
+            except FileExistsError:
+                pass
+            self._remove(claimed)
+            return False
+        self._remove(claimed)
+        return True
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+_pdf_cache: Optional[PdfCache] = None
+
+def get_pdf_cache() -> PdfCache:
+    """プロセス内で共有するPDFキャッシュを取得"""
+    global _pdf_cache
+    if _pdf_cache is None:
+        _pdf_cache = PdfCache()
+    return _pdf_cache
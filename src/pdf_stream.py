@@ -0,0 +1,72 @@
+import PyPDF2
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+# アップロードをディスクへ書き出すときの読み込み単位
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_upload(source: BinaryIO, directory: str) -> Tuple[str, str]:
+    """
+    アップロードされたファイルをメモリに載せずにチャンク単位で保存し、同時にSHA-256を計算する
+
+    Returns:
+        (一時ファイルのパス, ハッシュ値)。呼び出し側で最終的な名前に置き換えること
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix=".pdf.part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+@contextmanager
+def open_pdf(pdf_path: str) -> Iterator[PyPDF2.PdfReader]:
+    """
+    保存済みのPDFを開く
+
+    PdfReader にパスを渡すとファイル全体をBytesIOに読み込むため、ファイルオブジェクトを渡して
+    必要な部分だけをシークして読ませる。
+    （mmapも試したが、書き込み直後のファイルではマップしたページがRSSに乗り、ファイルサイズ分増えた）
+    """
+    with open(pdf_path, "rb") as file:
+        yield PyPDF2.PdfReader(file)
+
+def release_page_cache(reader: PyPDF2.PdfReader):
+    """
+    読み込み済みのオブジェクト（デコード済みのコンテンツストリームなど）を手放す
+
+    PdfReader は解決したオブジェクトを文書全体分保持し続けるため、
+    ページ単位で処理するときは1ページごとに破棄してピークメモリを抑える。
+    """
+    reader.resolved_objects.clear()
+
+def iter_page_texts(reader: PyPDF2.PdfReader) -> Iterator[str]:
+    """ページごとにテキストを抽出する（抽出後は該当ページのキャッシュを破棄）"""
+    for page_num in range(len(reader.pages)):
+        try:
+            yield reader.pages[page_num].extract_text() or ""
+        finally:
+            release_page_cache(reader)
+
+def write_text(pdf_path: str, file: TextIO):
+    """PDFのテキストを1ページずつ抽出して file に書き込む（全文を文字列として保持しない）"""
+    with open_pdf(pdf_path) as reader:
+        for text in iter_page_texts(reader):
+            file.write(text)
+
+def extract_text(pdf_path: str) -> str:
+    """PDFのテキストを1ページずつ抽出して返す（キャッシュに保存する場合は write_text を使う）"""
+    with open_pdf(pdf_path) as reader:
+        return "".join(iter_page_texts(reader))
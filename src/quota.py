@@ -0,0 +1,190 @@
+from . import config
+from .db import connect, immediate_transaction, open_connection
+from .replay import get_traffic
+from .job_context import JobContext, sleep
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Notion APIの呼び出しをまとめて制限するためのクォータキー
+NOTION_QUOTA_KEY = "notion"
+
+class QuotaScheduler:
+    """
+    Gemini呼び出し（およびNotionの一括取得）のRPM/TPMを管理するトークンバケット
+
+    状態はローカルのSQLiteに保存するため、複数のワーカープロセス間で共有される。
+    呼び出し元はモデルごとのFIFOキューに並び、先頭の呼び出しだけが容量を予約できる。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.QUOTA_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS waiters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS waiters_key ON waiters (key, id)")
+
+    def _connect(self):
+        # スレッドごとに接続を作る（autocommitにしてトランザクションは明示的に張る）
+        return connect(self.db_path, autocommit=True)
+
+    @staticmethod
+    def limits_for(key: str) -> Dict[str, float]:
+        """キー（モデル名）に対応するRPM/TPMの上限を返す"""
+        if key.endswith(":count_tokens"):
+            return {"rpm": config.COUNT_TOKENS_RPM, "tpm": float("inf")}
+        if key == NOTION_QUOTA_KEY:
+            return {"rpm": config.NOTION_RPM, "tpm": float("inf")}
+        return config.GEMINI_RATE_LIMITS.get(key, config.GEMINI_RATE_LIMITS["default"])
+
+    def _refill(self, conn: sqlite3.Connection, key: str, now: float):
+        """経過時間に応じてバケットを補充し、(requests, tokens) を返す"""
+        limits = self.limits_for(key)
+        row = conn.execute(
+            "SELECT requests, tokens, updated FROM buckets WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            requests, tokens = float(limits["rpm"]), float(limits["tpm"])
+        else:
+            requests, tokens, updated = row
+            elapsed = max(0.0, now - updated)
+            requests = min(limits["rpm"], requests + elapsed * limits["rpm"] / 60.0)
+            tokens = min(limits["tpm"], tokens + elapsed * limits["tpm"] / 60.0)
+        return requests, tokens, limits
+
+    def _save(self, conn: sqlite3.Connection, key: str, requests: float, tokens: float, now: float):
+        # inf はSQLiteに保存できないため上限なしは大きな値で表す
+        tokens = min(tokens, 1e18)
+        conn.execute(
+            "INSERT INTO buckets (key, requests, tokens, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET requests = excluded.requests, "
+            "tokens = excluded.tokens, updated = excluded.updated",
+            (key, requests, tokens, now)
+        )
+
+    def acquire(self, key: str, tokens: int = 0, context: Optional[JobContext] = None) -> float:
+        """
+        1リクエスト分と tokens 分の容量を予約する（空くまでブロックする）
+
+        context のジョブが取り消された・期限を過ぎた場合は待ち行列から外れて JobCancelled を送出する。
+
+        Returns:
+            float: 待機した秒数
+        """
+        if get_traffic().mode == "replay":
+            # 再生時はAPIを呼び出さないため枠を消費しない（待ち時間は TRAFFIC_REPLAY_LATENCY で再現する）
+            return 0.0
+        start = time.time()
+        conn = open_connection(self.db_path, autocommit=True)
+        ticket = None
+        try:
+            ticket = conn.execute(
+                "INSERT INTO waiters (key, pid, created, heartbeat) VALUES (?, ?, ?, ?)",
+                (key, os.getpid(), start, start)
+            ).lastrowid
+
+            while True:
+                if context:
+                    context.check()
+                now = time.time()
+                acquired = False
+                wait = config.QUOTA_POLL_SECONDS
+                with immediate_transaction(conn):
+                    # 異常終了したプロセスの待ち行列を掃除
+                    conn.execute(
+                        "DELETE FROM waiters WHERE heartbeat < ?",
+                        (now - config.QUOTA_STALE_WAITER_SECONDS,)
+                    )
+                    conn.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, ticket))
+                    head = conn.execute(
+                        "SELECT id FROM waiters WHERE key = ? ORDER BY id LIMIT 1", (key,)
+                    ).fetchone()
+
+                    if head and head[0] == ticket:
+                        available_requests, available_tokens, limits = self._refill(conn, key, now)
+                        # 1回でTPM上限を超える入力は上限いっぱいまでの予約とする
+                        needed_tokens = min(float(tokens), limits["tpm"])
+                        if available_requests >= 1 and available_tokens >= needed_tokens:
+                            self._save(conn, key, available_requests - 1,
+                                       available_tokens - needed_tokens, now)
+                            conn.execute("DELETE FROM waiters WHERE id = ?", (ticket,))
+                            acquired = True
+                        else:
+                            # 不足分が補充されるまでの時間を見積もる
+                            request_wait = (1 - available_requests) * 60.0 / limits["rpm"]
+                            token_wait = (needed_tokens - available_tokens) * 60.0 / limits["tpm"]
+                            wait = max(request_wait, token_wait, 0.05)
+                if acquired:
+                    waited = time.time() - start
+                    if waited > 1:
+                        logger.info(f"クォータ待ち {waited:.1f}秒 ({key}, {tokens} トークン)")
+                    return waited
+                sleep(context, min(wait, config.QUOTA_MAX_SLEEP_SECONDS))
+        finally:
+            # 中断された場合も待ち行列から外す
+            if ticket is not None:
+                try:
+                    conn.execute("DELETE FROM waiters WHERE id = ?", (ticket,))
+                except Exception:
+                    pass
+            conn.close()
+
+    def report_throttled(self, key: str):
+        """APIから429を受けた場合にバケットを空にし、全プロセスで一斉に待機させる"""
+        with self._connect() as conn, immediate_transaction(conn):
+            now = time.time()
+            _, tokens, _ = self._refill(conn, key, now)
+            self._save(conn, key, 0.0, tokens, now)
+
+    def queue_depth(self, key: str) -> int:
+        """キーごとの待ち行列の長さ"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM waiters WHERE key = ?", (key,)).fetchone()
+            return row[0]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """全キーの待ち行列の長さとバケットの残量"""
+        now = time.time()
+        result: Dict[str, Dict[str, Any]] = {}
+        with self._connect() as conn:
+            keys = {row[0] for row in conn.execute("SELECT key FROM buckets")}
+            depths = dict(conn.execute("SELECT key, COUNT(*) FROM waiters GROUP BY key").fetchall())
+            for key in keys | set(depths):
+                requests, tokens, limits = self._refill(conn, key, now)
+                result[key] = {
+                    "queue_depth": depths.get(key, 0),
+                    "available_requests": round(requests, 2),
+                    "available_tokens": None if limits["tpm"] == float("inf") else int(tokens),
+                    "rpm": limits["rpm"],
+                    "tpm": None if limits["tpm"] == float("inf") else limits["tpm"],
+                }
+        return result
+
+_scheduler: Optional[QuotaScheduler] = None
+
+def get_quota_scheduler() -> QuotaScheduler:
+    """プロセス内で共有するスケジューラを取得"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = QuotaScheduler()
+    return _scheduler
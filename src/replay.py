@@ -0,0 +1,364 @@
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import protos, types
+from notion_client import Client
+from . import config
+from .job_store import hash_file
+import argparse
+import collections
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from importlib import metadata
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# カセットの形式のバージョン（記録内容の形式を変えたら上げる。異なるバージョンのカセットは再生しない）
+CASSETTE_VERSION = 1
+TRAFFIC_MODES = ("off", "record", "replay")
+
+class CassetteMiss(LookupError):
+    """再生時にカセットに該当するリクエストが記録されていない"""
+
+class ReplayedError(RuntimeError):
+    """記録時に発生したエラー（Google APIの例外以外）を再生したもの"""
+
+def _canonical(value: Any) -> Any:
+    """リクエストを比較用のJSON互換の値に変換する（PDFやアップロードはハッシュ・名前で表す）"""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, bytes):
+        return {"sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, types.File):
+        return {"file": value.name}
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(type(value), "to_dict"):
+        return _canonical(type(value).to_dict(value))
+    return repr(value)
+
+def fingerprint(kind: str, request: Any) -> str:
+    payload = json.dumps([kind, _canonical(request)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _library_versions() -> Dict[str, Optional[str]]:
+    versions = {}
+    for package in ("google-generativeai", "notion-client"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+class TrafficRecorder:
+    """
+    Gemini・Notionへのリクエストとレスポンスの組をカセット（JSONL）に記録し、再生する
+
+    - off: そのままAPIを呼び出す
+    - record: APIを呼び出し、結果（エラーを含む）と所要時間をカセットに追記する
+    - replay: APIを呼ばずにカセットから結果を返す。latency_scale > 0 の場合は記録時の所要時間×倍率だけ待つ
+
+    再生時はリクエスト内容のハッシュで照合する。同じリクエストが複数回記録されている場合は記録順に返し、
+    使い切った後は最後の結果を返し続ける。strict でない場合、一致するものがなければ同じ経路
+    （Geminiはモデル、NotionはメソッドとURLパス）の未使用の記録を順に返す。
+    """
+
+    def __init__(self, mode: str = "off", cassette_path: Optional[str] = None,
+                 latency_scale: float = 0.0, strict: bool = False):
+        if mode not in TRAFFIC_MODES:
+            raise ValueError(f"不明な TRAFFIC_MODE です: {mode}（{', '.join(TRAFFIC_MODES)} のいずれか）")
+        self.mode = mode
+        self.cassette_path = cassette_path
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._interactions: List[Dict[str, Any]] = []
+        self._by_key: Dict[str, Deque[int]] = collections.defaultdict(collections.deque)
+        self._last_by_key: Dict[str, int] = {}
+        self._by_route: Dict[str, Deque[int]] = collections.defaultdict(collections.deque)
+        self._used: set = set()
+        self.served: collections.Counter = collections.Counter()
+        if mode == "replay":
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _load(self):
+        if not self.cassette_path or not os.path.exists(self.cassette_path):
+            raise FileNotFoundError(f"カセットが見つかりません: {self.cassette_path}")
+        with open(self.cassette_path, encoding="utf-8") as file:
+            header = json.loads(file.readline() or "{}")
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(
+                    f"カセットのバージョンが一致しません: {header.get('version')}"
+                    f"（対応バージョン {CASSETTE_VERSION}）。記録し直してください"
+                )
+            for line in file:
+                if line.strip():
+                    self._interactions.append(json.loads(line))
+        for index, interaction in enumerate(self._interactions):
+            self._by_key[interaction["key"]].append(index)
+            self._last_by_key[interaction["key"]] = index
+            self._by_route[interaction["route"]].append(index)
+        logger.info(f"カセットを読み込みました: {self.cassette_path} ({len(self._interactions)} 件)")
+
+    def _append(self, interaction: Dict[str, Any]):
+        """カセットに1件追記する（複数ワーカーが同じカセットに記録できるようファイルロックを取る）"""
+        os.makedirs(os.path.dirname(self.cassette_path) or ".", exist_ok=True)
+        line = json.dumps(interaction, ensure_ascii=False) + "\n"
+        with self._lock, open(self.cassette_path, "a", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                if file.tell() == 0:
+                    header = {"version": CASSETTE_VERSION, "created_at": datetime.now().isoformat(),
+                              "libraries": _library_versions()}
+                    file.write(json.dumps(header) + "\n")
+                file.write(line)
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _take(self, key: str, route: str) -> Dict[str, Any]:
+        with self._lock:
+            queue = self._by_key.get(key)
+            while queue and queue[0] in self._used:
+                queue.popleft()
+            if queue:
+                index = queue.popleft()
+            elif key in self._last_by_key:
+                index = self._last_by_key[key]
+            elif not self.strict and self._by_route.get(route):
+                queue = self._by_route[route]
+                while queue and queue[0] in self._used:
+                    queue.popleft()
+                if not queue:
+                    raise CassetteMiss(f"カセットに記録がありません: {route}")
+                index = queue.popleft()
+                logger.warning(f"リクエストが一致しないため同じ経路の記録を返します: {route}")
+            else:
+                raise CassetteMiss(f"カセットに記録がありません: {route}")
+            self._used.add(index)
+            self.served[route.split(" ")[0]] += 1
+            return self._interactions[index]
+
+    def call(self, kind: str, route: str, request: Any, live: Callable[[], Any],
+             encode: Callable[[Any], Any], decode: Callable[[Any], Any]) -> Any:
+        """
+        1回分のAPI呼び出しを記録・再生する
+
+        Args:
+            kind: 呼び出しの種類（generate_content, count_tokens, upload_file, get_file, delete_file, notion）
+            route: 照合に使う経路（"<kind> <モデル名>" や "notion POST pages" など）
+            request: 照合に使うリクエスト内容
+            live: 実際にAPIを呼び出す関数
+            encode: レスポンスをJSON互換の値に変換する関数
+            decode: encode した値からレスポンスを復元する関数
+        """
+        if self.mode == "off":
+            return live()
+
+        key = fingerprint(kind, request)
+        if self.mode == "replay":
+            interaction = self._take(key, route)
+            if self.latency_scale > 0:
+                time.sleep(interaction["elapsed"] * self.latency_scale)
+            if "error" in interaction:
+                raise _rebuild_error(interaction["error"])
+            return decode(interaction["response"])
+
+        start = time.time()
+        try:
+            result = live()
+        except Exception as e:
+            self._append({"key": key, "route": route, "elapsed": time.time() - start,
+                          "error": {"type": type(e).__name__, "message": getattr(e, "message", None) or str(e)}})
+            raise
+        self._append({"key": key, "route": route, "elapsed": time.time() - start,
+                      "response": encode(result)})
+        return result
+
+def _rebuild_error(error: Dict[str, str]) -> Exception:
+    """記録したエラーを例外に戻す（Google APIの例外は同じ型にしてフォールバック判定を再現する）"""
+    error_class = getattr(google_exceptions, error["type"], None)
+    if isinstance(error_class, type) and issubclass(error_class, google_exceptions.GoogleAPICallError):
+        return error_class(error["message"])
+    return ReplayedError(f"{error['type']}: {error['message']}")
+
+def _proto_to_dict(message: Any) -> Dict[str, Any]:
+    return type(message).to_dict(message)
+
+def _file_to_dict(file: types.File) -> Dict[str, Any]:
+    return _proto_to_dict(file.to_proto())
+
+def _file_from_dict(data: Dict[str, Any]) -> types.File:
+    return types.File(protos.File(data))
+
+def _model_name(model: Any) -> str:
+    return getattr(model, "model_name", None) or str(model)
+
+def _request_options(timeout: Optional[float]) -> Dict[str, Any]:
+    return {"request_options": {"timeout": timeout}} if timeout else {}
+
+def generate_content(model: Any, contents: list, timeout: Optional[float] = None) -> Any:
+    """model.generate_content(contents) を記録・再生する（timeout は照合に含めない）"""
+    name = _model_name(model)
+    return get_traffic().call(
+        "generate_content", f"generate_content {name}", [name, contents],
+        lambda: model.generate_content(contents, **_request_options(timeout)),
+        lambda response: response.to_dict(),
+        lambda data: types.GenerateContentResponse.from_response(protos.GenerateContentResponse(data)),
+    )
+
+def count_tokens(model: Any, contents: list, timeout: Optional[float] = None) -> Any:
+    """model.count_tokens(contents) を記録・再生する"""
+    name = _model_name(model)
+    return get_traffic().call(
+        "count_tokens", f"count_tokens {name}", [name, contents],
+        lambda: model.count_tokens(contents, **_request_options(timeout)),
+        _proto_to_dict,
+        lambda data: protos.CountTokensResponse(data),
+    )
+
+def upload_file(pdf_path: str) -> types.File:
+    """genai.upload_file を記録・再生する（PDFの内容のハッシュで照合する）"""
+    return get_traffic().call(
+        "upload_file", "upload_file", hash_file(pdf_path),
+        lambda: genai.upload_file(pdf_path),
+        _file_to_dict, _file_from_dict,
+    )
+
+def get_file(name: str) -> types.File:
+    """genai.get_file を記録・再生する"""
+    return get_traffic().call(
+        "get_file", "get_file", name,
+        lambda: genai.get_file(name),
+        _file_to_dict, _file_from_dict,
+    )
+
+def delete_file(name: str):
+    """genai.delete_file を記録・再生する"""
+    return get_traffic().call(
+        "delete_file", "delete_file", name,
+        lambda: genai.delete_file(name),
+        lambda response: None,
+        lambda data: None,
+    )
+
+class ReplayClient(Client):
+    """
+    すべてのリクエストを記録・再生するNotionクライアント
+
+    notion_client のエンドポイント（pages.create, blocks.children.append など）は
+    すべて Client.request を経由するため、ここで記録・再生する。
+    """
+
+    def request(self, path: str, method: str, query: Optional[Dict[Any, Any]] = None,
+                body: Optional[Dict[Any, Any]] = None, form_data: Optional[Dict[Any, Any]] = None,
+                auth: Optional[Any] = None) -> Any:
+        return get_traffic().call(
+            "notion", f"notion {method} {path}", [method, path, query, body],
+            lambda: super(ReplayClient, self).request(path, method, query, body, form_data, auth),
+            lambda response: response,
+            lambda data: data,
+        )
+
+def create_notion_client(auth: Optional[str] = None) -> Client:
+    """Notionクライアントを作成する（TRAFFIC_MODE が off 以外の場合は記録・再生用）"""
+    client_class = ReplayClient if get_traffic().enabled else Client
+    return client_class(auth=auth or config.NOTION_API_KEY,
+                        timeout_ms=int(config.NOTION_TIMEOUT_SECONDS * 1000))
+
+def cassette_path(name: str) -> str:
+    """カセット名（またはパス）からファイルのパスを決める"""
+    if os.sep in name or name.endswith(".jsonl"):
+        return name
+    return os.path.join(config.CASSETTE_DIR, f"{name}.jsonl")
+
+_traffic: Optional[TrafficRecorder] = None
+_traffic_lock = threading.Lock()
+
+def configure_traffic(mode: str, cassette: str, latency_scale: float = 0.0,
+                      strict: bool = False) -> TrafficRecorder:
+    """プロセス内で共有する記録・再生の設定を差し替える（APIクライアントの作成前に呼ぶこと）"""
+    global _traffic
+    recorder = TrafficRecorder(mode, cassette_path(cassette), latency_scale, strict)
+    with _traffic_lock:
+        _traffic = recorder
+    if recorder.enabled:
+        logger.info(f"API通信の{'記録' if mode == 'record' else '再生'}: {recorder.cassette_path}")
+    return recorder
+
+def get_traffic() -> TrafficRecorder:
+    global _traffic
+    with _traffic_lock:
+        if _traffic is None:
+            _traffic = TrafficRecorder(config.TRAFFIC_MODE, cassette_path(config.TRAFFIC_CASSETTE),
+                                       config.TRAFFIC_REPLAY_LATENCY, config.TRAFFIC_REPLAY_STRICT)
+        return _traffic
+
+def cassette_info(path: str) -> Dict[str, Any]:
+    """カセットの中身を経路ごとに集計する（件数・エラー数・記録時の所要時間）"""
+    with open(path, encoding="utf-8") as file:
+        header = json.loads(file.readline() or "{}")
+        interactions = [json.loads(line) for line in file if line.strip()]
+    routes: Dict[str, Dict[str, Any]] = {}
+    for interaction in interactions:
+        stats = routes.setdefault(interaction["route"], {"count": 0, "errors": 0, "elapsed": 0.0})
+        stats["count"] += 1
+        stats["errors"] += "error" in interaction
+        stats["elapsed"] += interaction["elapsed"]
+    return {"header": header, "interactions": len(interactions), "routes": routes}
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Gemini・Notionの通信の記録と再生")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info_parser = subparsers.add_parser("info", help="カセットの内容を表示")
+    info_parser.add_argument("cassette", help="カセット名またはファイルのパス")
+
+    run_parser = subparsers.add_parser("run", help="PDFの要約からNotionへの書き込みまでを記録・再生して時間を計測")
+    run_parser.add_argument("pdf_path", help="要約するPDFファイルのパス")
+    run_parser.add_argument("--cassette", default=config.TRAFFIC_CASSETTE, help="カセット名またはファイルのパス")
+    run_parser.add_argument("--mode", choices=("record", "replay"), default="replay")
+    run_parser.add_argument("--latency", type=float, default=config.TRAFFIC_REPLAY_LATENCY,
+                            help="再生時に記録時の所要時間の何倍待つか（0で待たない）")
+    run_parser.add_argument("--strict", action="store_true", help="リクエストが完全に一致する記録のみ再生する")
+    run_parser.add_argument("--repeat", type=int, default=1, help="再生する回数")
+    run_parser.add_argument("--model", default=None, help="使用するモデル")
+    run_parser.add_argument("--summary-mode", default="concise", help="要約モード")
+    run_parser.add_argument("--pdf-mode", default="text", help="PDF処理モード")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        info = cassette_info(cassette_path(args.cassette))
+        print(json.dumps(info["header"], ensure_ascii=False))
+        print(f"{'route':<60} {'count':>6} {'errors':>7} {'elapsed[s]':>11}")
+        for route, stats in sorted(info["routes"].items()):
+            print(f"{route[:60]:<60} {stats['count']:>6} {stats['errors']:>7} {stats['elapsed']:>11.2f}")
+    else:
+        from .add_notion import NotionSummaryWriter
+        repeat = args.repeat if args.mode == "replay" else 1
+        for run in range(repeat):
+            # 実行ごとにカセットを読み直し、毎回同じ順序で再生する
+            recorder = configure_traffic(args.mode, args.cassette, args.latency, args.strict)
+            writer = NotionSummaryWriter(config)
+            start = time.time()
+            result = writer.add_summary(args.pdf_path, args.model, args.summary_mode, args.pdf_mode) or {}
+            served = dict(recorder.served) if args.mode == "replay" else {}
+            status = "ok" if result.get("success") else f"failed: {result.get('error')}"
+            print(f"run {run + 1}: {time.time() - start:.2f}s {status} {json.dumps(served)}")
+
+if __name__ == "__main__":
+    # 他のモジュールが参照する src.replay と同じ設定を使うため、パッケージ経由で読み込んで実行する
+    from .replay import main as run_main
+    run_main()
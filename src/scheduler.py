@@ -0,0 +1,370 @@
+from . import config
+from .chat_pdf import get_needed_sections
+from .db import connect
+from .memory_budget import get_memory_budget
+from .pdf_cache import get_pdf_cache
+from .pdf_stream import open_pdf
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 優先度（この順に処理する）。interactive は画面で結果を待っているジョブ
+PRIORITIES = ("interactive", "background")
+
+# コスト見積もりの係数
+CHARS_PER_TOKEN = 4
+TOKENS_PER_PAGE = 800  # テキスト未抽出のPDFの1ページあたりの見積もり
+TOKENS_PER_MB = 20_000  # ページ数も読めないPDFのファイルサイズあたりの見積もり
+SECTION_OUTPUT_TOKENS = {True: 400, False: 2500}  # 必須セクション / 詳細モードのみの長文セクション
+
+def estimate_pdf_tokens(pdf_path: str, input_hash: Optional[str] = None) -> int:
+    """PDFの入力トークン数の見積もり（抽出済みテキストがあればその長さ、なければページ数から）"""
+    if input_hash:
+        text = get_pdf_cache().get_text(input_hash)
+        if text is not None:
+            return len(text) // CHARS_PER_TOKEN
+    try:
+        with open_pdf(pdf_path) as reader:
+            return len(reader.pages) * TOKENS_PER_PAGE
+    except Exception:
+        return int(os.path.getsize(pdf_path) / (1024 * 1024) * TOKENS_PER_MB)
+
+def estimate_job_cost(pdf_path: Optional[str], summary_mode: str, input_hash: Optional[str] = None,
+                      sections: Optional[Iterable[str]] = None) -> float:
+    """
+    ジョブの重さの見積もり（トークン換算）
+
+    PDFを入力とする呼び出し回数 × PDFのトークン数 に、生成するセクションの出力トークン数
+    （生成は入力より遅いため SCHEDULER_OUTPUT_TOKEN_WEIGHT 倍）を加える。
+    """
+    needed = set(sections) if sections is not None else get_needed_sections(summary_mode)
+    configs = [config.column_configs[name] for name in needed if name in config.column_configs]
+    # タイトルをローカルで抽出する場合、Name はPDFを送らない翻訳の呼び出しだけになる
+    first = [name for name in needed if config.column_configs.get(name, {}).get("process_first")]
+    calls = sum(1 for name in first if not (name == "Name" and config.TITLE_LOCAL_EXTRACTION)) + 1
+    calls += any(cfg.get("needs_figures") for cfg in configs)
+    output_tokens = sum(SECTION_OUTPUT_TOKENS[bool(cfg.get("required"))] for cfg in configs)
+    pdf_tokens = estimate_pdf_tokens(pdf_path, input_hash) if pdf_path and os.path.exists(pdf_path) else 0
+    return float(pdf_tokens * calls + output_tokens * config.SCHEDULER_OUTPUT_TOKEN_WEIGHT)
+
+class ScheduledJob:
+    """スケジューラに投入された1ジョブ"""
+
+    def __init__(self, task: Callable[[], Any], priority: str, summary_mode: str, submitter: str,
+                 cost: float, label: str, memory_mb: float = 0.0):
+        self.task = task
+        self.priority = priority
+        self.summary_mode = summary_mode
+        self.submitter = submitter
+        self.cost = max(cost, 1.0)
+        self.label = label
+        self.memory_mb = memory_mb
+        self.reservation_id: Optional[str] = None
+        self.submitted_at = time.time()
+        self.future: Future = Future()
+
+    @property
+    def job_class(self) -> str:
+        return f"{self.priority}:{self.summary_mode}"
+
+class FairQueue:
+    """
+    要約モードごと・投入者ごとの待ち行列を重み付きで公平に取り出す（ストライドスケジューリング）
+
+    - 要約モード間: 取り出したジョブのコスト / 重み だけ、そのモードの仮想時間を進め、仮想時間が最小のモードから取り出す
+    - 投入者間: 同様に（重みは均等）
+    - 投入者の中: 見積もりコストの小さい順（同じなら投入順）
+    空になった待ち行列は削除し、再び投入されたときは現在の仮想時間から始める（待っていなかった分を貯め込まない）。
+    """
+
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = weights
+        self._classes: Dict[str, Dict[str, Any]] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, job: ScheduledJob):
+        job_class = self._classes.setdefault(job.summary_mode, {"pass": self._virtual_time, "submitters": {}})
+        submitter = job_class["submitters"].setdefault(
+            job.submitter, {"pass": self._min_submitter_pass(job_class), "heap": []}
+        )
+        heapq.heappush(submitter["heap"], (job.cost, next(self._sequence), job))
+        self._size += 1
+
+    @staticmethod
+    def _min_submitter_pass(job_class: Dict[str, Any]) -> float:
+        passes = [s["pass"] for s in job_class["submitters"].values()]
+        return min(passes) if passes else 0.0
+
+    def pop(self, admit: Optional[Callable[[ScheduledJob], bool]] = None) -> Optional[ScheduledJob]:
+        """
+        次のジョブを取り出す
+
+        admit を指定した場合は、公平性の順に admit が True を返す最初のジョブを取り出す
+        （先頭のジョブが開始できなければ次のジョブを試す）。該当するジョブがなければ None。
+        """
+        for mode in sorted(self._classes, key=lambda name: (self._classes[name]["pass"], name)):
+            job_class = self._classes[mode]
+            for name in sorted(job_class["submitters"], key=lambda s: (job_class["submitters"][s]["pass"], s)):
+                heap = job_class["submitters"][name]["heap"]
+                for entry in ([heap[0]] if admit is None else sorted(heap)):
+                    if admit is None or admit(entry[2]):
+                        return self._take(mode, name, entry)
+        return None
+
+    def _take(self, mode: str, name: str, entry) -> ScheduledJob:
+        job_class = self._classes[mode]
+        submitter = job_class["submitters"][name]
+        if submitter["heap"][0] is entry:
+            heapq.heappop(submitter["heap"])
+        else:
+            submitter["heap"].remove(entry)
+            heapq.heapify(submitter["heap"])
+        job = entry[2]
+        self._size -= 1
+
+        self._virtual_time = job_class["pass"]
+        job_class["pass"] += job.cost / self.weights.get(mode, 1.0)
+        submitter["pass"] += job.cost
+        if not submitter["heap"]:
+            del job_class["submitters"][name]
+        if not job_class["submitters"]:
+            del self._classes[mode]
+        return job
+
+    def depths(self) -> Dict[str, int]:
+        return {
+            mode: sum(len(s["heap"]) for s in job_class["submitters"].values())
+            for mode, job_class in self._classes.items()
+        }
+
+class QueueMetrics:
+    """ジョブの待ち時間の記録（SQLite, 全ワーカーで共有）"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.SCHEDULER_DB_PATH
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with connect(self.db_path) as conn:
+            if not self._initialized:
+                with self._init_lock:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS queue_waits (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            job_class TEXT NOT NULL,
+                            submitter TEXT,
+                            cost REAL,
+                            waited REAL NOT NULL,
+                            started_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS queue_waits_started_at ON queue_waits (started_at)")
+                    self._initialized = True
+            yield conn
+
+    def record(self, job: ScheduledJob, waited: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO queue_waits (job_class, submitter, cost, waited, started_at) VALUES (?, ?, ?, ?, ?)",
+                (job.job_class, job.submitter, job.cost, waited, now)
+            )
+            conn.execute("DELETE FROM queue_waits WHERE started_at < ?",
+                         (now - config.SCHEDULER_METRICS_RETENTION_SECONDS,))
+
+    def summary(self, window: float) -> Dict[str, Dict[str, Any]]:
+        """直近 window 秒に開始したジョブの、クラスごとの待ち時間の統計"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_class, waited FROM queue_waits WHERE started_at >= ? ORDER BY waited",
+                (time.time() - window,)
+            ).fetchall()
+        waits: Dict[str, List[float]] = {}
+        for job_class, waited in rows:
+            waits.setdefault(job_class, []).append(waited)
+        return {
+            job_class: {
+                "started": len(values),
+                "avg_wait": round(sum(values) / len(values), 2),
+                "p50_wait": round(_percentile(values, 0.5), 2),
+                "p95_wait": round(_percentile(values, 0.95), 2),
+                "max_wait": round(values[-1], 2),
+            }
+            for job_class, values in waits.items()
+        }
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class JobScheduler:
+    """
+    要約ジョブのスケジューラ（ワーカープロセスごと）
+
+    interactive のジョブはバックグラウンドのジョブより常に先に取り出す。
+    バックグラウンドのジョブが同時に使えるスレッドは BATCH_CONCURRENCY までとし、
+    残りの SCHEDULER_INTERACTIVE_SLOTS 本は画面で待っているジョブのために空けておく。
+    各優先度の中では FairQueue で要約モード・投入者の間を公平に分け、軽いジョブから処理する。
+    """
+
+    def __init__(self, background_slots: Optional[int] = None, interactive_slots: Optional[int] = None,
+                 weights: Optional[Dict[str, float]] = None, metrics: Optional[QueueMetrics] = None):
+        self.background_slots = background_slots or config.BATCH_CONCURRENCY
+        self.interactive_slots = config.SCHEDULER_INTERACTIVE_SLOTS if interactive_slots is None else interactive_slots
+        weights = weights or config.SCHEDULER_WEIGHTS
+        self.metrics = metrics or QueueMetrics()
+        self._queues = {priority: FairQueue(weights) for priority in PRIORITIES}
+        self._running: Dict[str, int] = {}
+        self._running_background = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def _start(self):
+        if self._threads:
+            return
+        for index in range(self.background_slots + self.interactive_slots):
+            thread = threading.Thread(target=self._worker, name=f"scheduler-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, task: Callable[[], Any], summary_mode: str = "concise", submitter: str = "anonymous",
+               cost: float = 0.0, interactive: bool = False, label: str = "", memory_mb: float = 0.0) -> Future:
+        """
+        ジョブを投入する
+
+        Args:
+            task: 実行する処理（引数なしで呼べるもの）
+            cost: estimate_job_cost による見積もり（同じ投入者の中で小さい順に処理する）
+            interactive: 画面で結果を待っているジョブか
+            memory_mb: estimate_job_memory_mb による見積もり（予約できるまでジョブを開始しない）
+
+        Returns:
+            Future: task の戻り値（例外）を受け取る
+        """
+        job = ScheduledJob(task, "interactive" if interactive else "background", summary_mode,
+                           submitter, cost, label, memory_mb)
+        with self._cond:
+            self._start()
+            self._queues[job.priority].push(job)
+            self._cond.notify_all()
+        logger.info(f"ジョブを投入: {label} ({job.job_class}, 投入者 {submitter}, 見積もり {job.cost:,.0f})")
+        return job.future
+
+    def _admit(self, job: ScheduledJob) -> bool:
+        """メモリの予約（全ワーカーで共有）が取れたジョブだけを開始する"""
+        try:
+            job.reservation_id = get_memory_budget().try_admit(job.memory_mb, job.label)
+        except Exception as e:
+            # 予約できない場合はジョブの中（get_summary）で予約を待つ
+            logger.warning(f"メモリの予約に失敗: {job.label}: {e}")
+            job.reservation_id = ""
+        return job.reservation_id is not None
+
+    def _next_job(self) -> ScheduledJob:
+        with self._cond:
+            while True:
+                job = None
+                waiting_for_memory = False
+                if self._queues["interactive"]:
+                    job = self._queues["interactive"].pop(self._admit)
+                    waiting_for_memory = job is None
+                if job is None and self._queues["background"] and self._running_background < self.background_slots:
+                    job = self._queues["background"].pop(self._admit)
+                    if job is None:
+                        waiting_for_memory = True
+                    else:
+                        self._running_background += 1
+                if job is not None:
+                    break
+                # メモリの空きは他のワーカーが解放しても通知されないため、定期的に確認する
+                self._cond.wait(config.MEMORY_POLL_SECONDS if waiting_for_memory else None)
+            self._running[job.job_class] = self._running.get(job.job_class, 0) + 1
+            return job
+
+    def _finish(self, job: ScheduledJob):
+        with self._cond:
+            self._running[job.job_class] -= 1
+            if job.priority == "background":
+                self._running_background -= 1
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            try:
+                waited = time.time() - job.submitted_at
+                try:
+                    self.metrics.record(job, waited)
+                except Exception as e:
+                    logger.warning(f"待ち時間の記録に失敗: {e}")
+                if waited > 1:
+                    logger.info(f"ジョブを開始: {job.label} ({job.job_class}, 待ち {waited:.1f}秒)")
+                with get_memory_budget().hold(job.reservation_id):
+                    if job.future.set_running_or_notify_cancel():
+                        try:
+                            job.future.set_result(job.task())
+                        except BaseException as e:
+                            logger.error(f"ジョブでエラーが発生: {job.label}: {e}")
+                            job.future.set_exception(e)
+            finally:
+                self._finish(job)
+
+    def status(self) -> Dict[str, Any]:
+        """クラス（優先度:要約モード）ごとの待ち行列の長さ・実行中の数（このワーカー）と待ち時間の統計（全ワーカー）"""
+        with self._cond:
+            classes: Dict[str, Dict[str, Any]] = {}
+            for priority, queue in self._queues.items():
+                for mode, depth in queue.depths().items():
+                    classes.setdefault(f"{priority}:{mode}", {})["queued"] = depth
+            for job_class, running in self._running.items():
+                classes.setdefault(job_class, {})["running"] = running
+            running_background = self._running_background
+        window = config.SCHEDULER_METRICS_WINDOW_SECONDS
+        for job_class, stats in self.metrics.summary(window).items():
+            classes.setdefault(job_class, {}).update(stats)
+        for stats in classes.values():
+            stats.setdefault("queued", 0)
+            stats.setdefault("running", 0)
+        return {
+            "background_slots": self.background_slots,
+            "interactive_slots": self.interactive_slots,
+            "running_background": running_background,
+            "window_seconds": window,
+            "classes": classes,
+        }
+
+_scheduler: Optional[JobScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def configure_scheduler(background_slots: Optional[int] = None,
+                        interactive_slots: Optional[int] = None) -> JobScheduler:
+    """プロセス内で共有するスケジューラのスレッド数を指定する（最初のジョブを投入する前に呼ぶこと）"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = JobScheduler(background_slots, interactive_slots)
+        return _scheduler
+
+def get_scheduler() -> JobScheduler:
+    """プロセス内で共有するスケジューラを取得"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
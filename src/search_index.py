@@ -0,0 +1,278 @@
+from . import config
+from .db import connect
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 日本語（漢字・かな・カナ）の連続部分
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+# 英数字の単語
+WORD_PATTERN = re.compile(r"[0-9a-z]+")
+# Notionのエクスポートファイル名末尾のページID
+NOTION_ID_PATTERN = re.compile(r"([0-9a-f]{32})$")
+
+# 本文として扱わないセクション
+META_SECTIONS = ("Name", "Keywords", "_debug_info")
+
+def tokenize(text: str, query: bool = False) -> List[str]:
+    """
+    日本語と英語が混在したテキストを検索用のトークン列に変換する
+
+    英数字は小文字化した単語単位、日本語は文字バイグラムに分割し、連続部分の末尾の1文字も
+    ユニグラムとして加える（1文字の検索語が連続部分の末尾の文字にも一致するように）。
+    FTS5の標準トークナイザ（unicode61）に空白区切りで渡すことで、形態素解析なしで日本語を検索できる。
+
+    query=True の場合は、検索語の末尾の連続部分にはユニグラムを加えない（索引側では続きの文字の
+    バイグラムが並ぶため、加えるとフレーズとして一致しなくなる）。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    position = 0
+    for match in CJK_PATTERN.finditer(text):
+        tokens.extend(WORD_PATTERN.findall(text[position:match.start()]))
+        run = match.group()
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        at_end = not WORD_PATTERN.search(text[match.end():])
+        if len(run) == 1 or not (query and at_end):
+            tokens.append(run[-1])
+        position = match.end()
+    tokens.extend(WORD_PATTERN.findall(text[position:]))
+    return tokens
+
+def build_match_query(query: str) -> Optional[str]:
+    """検索語をFTS5のMATCH式に変換（語ごとにAND、日本語はバイグラムのフレーズ検索）"""
+    terms = []
+    for term in unicodedata.normalize("NFKC", query).split():
+        tokens = tokenize(term, query=True)
+        if not tokens:
+            continue
+        if len(tokens) == 1 and CJK_PATTERN.fullmatch(tokens[0]) and len(tokens[0]) == 1:
+            # 1文字の日本語はその文字で始まるバイグラムと、連続部分の末尾のユニグラムに前方一致させる
+            terms.append(f'"{tokens[0]}"*')
+        else:
+            terms.append('"' + " ".join(tokens) + '"')
+    return " AND ".join(terms) if terms else None
+
+def make_snippet(text: str, query: str, width: int = 80) -> str:
+    """元のテキストから検索語の周辺を切り出す"""
+    normalized = unicodedata.normalize("NFKC", text)
+    lowered = normalized.lower()
+    hit = -1
+    for term in unicodedata.normalize("NFKC", query).lower().split():
+        hit = lowered.find(term)
+        if hit >= 0:
+            break
+    if hit < 0:
+        return normalized[:width].replace("\n", " ")
+    start = max(0, hit - width // 2)
+    end = min(len(normalized), start + width)
+    snippet = normalized[start:end].replace("\n", " ")
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(normalized) else "")
+
+class SearchIndex:
+    """生成済み要約のローカル全文検索インデックス（SQLite FTS5）"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.SEARCH_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    page_id TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    keywords TEXT,
+                    sections TEXT NOT NULL,
+                    indexed_at TEXT NOT NULL
+                )
+            """)
+            # 検索用の列にはトークン化済みのテキストを入れる（原文は documents に保持）
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                    title, keywords, body, tokenize = 'unicode61 remove_diacritics 0'
+                )
+            """)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    @staticmethod
+    def _split_sections(sections: Dict[str, Any]):
+        title = str(sections.get("Name", ""))
+        keywords = sections.get("Keywords", [])
+        if isinstance(keywords, str):
+            keywords = [k.strip() for k in keywords.split(",") if k.strip()]
+        body = {
+            name: str(content) for name, content in sections.items()
+            if name not in META_SECTIONS and content
+        }
+        return title, list(keywords), body
+
+    def _add(self, conn: sqlite3.Connection, page_id: str, sections: Dict[str, Any]):
+        title, keywords, body = self._split_sections(sections)
+        row = conn.execute("SELECT id FROM documents WHERE page_id = ?", (page_id,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+            conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+        cursor = conn.execute(
+            "INSERT INTO documents (page_id, title, keywords, sections, indexed_at) VALUES (?, ?, ?, ?, ?)",
+            (page_id, title, json.dumps(keywords, ensure_ascii=False),
+             json.dumps(body, ensure_ascii=False), datetime.now().isoformat(timespec="seconds"))
+        )
+        conn.execute(
+            "INSERT INTO documents_fts (rowid, title, keywords, body) VALUES (?, ?, ?, ?)",
+            (cursor.lastrowid, " ".join(tokenize(title)), " ".join(tokenize(" ".join(keywords))),
+             " ".join(tokenize("\n".join(body.values()))))
+        )
+
+    def add(self, page_id: str, sections: Dict[str, Any]):
+        """要約を1件追加（同じページIDは置き換え）"""
+        with self._connect() as conn:
+            self._add(conn, page_id, sections)
+
+    def merge(self, page_id: str, sections: Dict[str, Any]) -> bool:
+        """登録済みの要約にセクションを追加・上書きする（未登録のページは何もしない）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT title, keywords, sections FROM documents WHERE page_id = ?", (page_id,)
+            ).fetchone()
+            if not row:
+                return False
+            title, keywords, body = row
+            merged = {"Name": title, "Keywords": json.loads(keywords), **json.loads(body), **sections}
+            self._add(conn, page_id, merged)
+        return True
+
+    def rebuild(self, documents: Iterable[Dict[str, Any]]) -> int:
+        """
+        インデックスを作り直す
+
+        Args:
+            documents: {"page_id": ..., "sections": {...}} のイテラブル
+        """
+        count = 0
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents_fts")
+            conn.execute("DELETE FROM documents")
+            for document in documents:
+                self._add(conn, document["page_id"], document["sections"])
+                count += 1
+        return count
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """検索してスコア順にヒットを返す（タイトル・キーワードの一致を重視）"""
+        match = build_match_query(query)
+        if not match:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT d.page_id, d.title, d.keywords, d.sections, "
+                "bm25(documents_fts, 5.0, 3.0, 1.0) AS score "
+                "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+                "WHERE documents_fts MATCH ? ORDER BY score LIMIT ?",
+                (match, limit)
+            ).fetchall()
+
+        terms = unicodedata.normalize("NFKC", query).lower().split()
+        hits = []
+        for page_id, title, keywords, sections_json, score in rows:
+            sections = json.loads(sections_json)
+            snippets = {}
+            for name, content in sections.items():
+                normalized = unicodedata.normalize("NFKC", content).lower()
+                if any(term in normalized for term in terms):
+                    snippets[name] = make_snippet(content, query)
+            hits.append({
+                "page_id": page_id,
+                "title": title,
+                "keywords": json.loads(keywords),
+                "score": -score,
+                "snippets": snippets,
+            })
+        return hits
+
+def load_notion_markdown_export(export_dir: str) -> Iterable[Dict[str, Any]]:
+    """
+    NotionのMarkdownエクスポート（ページごとの .md ファイル）を読み込む
+
+    ファイル名末尾の32桁のIDをページIDとして使う。
+    """
+    from .chat_pdf import extract_sections_from_markdown
+
+    for root, _, files in os.walk(export_dir):
+        for filename in files:
+            if not filename.endswith(".md"):
+                continue
+            stem = os.path.splitext(filename)[0]
+            match = NOTION_ID_PATTERN.search(stem.replace("-", ""))
+            if not match:
+                continue
+            with open(os.path.join(root, filename), encoding="utf-8") as file:
+                text = file.read()
+
+            sections = extract_sections_from_markdown(text)
+            # 先頭の "# タイトル" と "Keywords: a, b" 形式のプロパティ行を拾う
+            for line in text.splitlines():
+                if line.startswith("# ") and "Name" not in sections:
+                    sections["Name"] = line[2:].strip()
+                elif line.startswith("Keywords:") and "Keywords" not in sections:
+                    sections["Keywords"] = [k.strip() for k in line[9:].split(",") if k.strip()]
+            yield {"page_id": match.group(1), "sections": sections}
+
+def load_jsonl_export(path: str) -> Iterable[Dict[str, Any]]:
+    """export_notion で書き出したJSONLを読み込む（同じページは最後のレコードを使う）"""
+    latest: Dict[str, Dict[str, Any]] = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                latest.pop(record["page_id"], None)
+                latest[record["page_id"]] = record["sections"]
+    for page_id, sections in latest.items():
+        yield {"page_id": page_id, "sections": sections}
+
+_search_index: Optional[SearchIndex] = None
+
+def get_search_index() -> SearchIndex:
+    """プロセス内で共有する検索インデックスを取得"""
+    global _search_index
+    if _search_index is None:
+        _search_index = SearchIndex()
+    return _search_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="要約のローカル全文検索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser("query", help="検索する")
+    query_parser.add_argument("query", help="検索語（空白区切りでAND検索）")
+    query_parser.add_argument("--limit", type=int, default=10)
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="Notionのエクスポートからインデックスを作り直す")
+    rebuild_parser.add_argument("export_path",
+                                help="NotionのMarkdownエクスポートを展開したディレクトリ、"
+                                     "または export_notion で書き出したJSONL")
+
+    args = parser.parse_args()
+    index = get_search_index()
+
+    if args.command == "query":
+        for hit in index.search(args.query, args.limit):
+            print(f"{hit['score']:.2f}  {hit['title']}  ({hit['page_id']})")
+            for name, snippet in hit["snippets"].items():
+                print(f"    [{name}] {snippet}")
+    else:
+        if os.path.isdir(args.export_path):
+            documents = load_notion_markdown_export(args.export_path)
+        else:
+            documents = load_jsonl_export(args.export_path)
+        count = index.rebuild(documents)
+        print(f"{count} 件のページをインデックスに登録しました")
@@ -0,0 +1,211 @@
+from . import config
+from .job_context import JobCancelled
+from .model_router import ModelRouter, get_section_tier
+from .pdf_stream import open_pdf
+import difflib
+import logging
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIN_TITLE_CHARS = 10
+MAX_TITLE_CHARS = 300
+MIN_TITLE_WORDS = 2
+FONT_SIZE_STEP = 0.5  # 本文の大きさを数えるときはこの幅で丸める
+TITLE_SIZE_TOLERANCE = 0.1  # 最大の文字との差がこの割合以内の連続した文字列はタイトルの続きとみなす（行ごとに大きさやフォントが違う場合）
+METADATA_MATCH_RATIO = 0.85  # メタデータとページ上の文字がこの類似度以上なら一致とみなす
+
+# 確信度（TITLE_LOCAL_MIN_CONFIDENCE 以上ならPDF全体を送る呼び出しを省く）
+CONFIDENCE_BOTH = 0.95  # メタデータと1ページ目の最大の文字が一致
+CONFIDENCE_METADATA_ONLY = 0.5  # メタデータは作成ソフトの既定値や古い値のことがある
+# メタデータで裏付けられない場合の上限（ページ上の文字だけでは既定のしきい値 0.7 に届かないようにする）
+CONFIDENCE_FONT_ONLY_MAX = 0.65
+
+# タイトルの途中で切れている（続きが別の大きさ・フォントで書かれている）ことを示す末尾
+_INCOMPLETE_ENDING = re.compile(
+    r"([:\-–—,&/]|\b(and|or|of|for|the|a|an|with|to|in|on|at|by|from|via|towards?|into|using|versus|vs\.?))$",
+    re.IGNORECASE)
+
+# 作成ソフトが入れる意味のないメタデータ（"Microsoft Word - paper.docx"、"untitled" など）
+_JUNK_METADATA = re.compile(r"^(untitled|microsoft word|title|paper|document|slide)\b|\.(pdf|docx?|tex|dvi|ps)$",
+                            re.IGNORECASE)
+_JAPANESE = re.compile(r"[぀-ヿ一-鿿]")
+
+TRANSLATION_PROMPT = """Translate the following paper title into Japanese.
+Output only the Japanese translation, nothing else.
+
+{title}"""
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+def _comparable(text: str) -> str:
+    return re.sub(r"[^0-9a-z぀-ヿ一-鿿]", "", text.casefold())
+
+def _metadata_title(reader) -> Optional[str]:
+    try:
+        title = _normalize((reader.metadata or {}).get("/Title") or "")
+    except Exception as e:
+        logger.debug(f"メタデータの読み込みに失敗: {e}")
+        return None
+    if len(title) < MIN_TITLE_CHARS or _JUNK_METADATA.search(title):
+        return None
+    return title
+
+def _text_runs(page) -> List[Tuple[str, float]]:
+    """1ページ目の文字列と実際の文字の大きさ（フォントサイズ × 文字・座標の変換行列の拡大率）"""
+    runs: List[Tuple[str, float]] = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        # 回転した文字（arXiv の左端の識別子など）は除く
+        if abs(tm[1]) > abs(tm[0]) or abs(cm[1]) > abs(cm[0]):
+            return
+        runs.append((text, font_size * math.hypot(tm[2], tm[3]) * math.hypot(cm[2], cm[3])))
+
+    page.extract_text(visitor_text=visitor)
+    return runs
+
+def _same_title_size(size: float, title_size: float) -> bool:
+    return abs(size - title_size) <= title_size * TITLE_SIZE_TOLERANCE
+
+def _largest_font_title(runs: List[Tuple[str, float]]) -> Optional[Tuple[str, float, float]]:
+    """
+    最も大きい文字を含むひとまとまり（大きさの差が TITLE_SIZE_TOLERANCE 以内で連続する文字列）をタイトルとする
+
+    Returns:
+        (タイトル, タイトルの文字の大きさ, 本文の文字の大きさ)
+    """
+    sized = [(text, size) for text, size in runs if size > 0 and sum(c.isalpha() for c in text) >= 3]
+    if not sized:
+        return None
+    title_size = max(size for _, size in sized)
+    # 本文は文字数が最も多い大きさ
+    body_sizes = Counter()
+    for text, size in sized:
+        body_sizes[round(size / FONT_SIZE_STEP) * FONT_SIZE_STEP] += len(text)
+    body_size = body_sizes.most_common(1)[0][0]
+    if title_size <= body_size or _same_title_size(body_size, title_size):
+        # 本文より大きい文字がない（タイトルが画像・回転している場合など）
+        return None
+
+    # 空白だけの文字列はタイトルの区切りにしない
+    visible = [(text, size) for text, size in runs if text.strip()]
+    start = next(index for index, (_, size) in enumerate(visible) if size == title_size)
+    end = start + 1
+    # 最大の文字の前後に続く、大きさの近い行（フォントや大きさを変えた副題など）もつなぐ
+    while start > 0 and _same_title_size(visible[start - 1][1], title_size):
+        start -= 1
+    while end < len(visible) and _same_title_size(visible[end][1], title_size):
+        end += 1
+    parts = [text for text, _ in visible[start:end]]
+    # 行末のハイフンで分割された単語をつなぐ（次の行が大文字で始まる "Self-\nSupervised" はハイフンを残す）
+    title = re.sub(r"(\w)-\s*\n\s*([a-z])", r"\1\2", "\n".join(parts))
+    title = _normalize(re.sub(r"-\s*\n\s*", "-", title))
+    return title, title_size, body_size
+
+def _font_confidence(title: str, title_size: float, body_size: float) -> float:
+    """
+    文字の大きさの差と長さから、本文の見出しやロゴではなく論文のタイトルらしいかを見積もる
+
+    ページ上の文字だけの見積もりで、メタデータで裏付けられた場合を除き CONFIDENCE_FONT_ONLY_MAX を超えない。
+    """
+    ratio = title_size / body_size if body_size else 1.0
+    confidence = 0.5
+    if ratio >= 1.4:
+        confidence += 0.25
+    elif ratio >= 1.15:
+        confidence += 0.1
+    else:
+        confidence -= 0.2
+    if not MIN_TITLE_CHARS <= len(title) <= MAX_TITLE_CHARS or len(title.split()) < MIN_TITLE_WORDS:
+        confidence -= 0.3
+    if _INCOMPLETE_ENDING.search(title):
+        # "Progress report: Ruby 3 and" のように途中で切れている
+        confidence -= 0.3
+    return min(max(confidence, 0.0), CONFIDENCE_FONT_ONLY_MAX)
+
+def extract_title(pdf_path: str) -> Optional[Dict[str, Any]]:
+    """
+    PDFのメタデータと1ページ目の最も大きい文字からタイトルを推定する（APIは呼ばない）
+
+    Returns:
+        dict: title, confidence (0〜1), method ("metadata+font" / "font" / "metadata")。推定できない場合は None
+    """
+    with open_pdf(pdf_path) as reader:
+        metadata = _metadata_title(reader)
+        font = None
+        if len(reader.pages):
+            try:
+                font = _largest_font_title(_text_runs(reader.pages[0]))
+            except Exception as e:
+                logger.debug(f"1ページ目の文字の読み込みに失敗: {e}")
+
+    if font:
+        font_title, title_size, body_size = font
+        confidence = _font_confidence(font_title, title_size, body_size)
+        if metadata:
+            similarity = difflib.SequenceMatcher(None, _comparable(metadata), _comparable(font_title)).ratio()
+            if similarity >= METADATA_MATCH_RATIO:
+                # 改行や合字の影響がないメタデータの表記を使う
+                return {"title": metadata, "confidence": max(confidence, CONFIDENCE_BOTH), "method": "metadata+font"}
+            # 食い違う場合はページ上の文字を使うが、確信度を下げる
+            confidence -= 0.1
+        return {"title": font_title, "confidence": round(confidence, 2), "method": "font"}
+    if metadata:
+        return {"title": metadata, "confidence": CONFIDENCE_METADATA_ONLY, "method": "metadata"}
+    return None
+
+def _clean_translation(text: str) -> str:
+    lines = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    return lines[0].strip("「」『』\"'()（） ") if lines else ""
+
+def generate_local_name(pdf_path: str, router: ModelRouter) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    ローカルで抽出したタイトルと、タイトルだけを送る翻訳の呼び出しから Name（「原題 (日本語訳)」）を作る
+
+    確信度が TITLE_LOCAL_MIN_CONFIDENCE 未満、または翻訳に失敗した場合は None を返す
+    （呼び出し側でPDF全体を使う従来の抽出に切り替える）。
+
+    Returns:
+        (Name, 抽出の情報)
+    """
+    try:
+        extracted = extract_title(pdf_path)
+    except Exception as e:
+        logger.warning(f"タイトルをローカルで抽出できません: {e}")
+        extracted = None
+    if not extracted:
+        return None, {"source": "model", "reason": "ローカルで抽出できませんでした"}
+
+    info = {"source": "model", "method": extracted["method"], "confidence": extracted["confidence"]}
+    title = extracted["title"]
+    if extracted["confidence"] < config.TITLE_LOCAL_MIN_CONFIDENCE:
+        logger.info(f"ローカルで抽出したタイトルの確信度が低いためPDF全体から抽出します: {title} "
+                    f"({extracted['method']}, 確信度 {extracted['confidence']})")
+        return None, info
+
+    if _JAPANESE.search(title):
+        # 日本語の論文は翻訳しない
+        name = title
+    else:
+        prompt = TRANSLATION_PROMPT.format(title=title)
+        try:
+            # 入力はタイトルだけなので、文字数をトークン数の上限としてTPM枠を予約する
+            response = router.generate([prompt], get_section_tier(["Name"]), "Name", input_tokens=len(prompt))
+            translation = _clean_translation(response.text)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            logger.warning(f"タイトルの翻訳に失敗したためPDF全体から抽出します: {e}")
+            return None, info
+        if not translation:
+            return None, info
+        name = f"{title} ({translation})"
+
+    logger.info(f"タイトルをローカルで抽出: {name} ({extracted['method']}, 確信度 {extracted['confidence']})")
+    return name, {**info, "source": "local"}
@@ -0,0 +1,417 @@
+from . import config
+from .add_notion import resume_interrupted_jobs
+from .batch import TERMINAL_STATES, run_job
+from .coordination import worker_papers_dir
+from .job_store import get_job_store, hash_file
+from .memory_budget import estimate_job_memory_mb
+from .scheduler import configure_scheduler, estimate_job_cost, get_scheduler
+import argparse
+import ctypes
+import ctypes.util
+import functools
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+SUBMITTER = "watch"
+TICK_SECONDS = 1.0  # 書き込み完了の確認・ジョブの完了確認の間隔
+
+# inotify のイベント（<sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+def is_candidate(name: str) -> bool:
+    """取り込み対象のファイル名か（隠しファイル・Officeの一時ファイル・ダウンロード途中の .part などは除く）"""
+    return name.lower().endswith(".pdf") and not name.startswith((".", "~$"))
+
+class DirectoryWatcher:
+    """監視の共通部分（ディレクトリを登録しながら既存のファイルを列挙する）"""
+
+    name = ""
+
+    def __init__(self, root: str, recursive: bool, excluded: Set[str]):
+        self.root = root
+        self.recursive = recursive
+        self.excluded = excluded
+
+    def _register(self, path: str):
+        raise NotImplementedError
+
+    def _is_registered(self, path: str) -> bool:
+        return False
+
+    def _includes_dir(self, path: str) -> bool:
+        return not os.path.basename(path).startswith(".") and path not in self.excluded
+
+    def _scan_dir(self, path: str) -> Iterator[str]:
+        # 一覧を読む前に登録し、読んでいる間に追加されたファイルを取りこぼさない
+        try:
+            self._register(path)
+            with os.scandir(path) as it:
+                entries = list(it)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if self.recursive and self._includes_dir(entry.path) and not self._is_registered(entry.path):
+                    yield from self._scan_dir(entry.path)
+            elif entry.is_file() and is_candidate(entry.name):
+                yield entry.path
+
+    def start(self) -> List[str]:
+        """監視を始め、既にあるPDFを返す"""
+        return list(self._scan_dir(self.root))
+
+    def poll(self, timeout: float) -> List[str]:
+        """追加・更新されたPDFのパス（最大 timeout 秒待つ）"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class InotifyWatcher(DirectoryWatcher):
+    """
+    inotify（Linux）による監視
+
+    通知されたファイルだけを扱うため、ファイルが何千あってもツリーを走査し直さない。
+    通知の取りこぼし（IN_Q_OVERFLOW）があった場合のみ全体を走査し直す。
+    """
+
+    name = "inotify"
+
+    def __init__(self, root: str, recursive: bool, excluded: Set[str]):
+        super().__init__(root, recursive, excluded)
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify はLinuxでのみ使えます")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._fd = fd
+        self._watches: Dict[int, str] = {}
+
+    def _register(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if path == self.root:
+                raise OSError(error, os.strerror(error), path)
+            # 監視数の上限（fs.inotify.max_user_watches）に達した場合など
+            logger.warning(f"サブフォルダを監視できません: {path}: {os.strerror(error)}")
+            return
+        self._watches[wd] = path
+
+    def poll(self, timeout: float) -> List[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths: List[str] = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify の通知があふれたため、フォルダ全体を確認し直します")
+                paths.extend(self._scan_dir(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # 新しいサブフォルダは監視を登録してから中身を確認する（登録前に置かれたファイルのため）
+                if self.recursive and self._includes_dir(path):
+                    paths.extend(self._scan_dir(path))
+            elif is_candidate(name):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher(DirectoryWatcher):
+    """
+    inotify が使えない環境（macOS・ネットワークドライブなど）向けの監視
+
+    ファイルの追加・削除・名前の変更でディレクトリの更新時刻が変わることを利用し、
+    WATCH_POLL_SECONDS ごとに各ディレクトリの更新時刻だけを確認して、変わったディレクトリだけを読み直す。
+    """
+
+    name = "polling"
+
+    def __init__(self, root: str, recursive: bool, excluded: Set[str], interval: float):
+        super().__init__(root, recursive, excluded)
+        self.interval = interval
+        self._mtimes: Dict[str, int] = {}
+        self._last_check = time.monotonic()
+
+    def _register(self, path: str):
+        self._mtimes[path] = os.stat(path).st_mtime_ns
+
+    def _is_registered(self, path: str) -> bool:
+        return path in self._mtimes
+
+    def poll(self, timeout: float) -> List[str]:
+        wait = self.interval - (time.monotonic() - self._last_check)
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        self._last_check = time.monotonic()
+
+        paths: List[str] = []
+        for directory, mtime in list(self._mtimes.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                del self._mtimes[directory]
+                continue
+            if current != mtime:
+                paths.extend(self._scan_dir(directory))
+        return paths
+
+def _unique_path(path: str) -> str:
+    """同名のファイルがあれば「名前 (1).pdf」のように番号を付ける"""
+    base, ext = os.path.splitext(path)
+    candidate, index = path, 1
+    while os.path.exists(candidate):
+        candidate = f"{base} ({index}){ext}"
+        index += 1
+    return candidate
+
+def _link_or_copy(source: str, destination: str):
+    """ジョブ用のPDFを作る（同じファイルシステムならハードリンクでコピーを省く）"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class FolderWatcher:
+    """
+    監視フォルダに置かれたPDFを要約してNotionに追加する常駐プロセス
+
+    1. 新しいPDFは、サイズと更新時刻が WATCH_SETTLE_SECONDS の間変わらなくなるまで待つ（書き込み途中のファイルを避ける）
+    2. ハッシュ値で重複を判定し、要約済みならそのまま done/ へ、処理中のジョブがあればその完了を待つ
+    3. それ以外はジョブを作り、複数ファイルのアップロードと同じ処理（NotionSummaryWriter.add_summary）を
+       バックグラウンドのジョブとしてスケジューラに投入する
+    4. ジョブが完了したら done/、失敗・取り消しの場合は failed/ に移す（失敗の理由は <ファイル名>.error.txt）
+
+    完了を待っているファイルは WATCH_MAX_PENDING 件までとし、残りはハッシュ計算もせずに並べておく。
+    """
+
+    def __init__(self, root: str, model_name: Optional[str] = None, summary_mode: str = "concise",
+                 pdf_mode: str = "auto", recursive: Optional[bool] = None, use_inotify: Optional[bool] = None,
+                 settle_seconds: Optional[float] = None, max_pending: Optional[int] = None):
+        self.root = os.path.abspath(root)
+        self.done_dir = os.path.join(self.root, DONE_DIR)
+        self.failed_dir = os.path.join(self.root, FAILED_DIR)
+        self.model_name = model_name
+        self.summary_mode = summary_mode
+        self.pdf_mode = pdf_mode
+        self.recursive = config.WATCH_RECURSIVE if recursive is None else recursive
+        self.use_inotify = config.WATCH_USE_INOTIFY if use_inotify is None else use_inotify
+        self.settle_seconds = config.WATCH_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.max_pending = max_pending or config.WATCH_MAX_PENDING
+        self.store = get_job_store()
+        self._settling: Dict[str, Tuple[int, int, float]] = {}  # パス -> (サイズ, 更新時刻, 最後に変化を見た時刻)
+        self._ready: Deque[str] = deque()
+        self._waiting: Dict[str, str] = {}  # パス -> 完了を待っているジョブID
+        self._known: Set[str] = set()
+        self._stop = threading.Event()
+
+    def _create_watcher(self) -> DirectoryWatcher:
+        excluded = {self.done_dir, self.failed_dir}
+        if self.use_inotify:
+            try:
+                return InotifyWatcher(self.root, self.recursive, excluded)
+            except OSError as e:
+                logger.warning(f"inotify が使えないため定期的な確認に切り替えます: {e}")
+        return PollingWatcher(self.root, self.recursive, excluded, config.WATCH_POLL_SECONDS)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        os.makedirs(self.done_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+        watcher = self._create_watcher()
+        try:
+            try:
+                existing = watcher.start()
+            except OSError as e:
+                if not isinstance(watcher, InotifyWatcher):
+                    raise
+                logger.warning(f"inotify で監視できないため定期的な確認に切り替えます: {e}")
+                watcher.close()
+                watcher = PollingWatcher(self.root, self.recursive, {self.done_dir, self.failed_dir},
+                                         config.WATCH_POLL_SECONDS)
+                existing = watcher.start()
+            for path in existing:
+                self._add(path)
+            logger.info(f"フォルダの監視を開始: {self.root} ({watcher.name}, 既存のPDF {len(existing)} 件)")
+
+            # 前回の停止で中断したジョブを再開する（フォルダに残っている元のPDFはそのジョブの完了を待つ）
+            # 画面やバッチから投入されたジョブは、Webサーバーのワーカーが定期的に再開するため触れない
+            resumed = resume_interrupted_jobs(submitter=SUBMITTER)
+            if resumed:
+                logger.info(f"中断されたジョブを {resumed} 件再開しました")
+
+            while not self._stop.is_set():
+                for path in watcher.poll(TICK_SECONDS):
+                    self._add(path)
+                self._check_settling()
+                self._check_waiting()
+                self._dispatch()
+        finally:
+            watcher.close()
+            logger.info(f"フォルダの監視を終了: {self.root}（未完了のジョブは次回の起動時に再開します）")
+
+    def _add(self, path: str):
+        if path in self._known:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        self._known.add(path)
+        self._settling[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def _check_settling(self):
+        now = time.monotonic()
+        for path, (size, mtime, since) in list(self._settling.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._settling[path]
+                self._known.discard(path)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self._settling[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size > 0 and now - since >= self.settle_seconds:
+                del self._settling[path]
+                self._ready.append(path)
+
+    def _dispatch(self):
+        while self._ready and len(self._waiting) < self.max_pending and not self._stop.is_set():
+            path = self._ready.popleft()
+            try:
+                self._submit(path)
+            except FileNotFoundError:
+                self._known.discard(path)
+            except Exception as e:
+                logger.error(f"ジョブを投入できません: {path}: {e}")
+                self._finish(path, "failed", str(e))
+
+    def _submit(self, path: str):
+        input_hash = hash_file(path)
+        existing = self.store.find_job_by_hash(input_hash, self.summary_mode)
+        if existing and existing["state"] == "completed":
+            logger.info(f"要約済みのPDFです: {path} (ジョブ {existing['id']})")
+            self._finish(path, "completed")
+            return
+        if existing:
+            # 同じPDFを処理中のジョブ（このフォルダ内の重複・前回の起動で中断したジョブ・画面からのアップロード）
+            logger.info(f"同じPDFを処理中のジョブの完了を待ちます: {path} (ジョブ {existing['id']})")
+            self._waiting[path] = existing["id"]
+            return
+
+        filename = os.path.relpath(path, self.root)
+        job_id = self.store.create_job(filename, input_hash, self.model_name, self.summary_mode, self.pdf_mode,
+                                       submitter=SUBMITTER)
+        # 元のファイルはジョブの完了後に done/ か failed/ へ移すため、ジョブには別のパスを渡す
+        pdf_path = os.path.join(worker_papers_dir(), f"{job_id}.pdf")
+        _link_or_copy(path, pdf_path)
+        self.store.update_job(job_id, pdf_path=pdf_path)
+        get_scheduler().submit(
+            functools.partial(run_job, job_id, pdf_path, self.model_name, self.summary_mode, self.pdf_mode),
+            summary_mode=self.summary_mode, submitter=SUBMITTER,
+            cost=estimate_job_cost(pdf_path, self.summary_mode, input_hash), label=job_id,
+            memory_mb=estimate_job_memory_mb(pdf_path)
+        )
+        self._waiting[path] = job_id
+
+    def _check_waiting(self):
+        for path, job_id in list(self._waiting.items()):
+            job = self.store.get_job(job_id)
+            state = job["state"] if job else "failed"
+            if state not in TERMINAL_STATES:
+                continue
+            del self._waiting[path]
+            error = (job.get("error") if job else None) or ("取り消されました" if state == "cancelled" else None)
+            self._finish(path, state, error)
+
+    def _finish(self, path: str, state: str, error: Optional[str] = None):
+        self._known.discard(path)
+        target_dir = self.done_dir if state == "completed" else self.failed_dir
+        target = _unique_path(os.path.join(target_dir, os.path.relpath(path, self.root)))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        except OSError as e:
+            logger.warning(f"処理済みのファイルを移動できません: {path}: {e}")
+            return
+        if state == "completed":
+            logger.info(f"完了: {path} -> {target}")
+            return
+        with open(f"{target}.error.txt", "w", encoding="utf-8") as file:
+            file.write(f"{state}: {error or '不明なエラー'}\n")
+        logger.warning(f"失敗: {path} -> {target} ({error})")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="フォルダに置かれたPDFを要約してNotionに追加する")
+    parser.add_argument("directory", nargs="?", default=config.WATCH_DIR,
+                        help="監視するフォルダ（省略時は WATCH_DIR）")
+    parser.add_argument("--model", help="使用するモデル（省略時は GOOGLE_MODEL）")
+    parser.add_argument("--summary-mode", choices=config.SUMMARY_MODES, default="concise")
+    parser.add_argument("--pdf-mode", choices=config.PDF_MODES, default="auto")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_CONCURRENCY, help="同時に処理するジョブ数")
+    parser.add_argument("--max-pending", type=int, default=config.WATCH_MAX_PENDING)
+    parser.add_argument("--no-recursive", action="store_true", help="サブフォルダを監視しない")
+    parser.add_argument("--polling", action="store_true", help="inotify を使わずに定期的に確認する")
+    args = parser.parse_args()
+    if not args.directory:
+        parser.error("監視するフォルダを指定してください（引数または WATCH_DIR）")
+
+    # 画面からのジョブはないため、すべてのスレッドをバックグラウンドのジョブに使う
+    configure_scheduler(args.concurrency, interactive_slots=0)
+    watcher = FolderWatcher(args.directory, args.model, args.summary_mode, args.pdf_mode,
+                            recursive=False if args.no_recursive else None,
+                            use_inotify=False if args.polling else None, max_pending=args.max_pending)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
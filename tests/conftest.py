@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+
+# src.config は必須の環境変数がないとインポート時に失敗するため、テスト用の値を先に設定する
+os.environ.setdefault("GOOGLE_API_KEY", "test-google-key")
+os.environ.setdefault("NOTION_API_KEY", "test-notion-key")
+os.environ.setdefault("NOTION_DATABASE_ID", "test-database")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="paper-summarizer-test-")
+os.environ["PAPERS_DIR"] = os.path.join(os.environ["DATA_DIR"], "papers")
+os.environ["TRAFFIC_MODE"] = "off"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from google.generativeai import protos, types
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from src import quota
+from src.model_router import ModelStats
+
+class FakeModel:
+    """generate_content / count_tokens の呼び出しを記録する Gemini モデルの代わり"""
+
+    def __init__(self, name, text="", tokens=10, error=None):
+        self.model_name = f"models/{name}"
+        self.text = text
+        self.tokens = tokens
+        self.error = error
+        self.calls = []
+
+    def generate_content(self, contents, request_options=None):
+        self.calls.append(("generate_content", contents))
+        if self.error:
+            raise self.error
+        return types.GenerateContentResponse.from_response(protos.GenerateContentResponse(
+            candidates=[{"content": {"parts": [{"text": self.text}], "role": "model"}}]
+        ))
+
+    def count_tokens(self, contents, request_options=None):
+        self.calls.append(("count_tokens", contents))
+        return protos.CountTokensResponse(total_tokens=self.tokens)
+
+class _Endpoint:
+    def __init__(self, notion, prefix):
+        self._notion = notion
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _Endpoint(self._notion, f"{self._prefix}.{name}")
+
+    def __call__(self, **kwargs):
+        return self._notion.handle(self._prefix, kwargs)
+
+class FakeNotion:
+    """
+    notion_client.Client の代わりに呼び出しを記録する
+
+    fail に "pages.update" などのメソッド名と例外のリストを入れると、その回数だけ呼び出しが失敗する
+    （None の要素は成功扱い）。
+    """
+
+    def __init__(self, keyword_options=()):
+        self.keyword_options = list(keyword_options)
+        self.calls = []
+        self.fail = {}
+        self._page_count = 0
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _Endpoint(self, name)
+
+    def handle(self, method, kwargs):
+        self.calls.append((method, kwargs))
+        failures = self.fail.get(method)
+        if failures:
+            error = failures.pop(0)
+            if error is not None:
+                raise error
+        if method == "pages.create":
+            self._page_count += 1
+            return {"id": f"page-{self._page_count}"}
+        if method == "databases.retrieve":
+            return {"properties": {"Keywords": {"multi_select": {
+                "options": [{"name": name} for name in self.keyword_options]
+            }}}}
+        return {"results": [], "has_more": False}
+
+    def called(self, method):
+        return [kwargs for name, kwargs in self.calls if name == method]
+
+PDF_FONTS = {"Helvetica": "/F1", "Helvetica-Bold": "/F2", "Times-Roman": "/F3", "Times-Bold": "/F4"}
+
+def _image_xobject(writer):
+    """1×1 のグレースケール画像（スキャンしたページや図の代わり）"""
+    image = DecodedStreamObject()
+    image.set_data(b"\x80")
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(1),
+        NameObject("/Height"): NumberObject(1),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return writer._add_object(image)
+
+def make_pdf(path, lines, metadata_title=None, line_gap=1.4, images=0, pages=1):
+    """
+    同じ内容のページが pages ページ続くPDFを作る
+
+    lines: 上から順に配置する (文字列, フォントサイズ, フォント名)。
+    論文の1ページ目のように、タイトル・著者・本文を大きさとフォントを変えて並べる。
+    images: 各ページに置く画像の数（文字がなく画像だけのページはスキャンしたページになる）
+    """
+    writer = PdfWriter()
+    fonts = DictionaryObject()
+    operations = []
+    y = 740.0
+    for text, size, font in lines:
+        key = PDF_FONTS[font]
+        if NameObject(key) not in fonts:
+            fonts[NameObject(key)] = writer._add_object(DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject(f"/{font}"),
+            }))
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        operations.append(f"BT {key} {size} Tf 72 {y:.1f} Td ({escaped}) Tj ET")
+        y -= size * line_gap
+    xobjects = DictionaryObject()
+    for index in range(images):
+        xobjects[NameObject(f"/Im{index}")] = _image_xobject(writer)
+        operations.append(f"q 100 0 0 100 {72 + index * 110} 72 cm /Im{index} Do Q")
+    resources = DictionaryObject({NameObject("/Font"): fonts})
+    if images:
+        resources[NameObject("/XObject")] = xobjects
+    for _ in range(pages):
+        page = PageObject.create_blank_page(None, 612, 792)
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(operations).encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = resources
+        writer.add_page(page)
+    if metadata_title:
+        writer.add_metadata({"/Title": metadata_title})
+    with open(path, "wb") as file:
+        writer.write(file)
+    return str(path)
+
+@pytest.fixture
+def quota_scheduler(tmp_path, monkeypatch):
+    """テストごとに空のクォータ（プロセス共有のスケジューラを差し替える）"""
+    scheduler = quota.QuotaScheduler(str(tmp_path / "quota.sqlite3"))
+    monkeypatch.setattr(quota, "_scheduler", scheduler)
+    return scheduler
+
+@pytest.fixture
+def model_stats(tmp_path):
+    return ModelStats(str(tmp_path / "routing.sqlite3"))
@@ -0,0 +1,60 @@
+import pytest
+from conftest import FakeNotion, make_pdf
+
+from src import backfill
+from src.backfill import LocalPdfIndex, SectionBackfiller
+from src.job_store import hash_file
+
+TITLE = "Scaling Laws for Neural Language Models"
+
+def paper(path, title=TITLE):
+    return make_pdf(path, [(title, 18, "Helvetica-Bold"), ("Jared Kaplan", 11, "Times-Roman")]
+                    + [("We study empirical scaling laws for language model performance.", 10, "Times-Roman")] * 20)
+
+def page(page_id, name):
+    return {"id": page_id, "properties": {
+        "Name": {"type": "title", "title": [{"plain_text": name}]},
+        "どんな研究？": {"type": "rich_text", "rich_text": []},
+    }}
+
+def test_local_index_matches_by_hash_then_exact_title(tmp_path):
+    (tmp_path / "papers").mkdir()
+    path = paper(tmp_path / "papers" / "kaplan.pdf")
+    other = paper(tmp_path / "papers" / "other.pdf", "Scaling Laws for Autoregressive Generative Modeling")
+    index = LocalPdfIndex([str(tmp_path / "papers"), str(tmp_path / "missing")])
+
+    assert index.find(hash_file(other), None) == (other, hash_file(other))
+    # Name は「原題 (日本語訳)」の形式
+    assert index.find(None, f"{TITLE} (ニューラル言語モデルのスケーリング則)") == (path, hash_file(path))
+    # 似ているだけのタイトルには一致させない
+    assert index.find(None, "Scaling Laws for Neural Machine Translation") is None
+
+@pytest.fixture
+def backfiller(tmp_path, quota_scheduler, monkeypatch):
+    (tmp_path / "papers").mkdir()
+    backfiller = SectionBackfiller(["どんな研究？"], concurrency=1, pdf_dirs=[str(tmp_path / "papers")])
+    backfiller.writer.notion = backfiller.exporter.notion = FakeNotion()
+    backfiller.store = backfill.BackfillStore(str(tmp_path / "backfill.sqlite3"))
+    calls = []
+
+    def fake_summary(pdf_path, *args, sections_to_generate=None, input_hash=None, **kwargs):
+        calls.append((pdf_path, input_hash))
+        return {name: "生成した要約" for name in sections_to_generate}
+    monkeypatch.setattr(backfill, "get_summary", fake_summary)
+    backfiller.summary_calls = calls
+    return backfiller
+
+def test_page_without_job_uses_pdf_from_folder(backfiller, tmp_path):
+    path = paper(tmp_path / "papers" / "kaplan.pdf")
+    result = backfiller.backfill_page(page("page-old", f"{TITLE} (スケーリング則)"))
+    assert result["status"] == "filled"
+    assert backfiller.summary_calls == [(path, hash_file(path))]
+    # 次回以降はPDFキャッシュから使う
+    assert backfiller.pdf_cache.pdf_path(hash_file(path))
+
+def test_page_without_source_is_reported(backfiller):
+    result = backfiller.backfill_page(page("page-unknown", "Unknown Paper (不明な論文)"))
+    assert result["status"] == "no_source"
+    assert "papers" in result["error"]
+    assert backfiller.store.get("page-unknown")["state"] == "skipped"
+    assert not backfiller.summary_calls
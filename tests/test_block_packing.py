@@ -0,0 +1,89 @@
+from src import config
+from src.block_packing import (MAX_BLOCKS_PER_REQUEST, MAX_CHILDREN_PER_REQUEST, MAX_RICH_TEXT_ITEMS,
+                               MAX_TEXT_CONTENT, _payload_bytes, count_blocks, merge_paragraphs,
+                               pack_chunks, pack_section)
+
+def paragraph(text):
+    return {"object": "block", "type": "paragraph",
+            "paragraph": {"rich_text": [{"type": "text", "text": {"content": text}}]}}
+
+def toggle(children):
+    return {"object": "block", "type": "heading_2",
+            "heading_2": {"rich_text": [{"text": {"content": "見出し"}}], "is_toggleable": True,
+                          "children": children}}
+
+def _assert_within_limits(chunks, first_chunk_overhead=0):
+    for index, chunk in enumerate(chunks):
+        overhead = first_chunk_overhead if index == 0 else 0
+        assert len(chunk) <= MAX_CHILDREN_PER_REQUEST
+        assert sum(count_blocks(block) for block in chunk) <= MAX_BLOCKS_PER_REQUEST
+        assert overhead + sum(_payload_bytes(block) for block in chunk) <= config.NOTION_MAX_REQUEST_BYTES
+
+def test_top_level_children_limit():
+    blocks = [paragraph(f"{i}") for i in range(MAX_CHILDREN_PER_REQUEST * 2 + 1)]
+    chunks = pack_chunks(blocks)
+    assert [len(chunk) for chunk in chunks] == [MAX_CHILDREN_PER_REQUEST, MAX_CHILDREN_PER_REQUEST, 1]
+    assert [block for chunk in chunks for block in chunk] == blocks
+
+def test_nested_block_limit():
+    # 1つで99ブロックのトグル × 11 = 1089 ブロック → 1000 を超えないように分割
+    blocks = [toggle([paragraph(f"{i}-{j}") for j in range(98)]) for i in range(11)]
+    assert count_blocks(blocks[0]) == 99
+    chunks = pack_chunks(blocks)
+    assert [len(chunk) for chunk in chunks] == [10, 1]
+    _assert_within_limits(chunks)
+
+def test_payload_bytes_limit(monkeypatch):
+    monkeypatch.setattr(config, "NOTION_MAX_REQUEST_BYTES", 5000)
+    blocks = [paragraph("あ" * 500) for _ in range(10)]  # 1ブロック約1.6KB
+    chunks = pack_chunks(blocks)
+    assert len(chunks) > 1
+    _assert_within_limits(chunks)
+    assert [block for chunk in chunks for block in chunk] == blocks
+
+def test_first_chunk_overhead_only_applies_to_first_request(monkeypatch):
+    monkeypatch.setattr(config, "NOTION_MAX_REQUEST_BYTES", 5000)
+    blocks = [paragraph("a" * 900) for _ in range(10)]
+    size = _payload_bytes(blocks[0])
+    without = pack_chunks(blocks)
+    with_overhead = pack_chunks(blocks, first_chunk_overhead=3000)
+    assert len(with_overhead[0]) == (5000 - 3000) // size
+    assert len(with_overhead[0]) < len(without[0])
+    assert len(with_overhead[1]) == len(without[0])
+    _assert_within_limits(with_overhead, first_chunk_overhead=3000)
+
+def test_oversized_block_gets_its_own_request(monkeypatch):
+    monkeypatch.setattr(config, "NOTION_MAX_REQUEST_BYTES", 1000)
+    blocks = [paragraph("a"), paragraph("b" * 2000), paragraph("c")]
+    assert pack_chunks(blocks) == [[blocks[0]], [blocks[1]], [blocks[2]]]
+
+def test_empty_input():
+    assert pack_chunks([]) == []
+
+def test_merge_paragraphs_respects_rich_text_limits():
+    blocks = [paragraph("x" * (MAX_TEXT_CONTENT * 3 + 1))] + [paragraph(f"{i}") for i in range(120)]
+    merged = merge_paragraphs(blocks)
+    for block in merged:
+        rich_text = block["paragraph"]["rich_text"]
+        assert len(rich_text) <= MAX_RICH_TEXT_ITEMS
+        assert all(len(item["text"]["content"]) <= MAX_TEXT_CONTENT for item in rich_text)
+    text = "".join(item["text"]["content"] for block in merged for item in block["paragraph"]["rich_text"])
+    assert text.replace("\n", "") == "".join(b["paragraph"]["rich_text"][0]["text"]["content"] for b in blocks)
+
+def _headings(count):
+    # 段落はまとめられるため、段落以外のブロックで数を保つ
+    return [{"object": "block", "type": "heading_3", "heading_3": {"rich_text": []}} for _ in range(count)]
+
+def test_pack_section_toggles_when_children_fit(monkeypatch):
+    monkeypatch.setattr(config, "NOTION_TOGGLE_MIN_BLOCKS", 3)
+    blocks = pack_section("見出し", _headings(5))
+    assert len(blocks) == 1
+    assert blocks[0]["heading_2"]["is_toggleable"]
+    assert len(blocks[0]["heading_2"]["children"]) == 5
+
+def test_pack_section_keeps_flat_when_children_exceed_one_request(monkeypatch):
+    monkeypatch.setattr(config, "NOTION_TOGGLE_MIN_BLOCKS", 3)
+    blocks = pack_section("見出し", _headings(MAX_CHILDREN_PER_REQUEST + 1))
+    assert len(blocks) == MAX_CHILDREN_PER_REQUEST + 3
+    assert "children" not in blocks[0]["heading_2"]
+    assert blocks[-1]["type"] == "divider"
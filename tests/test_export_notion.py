@@ -0,0 +1,123 @@
+import json
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from notion_client.errors import APIResponseError
+
+from src import config, export_notion
+from src.export_notion import NOTION_QUOTA_KEY, NotionExporter
+
+def api_error(status, headers=None):
+    return APIResponseError(code="rate_limited" if status == 429 else "internal_server_error", status=status,
+                            message=f"status {status}", headers=httpx.Headers(headers or {}), raw_body_text="")
+
+class FlakyCall:
+    def __init__(self, errors, result=None):
+        self.errors = list(errors)
+        self.result = result or {"results": [], "has_more": False}
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+@pytest.fixture
+def exporter(quota_scheduler, monkeypatch):
+    sleeps = []
+    # クォータの待機はそのままにして、再試行の待機だけを記録する
+    monkeypatch.setattr(export_notion, "time", SimpleNamespace(sleep=sleeps.append))
+    exporter = NotionExporter(notion=None, database_id="database")
+    exporter.sleeps = sleeps
+    return exporter
+
+def test_retries_honour_retry_after_and_drain_bucket(exporter, quota_scheduler):
+    call = FlakyCall([api_error(429, {"Retry-After": "7"})])
+    assert exporter._request(call) == call.result
+    assert call.calls == 2
+    assert exporter.sleeps == [7.0]
+    assert quota_scheduler.status()[NOTION_QUOTA_KEY]["available_requests"] < 1
+
+def test_server_errors_back_off_without_draining_bucket(exporter, quota_scheduler):
+    call = FlakyCall([api_error(502), api_error(503)])
+    exporter._request(call)
+    assert call.calls == 3
+    assert len(exporter.sleeps) == 2
+    assert exporter.sleeps[1] > exporter.sleeps[0] >= config.NOTION_RETRY_BASE_SECONDS
+    assert quota_scheduler.status()[NOTION_QUOTA_KEY]["available_requests"] >= 1
+
+def test_client_errors_and_exhausted_retries_raise(exporter, monkeypatch):
+    call = FlakyCall([api_error(400)])
+    with pytest.raises(APIResponseError):
+        exporter._request(call)
+    assert call.calls == 1
+
+    monkeypatch.setattr(config, "NOTION_MAX_RETRIES", 2)
+    call = FlakyCall([api_error(500)] * 3)
+    with pytest.raises(APIResponseError):
+        exporter._request(call)
+    assert call.calls == 3
+
+def record(i):
+    return {"page_id": f"page-{i:03d}", "url": f"https://notion.so/page-{i:03d}",
+            "created_time": "2024-01-01T00:00:00.000Z", "last_edited_time": "2024-01-01T00:00:00.000Z",
+            "sections": {"Name": f"Paper {i}", "Keywords": ["AI"]}}
+
+@pytest.fixture
+def fake_database(monkeypatch):
+    """iter_records が pages のレコードを返し、fail_after 件目の後で中断するエクスポーター"""
+    database = SimpleNamespace(pages=[record(i) for i in range(120)], fail_after=None, skipped=None)
+
+    class FakeExporter:
+        def __init__(self, *args):
+            pass
+
+        def iter_records(self, since=None, skip=None):
+            database.skipped = set(skip or ())
+            for count, page in enumerate(p for p in database.pages if p["page_id"] not in database.skipped):
+                if count == database.fail_after:
+                    raise KeyboardInterrupt
+                yield page
+
+    monkeypatch.setattr(export_notion, "NotionExporter", FakeExporter)
+    return database
+
+def test_interrupted_jsonl_export_resumes_after_written_pages(tmp_path, fake_database):
+    output = str(tmp_path / "export.jsonl")
+    fake_database.fail_after = 70
+    with pytest.raises(KeyboardInterrupt):
+        export_notion.export_database(output)
+    with open(f"{output}.checkpoint.json", encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    # 中断時点までに書き込んだ70件すべてを記録する（チェックポイントの間隔に関係なく）
+    assert checkpoint["in_progress"] and len(checkpoint["done"]) == 70
+
+    fake_database.fail_after = None
+    assert export_notion.export_database(output) == 50
+    assert len(fake_database.skipped) == 70
+    with open(output, encoding="utf-8") as file:
+        assert sorted(json.loads(line)["page_id"] for line in file) == [p["page_id"] for p in fake_database.pages]
+
+def test_parquet_parts_follow_rows_per_file_and_checkpoint_only_written_rows(tmp_path, fake_database,
+                                                                              monkeypatch):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    sink_class = export_notion.ParquetSink
+    monkeypatch.setattr(export_notion, "ParquetSink",
+                        lambda path, append: sink_class(path, append, rows_per_file=40))
+    saved = []
+    save = export_notion._save_checkpoint
+    monkeypatch.setattr(export_notion, "_save_checkpoint",
+                        lambda path, checkpoint: (saved.append(list(checkpoint["done"])), save(path, checkpoint)))
+
+    output = str(tmp_path / "export")
+    assert export_notion.export_database(output, fmt="parquet") == 120
+    parts = sorted(f for f in os.listdir(output) if f.endswith(".parquet"))
+    # チェックポイントの保存（50件ごと）ではパートファイルを書き出さない
+    assert [pq.read_table(os.path.join(output, part)).num_rows for part in parts] == [40, 40, 40]
+    # 50件目・100件目の時点ではパートファイルに書き出した40件・80件だけを記録する
+    assert [len(done) for done in saved[1:3]] == [40, 80]
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from src import config, job_context
+from src.job_context import JobCancelled, JobContext, JobDeadlineExceeded, cancel_job, track_job
+from src.job_store import JobStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_context, "get_job_store", lambda: store)
+    return store
+
+def test_check_raises_after_the_job_deadline():
+    context = JobContext(timeout=0.05)
+    context.check()
+    time.sleep(0.06)
+    with pytest.raises(JobDeadlineExceeded, match="ジョブの期限"):
+        context.check()
+
+def test_zero_timeout_means_no_deadline():
+    context = JobContext(timeout=0)
+    assert context.remaining() is None
+    assert context.call_timeout(30) == 30
+    context.check()
+
+def test_stage_limits_only_its_own_block():
+    context = JobContext(timeout=60)
+    with context.stage(0.5):
+        # ジョブ全体の残り時間の半分がこのステージの期限
+        assert 29 < context.remaining() <= 30
+        assert context.call_timeout(10) == 10
+        with context.stage(0.0):
+            with pytest.raises(JobDeadlineExceeded, match="処理段階の期限"):
+                context.check()
+        # 内側のステージを抜けると外側の期限に戻る
+        context.check()
+        assert 29 < context.remaining() <= 30
+    assert context.remaining() > 59
+
+def test_cancel_job_reaches_a_job_running_in_another_worker(store, monkeypatch):
+    monkeypatch.setattr(config, "JOB_CANCEL_POLL_SECONDS", 0)
+    job_id = store.create_job("paper.pdf")
+    # 別のワーカーで実行中のジョブ（このプロセスの track_job には登録されていない）
+    context = JobContext(job_id, timeout=0)
+    assert not context.is_cancelled()
+
+    assert cancel_job(job_id)
+    assert store.get_job(job_id)["cancel_requested"]
+    with pytest.raises(JobCancelled, match="APIから取り消されました"):
+        context.check()
+
+def test_cancel_job_is_immediate_in_the_same_worker(store, monkeypatch):
+    # ジョブストアの確認間隔を待たずに反映する
+    monkeypatch.setattr(config, "JOB_CANCEL_POLL_SECONDS", 3600)
+    job_id = store.create_job("paper.pdf")
+    context = JobContext(job_id, timeout=0)
+    context.is_cancelled()
+    with track_job(context):
+        assert cancel_job(job_id, reason="テスト")
+        assert context.is_cancelled()
+        assert context.reason == "テスト"
+    assert job_id not in job_context._active
+
+def test_finished_jobs_cannot_be_cancelled(store):
+    job_id = store.create_job("paper.pdf")
+    store.update_job(job_id, state="completed")
+    assert not cancel_job(job_id)
+    assert not store.get_job(job_id)["cancel_requested"]
+    assert not cancel_job("missing")
+
+def test_run_cleanups_newest_first_and_continues_after_failures():
+    context = JobContext(timeout=0)
+    ran = []
+
+    def failing():
+        ran.append("failing")
+        raise RuntimeError("削除に失敗")
+
+    context.add_cleanup("アップロードしたPDFの削除", lambda: ran.append("upload"))
+    context.add_cleanup("失敗する後片付け", failing)
+    context.add_cleanup("ページのアーカイブ", lambda: ran.append("page"))
+    context.run_cleanups()
+    assert ran == ["page", "failing", "upload"]
+    # 実行済みの後片付けは2回実行しない
+    context.run_cleanups()
+    assert ran == ["page", "failing", "upload"]
+
+def test_cancel_wakes_up_sleep():
+    context = JobContext(timeout=0)
+    context.cancel("切断")
+    start = time.monotonic()
+    with pytest.raises(JobCancelled, match="切断"):
+        context.sleep(10)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,174 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from conftest import FakeNotion
+
+from src import add_notion, config
+from src.add_notion import NotionSummaryWriter
+from src.job_context import JobCancelled
+from src.block_packing import pack_chunks
+from src.job_store import JobStore
+from src.keyword_taxonomy import KeywordTaxonomy
+from src.quota import NOTION_QUOTA_KEY
+
+SECTIONS = {
+    "Name": "Attention Is All You Need (アテンションだけでよい)",
+    "Keywords": ["Transformer", "Attention"],
+    "どんな研究？": "\n".join(f"{i}行目: " + "あ" * 120 for i in range(40)),
+    "手法のキモは？": "\n".join(f"- 手順{i}: " + "い" * 120 for i in range(40)),
+    "次に読む論文等は？": "\n".join(f"- 論文{i}" for i in range(20)),
+    "_debug_info": {"token_counts": {"pdf_content": 100, "prompt": 10, "total_input": 110}},
+}
+
+class FailingNotion(Exception):
+    pass
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    # 小さな上限で複数のチャンクに分割させる
+    monkeypatch.setattr(config, "NOTION_MAX_REQUEST_BYTES", 4000)
+    writer = NotionSummaryWriter(config, job_store=JobStore(str(tmp_path / "jobs.sqlite3")))
+    writer.notion = FakeNotion(keyword_options=["Transformer"])
+    writer.keyword_taxonomy = KeywordTaxonomy(writer.notion, writer.database_id,
+                                              cache_path=str(tmp_path / "keywords.json"))
+    return writer
+
+def _summarized_job(writer):
+    job_id = writer.job_store.create_job("paper.pdf", input_hash="hash", pdf_path="paper.pdf")
+    writer.job_store.update_job(job_id, state="summarized", sections=SECTIONS)
+    return job_id
+
+def test_resume_reuses_stored_chunk_boundaries(writer, monkeypatch):
+    job_id = _summarized_job(writer)
+    # 2回目の追加が失敗し、アーカイブもできない → 再開できるよう writing のまま残る
+    writer.notion.fail = {"blocks.children.append": [None, FailingNotion("502")],
+                          "pages.update": [FailingNotion("502")]}
+    result = writer.add_summary("paper.pdf", job_id=job_id)
+    assert not result["success"]
+
+    job = writer.job_store.get_job(job_id)
+    assert job["state"] == "writing"
+    assert job["notion_page_id"] == "page-1"
+    assert job["blocks_written"] == 2
+    chunks = job["block_chunks"]
+    assert len(chunks) > 3
+    written = [kwargs["children"] for kwargs in writer.notion.called("pages.create")]
+    written += [kwargs["children"] for kwargs in writer.notion.called("blocks.children.append")][:1]
+
+    # 再開までに分割の条件が変わっても、記録した区切りで続きを書き込む
+    monkeypatch.setattr(config, "NOTION_MAX_REQUEST_BYTES", 9000)
+    assert pack_chunks([block for chunk in chunks for block in chunk]) != chunks
+    writer.notion = FakeNotion(keyword_options=["Transformer"])
+    result = writer.add_summary("paper.pdf", job_id=job_id)
+    assert result["success"]
+    assert not writer.notion.called("pages.create")
+    appended = [kwargs["children"] for kwargs in writer.notion.called("blocks.children.append")]
+    assert appended == chunks[2:]
+    assert written + appended == chunks
+
+    job = writer.job_store.get_job(job_id)
+    assert job["state"] == "completed"
+    assert job["block_chunks"] is None
+
+def test_failed_append_archives_partial_page(writer):
+    job_id = _summarized_job(writer)
+    writer.notion.fail = {"blocks.children.append": [FailingNotion("400 validation_error")]}
+    result = writer.add_summary("paper.pdf", job_id=job_id)
+    assert not result["success"]
+
+    assert writer.notion.called("pages.update") == [{"page_id": "page-1", "archived": True}]
+    job = writer.job_store.get_job(job_id)
+    assert job["state"] == "failed"
+    assert job["notion_page_id"] is None
+    assert job["blocks_written"] == 0
+    assert job["block_chunks"] is None
+    # 失敗したジョブは再開の対象にならない
+    assert job_id not in [j["id"] for j in writer.job_store.interrupted_jobs()]
+
+def test_failed_page_creation_leaves_nothing_to_archive(writer):
+    job_id = _summarized_job(writer)
+    writer.notion.fail = {"pages.create": [FailingNotion("400 validation_error")]}
+    result = writer.add_summary("paper.pdf", job_id=job_id)
+    assert not result["success"]
+    assert not writer.notion.called("pages.update")
+    assert writer.job_store.get_job(job_id)["state"] == "failed"
+
+def test_page_writes_consume_notion_quota(writer, quota_scheduler, monkeypatch):
+    monkeypatch.setattr(config, "NOTION_RPM", 100)
+    job_id = _summarized_job(writer)
+    assert writer.add_summary("paper.pdf", job_id=job_id)["success"]
+    writes = len(writer.notion.called("pages.create")) + len(writer.notion.called("blocks.children.append"))
+    assert writes > 1
+    # 対話的な書き込みもエクスポートと同じNotionのRPMを消費する
+    remaining = quota_scheduler.status()[NOTION_QUOTA_KEY]["available_requests"]
+    assert 100 - writes <= remaining < 100 - writes + 1
+
+def test_jobs_created_in_the_same_second_keep_registration_order(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "same-second.sqlite3"))
+    monkeypatch.setattr(JobStore, "_now", staticmethod(lambda: "2024-01-01T00:00:00"))
+    first = store.create_job("a.pdf", input_hash="same")
+    second = store.create_job("b.pdf", input_hash="same")
+    assert store.find_job_by_hash("same", "concise")["id"] == second
+    assert [job["id"] for job in store.interrupted_jobs()] == [first, second]
+    assert [job["id"] for job in store.list_jobs()] == [second, first]
+
+class RecordingScheduler:
+    def __init__(self):
+        self.labels = []
+
+    def submit(self, fn, label="", **kwargs):
+        self.labels.append(label)
+
+def test_sweep_resumes_only_jobs_whose_owner_has_exited(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "sweep.sqlite3"))
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(add_notion, "get_job_store", lambda: store)
+    monkeypatch.setattr(add_notion, "get_scheduler", lambda: scheduler)
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+
+    jobs = {}
+    for name, owner in [("dead", exited.pid), ("alive", os.getppid()), ("mine", os.getpid())]:
+        jobs[name] = store.create_job(f"{name}.pdf")
+        store.update_job(jobs[name], state="summarized", sections=SECTIONS, owner_pid=owner)
+    # 前回のプロセスが同じPIDで登録したジョブ（起動前に更新されたもの）
+    jobs["previous"] = store.create_job("previous.pdf")
+    store.update_job(jobs["previous"], state="summarized", sections=SECTIONS)
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET updated_at = '2000-01-01T00:00:00' WHERE id = ?", (jobs["previous"],))
+
+    assert add_notion.resume_interrupted_jobs() == 2
+    assert sorted(scheduler.labels) == sorted([jobs["dead"], jobs["previous"]])
+    assert store.get_job(jobs["dead"])["owner_pid"] == os.getpid()
+    # 引き継いだジョブは次の巡回では自分の処理中のジョブとして扱う
+    assert add_notion.resume_interrupted_jobs() == 0
+
+def _created_keywords(writer):
+    created = writer.notion.called("pages.create")[-1]
+    return [option["name"] for option in created["properties"]["Keywords"]["multi_select"]]
+
+def test_unknown_keywords_are_dropped_by_default(writer):
+    assert writer.add_summary("paper.pdf", job_id=_summarized_job(writer))["success"]
+    assert _created_keywords(writer) == ["Transformer"]
+
+def test_new_keywords_are_registered_only_after_the_page_is_created(writer, monkeypatch):
+    monkeypatch.setattr(config, "KEYWORD_ALLOW_NEW", True)
+    writer.notion.fail = {"pages.create": [FailingNotion("400 validation_error")]}
+    assert not writer.add_summary("paper.pdf", job_id=_summarized_job(writer))["success"]
+    # 作成に失敗したページのキーワードには寄せない
+    assert writer.keyword_taxonomy.resolve("attentions") is None
+
+    assert writer.add_summary("paper.pdf", job_id=_summarized_job(writer))["success"]
+    assert _created_keywords(writer) == ["Transformer", "Attention"]
+    assert writer.keyword_taxonomy.resolve("attentions") == "Attention"
+
+def test_cancel_while_writing_archives_the_partial_page(writer):
+    job_id = _summarized_job(writer)
+    # 追加ブロックの書き込み中に取り消された
+    writer.notion.fail = {"blocks.children.append": [None, JobCancelled("APIから取り消されました")]}
+    result = writer.add_summary("paper.pdf", job_id=job_id)
+    assert result["cancelled"]
+    assert writer.notion.called("pages.update") == [{"page_id": "page-1", "archived": True}]
+    assert writer.job_store.get_job(job_id)["state"] == "cancelled"
@@ -0,0 +1,81 @@
+import pytest
+from conftest import FakeNotion
+
+from src import config
+from src.keyword_taxonomy import KeywordTaxonomy, normalize_keyword
+
+OPTIONS = [
+    "AI", "MI", "CT", "GAN", "LLM", "Natural Language Processing",
+    "Representation Learning", "Image Segmentation", "Pre-training", "Self-Supervised Learning",
+    "Vision Transformer", "Approach",
+]
+
+@pytest.fixture
+def taxonomy(tmp_path):
+    return KeywordTaxonomy(FakeNotion(keyword_options=OPTIONS), "database",
+                           cache_path=str(tmp_path / "keywords.json"))
+
+@pytest.mark.parametrize("keyword", [
+    "Active Inference",  # → AI
+    "Mutual Information",  # → MI
+    "Medical Image",  # → MI
+    "Clinical Trial",  # → CT
+    "Computed Tomography",  # → CT
+    "Graph Attention Network",  # → GAN
+    "Image Augmentation",  # → Image Segmentation
+    "RL",  # → Representation Learning（別名では Reinforcement Learning）
+    "Reinforcement Learning",
+    "Vision Transformers Survey",
+])
+def test_different_concepts_are_not_merged(taxonomy, keyword):
+    assert taxonomy.resolve(keyword) is None
+
+@pytest.mark.parametrize("keyword, expected", [
+    ("llms", "LLM"),
+    ("Vision Transformers", "Vision Transformer"),
+    ("vision-transformer", "Vision Transformer"),
+    ("Pretraining", "Pre-training"),
+    ("pre training", "Pre-training"),
+    ("Self Supervised Learning", "Self-Supervised Learning"),
+    ("Approaches", "Approach"),
+    ("NATURAL LANGUAGE PROCESSING", "Natural Language Processing"),
+])
+def test_spelling_variants_are_merged(taxonomy, keyword, expected):
+    assert taxonomy.resolve(keyword) == expected
+
+def test_acronyms_only_through_alias_table(taxonomy, monkeypatch):
+    # llm / nlp は KEYWORD_ALIASES に登録されているため、どちらの表記からも既存オプションに寄せる
+    assert taxonomy.resolve("Large Language Models") == "LLM"
+    assert taxonomy.resolve("NLP") == "Natural Language Processing"
+    # 別名の組がなければ頭字語は一致させない
+    monkeypatch.setattr(config, "KEYWORD_ALIASES", {})
+    plain = KeywordTaxonomy(taxonomy.notion, "database", cache_path=taxonomy.cache_path)
+    assert plain.resolve("Large Language Model") is None
+    assert plain.resolve("NLP") is None
+
+def test_registered_option_becomes_alias_target(taxonomy):
+    assert taxonomy.resolve("GNN") is None
+    taxonomy.register("Graph Neural Network")
+    assert taxonomy.resolve("GNN") == "Graph Neural Network"
+    assert taxonomy.resolve("graph neural networks") == "Graph Neural Network"
+
+def test_both_spellings_of_an_alias_pair_stay_distinct_options(tmp_path):
+    taxonomy = KeywordTaxonomy(FakeNotion(keyword_options=["Large Language Model", "LLM"]), "database",
+                               cache_path=str(tmp_path / "keywords.json"))
+    assert taxonomy.resolve("LLM") == "LLM"
+    assert taxonomy.resolve("Large Language Model") == "Large Language Model"
+
+def test_options_are_cached_between_instances(taxonomy):
+    taxonomy.resolve("AI")
+    again = KeywordTaxonomy(FakeNotion(), "database", cache_path=taxonomy.cache_path)
+    assert again.resolve("ai") == "AI"
+    assert not again.notion.calls
+
+def test_normalize_keyword():
+    assert normalize_keyword("Large-Language_Models") == "large language model"
+    assert normalize_keyword("ＬＬＭｓ") == "llm"
+
+@pytest.mark.parametrize("word", ["physics", "robotics", "statistics", "bayes", "series", "species",
+                                  "corpus", "analysis", "loss"])
+def test_singular_words_ending_in_s_are_kept(word):
+    assert normalize_keyword(word) == word
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+
+@pytest.fixture
+def client():
+    # 起動処理（Notionデータベースの初期化）は行わない
+    return TestClient(main.app)
+
+@pytest.mark.parametrize("path, files", [
+    ("/upload-pdf", {"pdf_file": ("paper.pdf", b"%PDF-1.4", "application/pdf")}),
+    ("/upload-pdfs", {"pdf_files": ("paper.pdf", b"%PDF-1.4", "application/pdf")}),
+])
+def test_unknown_summary_mode_is_rejected_before_creating_job(client, path, files):
+    before = len(main.get_job_store().list_jobs())
+    response = client.post(path, files=files, data={"summary_mode": "verbose"})
+    assert response.status_code == 400
+    assert "verbose" in response.json()["detail"]
+    assert len(main.get_job_store().list_jobs()) == before
+
+def test_sync_endpoints_run_outside_event_loop(client):
+    for route in main.app.routes:
+        if getattr(route, "path", None) in ("/jobs", "/jobs/{job_id}/cancel", "/search", "/model-stats",
+                                            "/quota", "/scheduler", "/memory", "/batches/{batch_id}"):
+            assert not asyncio.iscoroutinefunction(route.endpoint), route.path
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.post("/jobs/unknown/cancel").status_code == 404
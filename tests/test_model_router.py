@@ -0,0 +1,107 @@
+import sqlite3
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src import config, db, model_router
+from src.model_router import ModelRouter, is_retryable_error, is_throttling_error
+
+from conftest import FakeModel
+
+@pytest.fixture
+def models(monkeypatch):
+    """MODEL_ROUTING の候補を fast / strong の2つに固定し、偽のモデルを登録する"""
+    registered = {}
+
+    def register(name, **kwargs):
+        registered[name] = FakeModel(name, **kwargs)
+        monkeypatch.setitem(model_router._models, name, registered[name])
+        return registered[name]
+
+    monkeypatch.setattr(config, "MODEL_ROUTING", {"fast": ["fast-model"], "strong": ["strong-model"]})
+    monkeypatch.setattr(config, "MODEL_FALLBACKS", ["backup-model"])
+    return register
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.DeadlineExceeded("deadline"),
+    google_exceptions.ServiceUnavailable("unavailable"),
+    TimeoutError("read timed out"),
+])
+def test_timeouts_fall_back_without_draining_shared_bucket(models, quota_scheduler, model_stats, error):
+    models("strong-model", error=error)
+    backup = models("backup-model", text="ok")
+    router = ModelRouter("strong-model", stats=model_stats)
+
+    assert is_retryable_error(error) and not is_throttling_error(error)
+    assert router.generate(["prompt"], "strong", "main_content", input_tokens=5).text == "ok"
+    assert backup.calls
+    # 1回分の予約だけが差し引かれ、枠は空にされていない
+    limits = quota_scheduler.limits_for("strong-model")
+    assert quota_scheduler.status()["strong-model"]["available_requests"] >= limits["rpm"] - 1.01
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ResourceExhausted("quota exceeded"),
+    google_exceptions.TooManyRequests("slow down"),
+])
+def test_throttling_drains_shared_bucket(models, quota_scheduler, model_stats, error):
+    models("strong-model", error=error)
+    models("backup-model", text="ok")
+    router = ModelRouter("strong-model", stats=model_stats)
+
+    assert is_throttling_error(error)
+    router.generate(["prompt"], "strong", "main_content", input_tokens=5)
+    assert quota_scheduler.status()["strong-model"]["available_requests"] < 1
+
+def test_count_tokens_uses_callers_tier(models, quota_scheduler, model_stats):
+    fast = models("fast-model", text="ok", tokens=7)
+    strong = models("strong-model", text="ok")
+    router = ModelRouter("strong-model", stats=model_stats)
+
+    router.generate(["short prompt"], "fast", "Name")
+
+    assert [kind for kind, _ in fast.calls] == ["count_tokens", "generate_content"]
+    assert strong.calls == []
+    assert "fast-model:count_tokens" in quota_scheduler.status()
+    assert "strong-model:count_tokens" not in quota_scheduler.status()
+
+def test_errors_are_classified_by_type_not_message(models, quota_scheduler, model_stats):
+    # 文言に "429" や "timeout" を含むだけのエラー（プロンプトの内容の誤りなど）はフォールバックしない
+    error = google_exceptions.InvalidArgument("prompt mentions a 429 timeout quota")
+    assert not is_retryable_error(error) and not is_throttling_error(error)
+    assert not is_retryable_error(RuntimeError("429 rate limit"))
+
+    models("strong-model", error=error)
+    backup = models("backup-model", text="ok")
+    router = ModelRouter("strong-model", stats=model_stats)
+    with pytest.raises(google_exceptions.InvalidArgument):
+        router.generate(["prompt"], "strong", "main_content", input_tokens=5)
+    assert not backup.calls
+
+def test_untried_models_keep_configured_order(models, model_stats, monkeypatch):
+    monkeypatch.setattr(config, "MODEL_ROUTING", {"strong": ["primary", "second", "third"]})
+    router = ModelRouter("primary", stats=model_stats)
+    assert router.candidates("strong")[:3] == ["primary", "second", "third"]
+
+    # 計測済みのモデル同士はレイテンシ順に入れ替わり、未計測のモデルは元の位置に残る
+    model_stats.record_success("third", 0.5)
+    model_stats.record_success("primary", 2.0)
+    assert router.candidates("strong")[:3] == ["third", "second", "primary"]
+
+def test_stats_connections_are_closed(model_stats, monkeypatch):
+    opened = []
+    open_connection = db.open_connection
+
+    def tracking_open(*args, **kwargs):
+        conn = open_connection(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(db, "open_connection", tracking_open)
+    model_stats.record_success("m", 0.5)
+    model_stats.record_failure("m", retryable=True)
+    assert not model_stats.is_healthy("m")
+    assert model_stats.snapshot()["m"]["calls"] == 2
+    assert opened
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
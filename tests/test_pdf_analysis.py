@@ -0,0 +1,74 @@
+import pytest
+from conftest import make_pdf
+
+from src import config
+from src.pdf_analysis import analyze_pdf, choose_pdf_mode, resolve_pdf_mode
+
+FIGURE_SECTION = next(name for name, column in config.column_configs.items() if column.get("needs_figures"))
+TEXT_SECTION = next(name for name, column in config.column_configs.items() if not column.get("needs_figures"))
+
+BODY = [(f"Line {i}: we evaluate the proposed method on several benchmarks and report results.", 10, "Times-Roman")
+        for i in range(12)]
+
+@pytest.fixture
+def text_pdf(tmp_path):
+    return make_pdf(tmp_path / "text.pdf", BODY, pages=3)
+
+@pytest.fixture
+def scanned_pdf(tmp_path):
+    return make_pdf(tmp_path / "scanned.pdf", [], images=1, pages=3)
+
+@pytest.fixture
+def figure_pdf(tmp_path):
+    return make_pdf(tmp_path / "figures.pdf", BODY, images=2, pages=3)
+
+def test_analyze_counts_text_images_and_scanned_pages(text_pdf, scanned_pdf, figure_pdf):
+    text = analyze_pdf(text_pdf)
+    assert text["page_count"] == 3
+    assert text["chars_per_page"] > config.PDF_AUTO_MIN_CHARS_PER_PAGE
+    assert text["image_count"] == 0 and text["scanned_pages"] == 0
+
+    scanned = analyze_pdf(scanned_pdf)
+    assert scanned["total_chars"] == 0
+    assert scanned["image_count"] == 3 and scanned["scanned_pages"] == 3
+
+    figures = analyze_pdf(figure_pdf)
+    assert figures["image_count"] == 6 and figures["scanned_pages"] == 0
+
+def test_text_heavy_pdf_uses_text(text_pdf):
+    assert resolve_pdf_mode(text_pdf, [TEXT_SECTION])[0] == "text"
+    # 図表のセクションがあっても、画像がなければPDF全体を送らない
+    assert resolve_pdf_mode(text_pdf, [TEXT_SECTION, FIGURE_SECTION])[0] == "text"
+
+def test_scanned_pdf_uses_full(scanned_pdf):
+    mode, reasons = resolve_pdf_mode(scanned_pdf, [TEXT_SECTION])
+    assert mode == "full"
+    assert "テキスト層のないページが多い" in reasons[0]
+
+def test_sparse_text_uses_full(tmp_path):
+    pdf = make_pdf(tmp_path / "sparse.pdf", [("Figure 1", 10, "Helvetica")], pages=2)
+    mode, reasons = resolve_pdf_mode(pdf, [TEXT_SECTION])
+    assert mode == "full"
+    assert "文字数が少ない" in reasons[0]
+
+def test_figure_heavy_pdf_is_hybrid_only_when_figures_are_needed(figure_pdf):
+    assert resolve_pdf_mode(figure_pdf, [TEXT_SECTION, FIGURE_SECTION])[0] == "hybrid"
+    assert resolve_pdf_mode(figure_pdf, [TEXT_SECTION])[0] == "text"
+
+def test_large_figure_pdf_falls_back_to_text(figure_pdf, monkeypatch):
+    monkeypatch.setattr(config, "PDF_AUTO_MAX_FULL_SIZE_MB", 0)
+    mode, reasons = resolve_pdf_mode(figure_pdf, [FIGURE_SECTION])
+    assert mode == "text"
+    assert "ファイルサイズが大きい" in reasons[-1]
+
+def test_unreadable_pdf_uses_full(tmp_path):
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    assert resolve_pdf_mode(str(broken))[0] == "full"
+
+def test_few_scanned_pages_keep_text():
+    analysis = {"page_count": 10, "scanned_pages": 2, "chars_per_page": 1500.0, "image_count": 2,
+                "file_size_mb": 1.0, "error": None}
+    # スキャンページが PDF_AUTO_MAX_SCANNED_RATIO（2割）以下ならテキスト層を使う
+    assert choose_pdf_mode(analysis, [FIGURE_SECTION])[0] == "hybrid"
+    assert choose_pdf_mode({**analysis, "scanned_pages": 3}, [FIGURE_SECTION])[0] == "full"
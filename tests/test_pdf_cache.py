@@ -0,0 +1,56 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src import config
+from src.pdf_cache import PdfCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return PdfCache(str(tmp_path / "pdf_cache"))
+
+def _pdf(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"%" * size)
+    return str(path)
+
+def test_prune_evicts_least_recently_used(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PDF_CACHE_MAX_MB", 2.5 / 1024)  # 2.5KB
+    for index, digest in enumerate(("a", "b")):
+        cache.store_pdf(_pdf(tmp_path, f"{digest}.pdf", 1024), digest)
+        os.utime(cache.pdf_path(digest), (1000 + index, 1000 + index))
+    # a を読み出すと b より新しくなる
+    assert cache.pdf_path("a")
+    cache.store_pdf(_pdf(tmp_path, "c.pdf", 1024), "c")
+    assert cache.pdf_path("a") and cache.pdf_path("c")
+    assert cache.pdf_path("b") is None
+
+def test_keep_pdf_disabled(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PDF_CACHE_KEEP_PDF", False)
+    cache.store_pdf(_pdf(tmp_path, "a.pdf", 10), "a")
+    assert cache.pdf_path("a") is None
+
+def test_cancelled_upload_is_deleted_when_not_shared(cache):
+    cache.put_upload("a", SimpleNamespace(name="files/one"))
+    assert cache.release_upload("a", "files/one")
+    assert cache.get_upload_name("a") is None
+
+def test_shared_upload_survives_cancellation(cache):
+    cache.put_upload("a", SimpleNamespace(name="files/one"))
+    # 別のジョブが使い回した後に、アップロードしたジョブが取り消される
+    assert cache.get_upload_name("a") == "files/one"
+    assert not cache.release_upload("a", "files/one")
+    assert cache.get_upload_name("a") == "files/one"
+
+def test_release_keeps_newer_upload(cache):
+    cache.put_upload("a", SimpleNamespace(name="files/one"))
+    cache.put_upload("a", SimpleNamespace(name="files/two"))
+    assert not cache.release_upload("a", "files/one")
+    assert cache.get_upload_name("a") == "files/two"
+
+def test_new_upload_is_not_marked_shared_by_old_reuse(cache):
+    cache.put_upload("a", SimpleNamespace(name="files/one"))
+    cache.get_upload_name("a")
+    cache.put_upload("a", SimpleNamespace(name="files/two"))
+    assert cache.release_upload("a", "files/two")
@@ -0,0 +1,33 @@
+import io
+
+import pytest
+from conftest import make_pdf
+
+from src import chat_pdf, pdf_cache
+from src.pdf_stream import extract_text, write_text
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = pdf_cache.PdfCache(str(tmp_path / "pdf_cache"))
+    monkeypatch.setattr(pdf_cache, "_pdf_cache", cache)
+    return cache
+
+def test_write_text_matches_extract_text(tmp_path):
+    path = make_pdf(tmp_path / "paper.pdf", [("Deep Residual Learning", 18, "Helvetica-Bold"),
+                                             ("We present a residual learning framework.", 10, "Times-Roman")])
+    buffer = io.StringIO()
+    write_text(path, buffer)
+    assert buffer.getvalue() == extract_text(path)
+    assert "residual learning framework" in buffer.getvalue()
+
+def test_text_is_streamed_into_cache_once(tmp_path, cache, monkeypatch):
+    path = make_pdf(tmp_path / "paper.pdf", [("Deep Residual Learning", 18, "Helvetica-Bold")])
+    text = chat_pdf.get_pdf_content(path, "text", digest="digest")
+    assert "Deep Residual Learning" in text
+    assert cache.get_text("digest") == text
+
+    def fail(*args):
+        raise AssertionError("キャッシュ済みのテキストを抽出し直した")
+    monkeypatch.setattr(chat_pdf, "write_text", fail)
+    monkeypatch.setattr(chat_pdf, "hash_file", fail)
+    assert chat_pdf.get_pdf_content(path, "text", digest="digest") == text
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import sqlite3
+
+import pytest
+
+from src import config, db
+from src.job_context import JobCancelled, JobContext
+
+KEY = "fifo-model"
+
+@pytest.fixture
+def empty_bucket(quota_scheduler, monkeypatch):
+    """毎分600リクエスト・6000トークン（0.1秒ごとに1リクエスト、100トークン/秒）の空のバケット"""
+    monkeypatch.setitem(config.GEMINI_RATE_LIMITS, KEY, {"rpm": 600, "tpm": 6000})
+    monkeypatch.setattr(config, "QUOTA_POLL_SECONDS", 0.01)
+    with quota_scheduler._connect() as conn:
+        quota_scheduler._save(conn, KEY, 0.0, 0.0, time.time())
+    return quota_scheduler
+
+def _enqueue(scheduler, name, tokens, order, errors, context=None):
+    """待ち行列に並ぶまで待ってから次の呼び出し元を起動する（並んだ順を確定させる）"""
+    depth = scheduler.queue_depth(KEY)
+
+    def run():
+        try:
+            scheduler.acquire(KEY, tokens=tokens, context=context)
+            order.append(name)
+        except Exception as e:
+            errors.append((name, e))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while scheduler.queue_depth(KEY) <= depth and thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return thread
+
+def test_acquire_serves_callers_in_arrival_order(empty_bucket):
+    order, errors = [], []
+    threads = [_enqueue(empty_bucket, name, 0, order, errors) for name in "abcd"]
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not errors
+    assert order == list("abcd")
+    assert empty_bucket.queue_depth(KEY) == 0
+
+def test_small_request_does_not_overtake_large_head(empty_bucket):
+    order, errors = [], []
+    # 先頭は0.5秒分のトークンが必要。後ろの1トークンの呼び出しが先に空き枠を使ってはいけない
+    threads = [_enqueue(empty_bucket, "large", 50, order, errors),
+               _enqueue(empty_bucket, "small", 1, order, errors)]
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not errors
+    assert order == ["large", "small"]
+
+def test_cancelled_waiter_leaves_the_queue(empty_bucket):
+    order, errors = [], []
+    # 先頭はTPM上限を待つ間に取り消される → 後ろの呼び出しが詰まらずに進む
+    context = JobContext(timeout=0)
+    head = _enqueue(empty_bucket, "cancelled", 6000, order, errors, context=context)
+    follower = _enqueue(empty_bucket, "follower", 0, order, errors)
+    context.cancel()
+    head.join(timeout=10)
+    follower.join(timeout=10)
+    assert [name for name, _ in errors] == ["cancelled"]
+    assert isinstance(errors[0][1], JobCancelled)
+    assert order == ["follower"]
+    assert empty_bucket.queue_depth(KEY) == 0
+
+def test_lock_timeout_surfaces_the_original_error(empty_bucket, monkeypatch):
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_SECONDS", 0.05)
+    holder = sqlite3.connect(empty_bucket.db_path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        # BEGIN IMMEDIATE 自体の失敗を ROLLBACK のエラーで隠さない
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            empty_bucket.acquire(KEY)
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+    assert empty_bucket.queue_depth(KEY) == 0
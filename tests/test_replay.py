@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import protos, types
+
+from src import replay
+from src.replay import CassetteMiss, ReplayedError, TrafficRecorder
+
+def identity(value):
+    return value
+
+def record_then_replay(path, calls, **replay_options):
+    """calls（(route, request, live) の並び）を記録し、同じカセットを再生するレコーダーを返す"""
+    recorder = TrafficRecorder("record", str(path))
+    for route, request, live in calls:
+        try:
+            recorder.call("notion", route, request, live, identity, identity)
+        except Exception:
+            pass
+    return TrafficRecorder("replay", str(path), **replay_options)
+
+def never_called():
+    raise AssertionError("再生時にAPIを呼び出した")
+
+def test_replay_returns_recorded_responses_in_order(tmp_path):
+    responses = iter([{"id": 1}, {"id": 2}])
+    player = record_then_replay(tmp_path / "c.jsonl", [
+        ("notion POST pages", {"title": "a"}, lambda: next(responses)),
+        ("notion POST pages", {"title": "a"}, lambda: next(responses)),
+    ])
+    call = lambda: player.call("notion", "notion POST pages", {"title": "a"}, never_called, identity, identity)
+    assert [call(), call()] == [{"id": 1}, {"id": 2}]
+    # 使い切った後は最後の結果を返し続ける
+    assert call() == {"id": 2}
+    assert player.served["notion"] == 3
+
+def test_replay_reproduces_errors(tmp_path):
+    def throttled():
+        raise google_exceptions.ResourceExhausted("quota exceeded")
+
+    def broken():
+        raise ValueError("bad payload")
+
+    player = record_then_replay(tmp_path / "c.jsonl", [
+        ("generate_content m", "throttled", throttled),
+        ("notion POST pages", "broken", broken),
+    ])
+    # Google APIの例外は同じ型で再現する（フォールバックの判定が記録時と同じになる）
+    with pytest.raises(google_exceptions.ResourceExhausted, match="quota exceeded"):
+        player.call("notion", "generate_content m", "throttled", never_called, identity, identity)
+    with pytest.raises(ReplayedError, match="ValueError: bad payload"):
+        player.call("notion", "notion POST pages", "broken", never_called, identity, identity)
+
+def test_unmatched_request_falls_back_to_route_unless_strict(tmp_path):
+    calls = [("notion PATCH blocks/x/children", {"n": 1}, lambda: {"ok": True})]
+    loose = record_then_replay(tmp_path / "c.jsonl", calls)
+    assert loose.call("notion", "notion PATCH blocks/x/children", {"n": 2},
+                      never_called, identity, identity) == {"ok": True}
+    with pytest.raises(CassetteMiss):
+        loose.call("notion", "notion PATCH blocks/x/children", {"n": 3}, never_called, identity, identity)
+
+    strict = TrafficRecorder("replay", str(tmp_path / "c.jsonl"), strict=True)
+    with pytest.raises(CassetteMiss):
+        strict.call("notion", "notion PATCH blocks/x/children", {"n": 2}, never_called, identity, identity)
+
+def test_cassette_version_mismatch_is_rejected(tmp_path):
+    path = tmp_path / "old.jsonl"
+    path.write_text(json.dumps({"version": replay.CASSETTE_VERSION + 1}) + "\n")
+    with pytest.raises(ValueError):
+        TrafficRecorder("replay", str(path))
+    with pytest.raises(FileNotFoundError):
+        TrafficRecorder("replay", str(tmp_path / "missing.jsonl"))
+
+def test_generate_content_round_trip(tmp_path, monkeypatch):
+    class Model:
+        model_name = "models/fake"
+
+        def generate_content(self, contents, **kwargs):
+            return types.GenerateContentResponse.from_response(protos.GenerateContentResponse(
+                {"candidates": [{"content": {"parts": [{"text": f"要約: {contents[0]}"}]}}]}
+            ))
+
+    path = str(tmp_path / "gemini.jsonl")
+    monkeypatch.setattr(replay, "_traffic", TrafficRecorder("record", path))
+    assert replay.generate_content(Model(), ["prompt"]).text == "要約: prompt"
+
+    monkeypatch.setattr(replay, "_traffic", TrafficRecorder("replay", path))
+    model = Model()
+    model.generate_content = lambda *args, **kwargs: never_called()
+    # timeout は照合に含めない
+    assert replay.generate_content(model, ["prompt"], timeout=30).text == "要約: prompt"
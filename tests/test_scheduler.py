@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from src import config, db, memory_budget
+from src.scheduler import FairQueue, JobScheduler, QueueMetrics, ScheduledJob
+
+WEIGHTS = {"concise": 4.0, "detailed": 1.0}
+
+def job(mode="concise", submitter="alice", cost=1.0, label=""):
+    return ScheduledJob(lambda: label, "background", mode, submitter, cost, label)
+
+def pop_all(queue, count=None):
+    popped = []
+    while queue and (count is None or len(popped) < count):
+        popped.append(queue.pop())
+    return popped
+
+def test_modes_share_by_weight():
+    queue = FairQueue(WEIGHTS)
+    for _ in range(20):
+        queue.push(job("concise"))
+        queue.push(job("detailed"))
+    modes = [j.summary_mode for j in pop_all(queue, 10)]
+    assert modes.count("concise") == 8
+    assert modes.count("detailed") == 2
+    assert len(queue) == 30
+
+def test_weight_applies_to_cost_not_job_count():
+    queue = FairQueue({"concise": 1.0, "detailed": 1.0})
+    for _ in range(10):
+        queue.push(job("concise", cost=3.0))
+        queue.push(job("detailed", cost=1.0))
+    modes = [j.summary_mode for j in pop_all(queue, 8)]
+    # 同じ重みなら処理量（コスト）が等しくなるように、軽いモードを3倍取り出す
+    assert modes.count("concise") == 2
+    assert modes.count("detailed") == 6
+
+def test_submitters_alternate_within_mode():
+    queue = FairQueue(WEIGHTS)
+    for i in range(5):
+        queue.push(job(submitter="alice", label=f"a{i}"))
+    queue.push(job(submitter="bob", label="b0"))
+    labels = [j.label for j in pop_all(queue)]
+    # 先に大量に投入した投入者がいても、後から来た投入者が待たされ続けない
+    assert labels.index("b0") <= 1
+    assert [label for label in labels if label.startswith("a")] == [f"a{i}" for i in range(5)]
+
+def test_cheapest_first_within_submitter_then_fifo():
+    queue = FairQueue(WEIGHTS)
+    for label, cost in [("big", 100.0), ("small-1", 5.0), ("mid", 20.0), ("small-2", 5.0)]:
+        queue.push(job(cost=cost, label=label))
+    assert [j.label for j in pop_all(queue)] == ["small-1", "small-2", "mid", "big"]
+
+def test_pop_skips_jobs_that_are_not_admitted():
+    queue = FairQueue(WEIGHTS)
+    for label, cost in [("big", 1.0), ("small", 2.0)]:
+        queue.push(job(cost=cost, label=label))
+    assert queue.pop(lambda j: j.label != "big").label == "small"
+    assert queue.pop(lambda j: False) is None
+    assert [j.label for j in pop_all(queue)] == ["big"]
+
+def test_idle_mode_does_not_bank_credit():
+    queue = FairQueue(WEIGHTS)
+    for _ in range(20):
+        queue.push(job("concise"))
+    pop_all(queue, 12)
+    for _ in range(5):
+        queue.push(job("detailed"))
+    modes = [j.summary_mode for j in pop_all(queue, 5)]
+    # 待っていなかった間の分を取り戻そうとして detailed が連続しない
+    assert modes.count("detailed") == 1
+    assert queue.depths() == {"concise": 4, "detailed": 4}
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return JobScheduler(background_slots=1, interactive_slots=1, weights=WEIGHTS,
+                        metrics=QueueMetrics(str(tmp_path / "scheduler.sqlite3")))
+
+def test_interactive_job_runs_while_background_slots_are_busy(scheduler):
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(10)
+        return "background"
+
+    first = scheduler.submit(blocking, label="bg-1")
+    assert started.wait(5)
+    second = scheduler.submit(lambda: "queued", label="bg-2")
+    interactive = scheduler.submit(lambda: "interactive", interactive=True, label="ui")
+    try:
+        assert interactive.result(timeout=5) == "interactive"
+        # バックグラウンドの枠は1つなので、2つ目はまだ待っている
+        assert not second.done()
+        status = scheduler.status()
+        assert status["running_background"] == 1
+        assert status["classes"]["background:concise"]["queued"] == 1
+    finally:
+        release.set()
+    assert first.result(timeout=5) == "background"
+    assert second.result(timeout=5) == "queued"
+    stats = scheduler.metrics.summary(3600)
+    assert stats["interactive:concise"]["started"] == 1
+
+@pytest.fixture
+def budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_LIMIT_MB", 100)
+    monkeypatch.setattr(config, "JOB_MEMORY_BUDGET_MB", 100)
+    monkeypatch.setattr(config, "MEMORY_POLL_SECONDS", 0.01)
+    budget = memory_budget.MemoryBudget(str(tmp_path / "memory.sqlite3"))
+    monkeypatch.setattr(memory_budget, "_memory_budget", budget)
+    return budget
+
+def test_jobs_that_do_not_fit_in_memory_do_not_take_a_slot(scheduler, budget):
+    # 別のワーカーが60MBを予約中
+    assert budget.try_reserve("other-worker", 60)
+
+    def small():
+        # スケジューラが開始時に予約した分を使い、ジョブの中では予約し直さない
+        with budget.reserve(30, "small"):
+            return budget.status()["reserved_mb"]
+
+    # 先に取り出される大きいジョブが入らなくても、1つしかない枠を占有せずに次のジョブを開始する
+    big = scheduler.submit(lambda: "big", label="big", memory_mb=80, cost=1)
+    small_result = scheduler.submit(small, label="small", memory_mb=30, cost=2)
+    assert small_result.result(timeout=5) == 90
+    assert not big.done()
+
+    budget.release("other-worker")
+    assert big.result(timeout=5) == "big"
+    # 予約はジョブの結果を返した後に解放される
+    deadline = time.monotonic() + 5
+    while budget.status()["reserved_mb"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert budget.status()["reserved_mb"] == 0
+
+def test_reserve_lock_timeout_surfaces_the_original_error(budget, monkeypatch):
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_SECONDS", 0.05)
+    holder = sqlite3.connect(budget.db_path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        # BEGIN IMMEDIATE 自体の失敗を ROLLBACK のエラーで隠さない
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            budget.try_reserve("blocked", 10)
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
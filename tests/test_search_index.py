@@ -0,0 +1,68 @@
+import pytest
+
+from src.search_index import SearchIndex, build_match_query, tokenize
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / "search.sqlite3"))
+
+def test_tokenize_mixed_japanese_and_english():
+    # 英数字は小文字の単語、日本語はバイグラムと連続部分の末尾の1文字、全角英数字は半角に揃える
+    assert tokenize("ＢＥＲＴの事前学習とFine-tuning") == [
+        "bert", "の事", "事前", "前学", "学習", "習と", "と", "fine", "tuning"]
+    assert tokenize("GPT-4 は 学") == ["gpt", "4", "は", "学"]
+
+def test_query_tokens_leave_the_trailing_run_open():
+    # 検索語の末尾は続きの文字があっても一致するよう、ユニグラムを加えない
+    assert tokenize("数学者", query=True) == ["数学", "学者"]
+    # 途中の連続部分は索引と同じくユニグラムを挟む
+    assert tokenize("強化学習RL", query=True) == tokenize("強化学習RL") == [
+        "強化", "化学", "学習", "習", "rl"]
+
+def test_build_match_query():
+    assert build_match_query("Transformer 注意機構") == '"transformer" AND "注意 意機 機構"'
+    assert build_match_query("学") == '"学"*'
+    assert build_match_query("  ") is None
+    assert build_match_query("!!") is None
+
+def test_search_ranks_title_and_keyword_matches_first(index):
+    index.add("body-only", {"Name": "Graph Neural Networks", "Keywords": ["GNN"],
+                            "どんな研究？": "Transformerとの比較を行う。"})
+    index.add("title", {"Name": "Transformerによる翻訳", "Keywords": ["NLP"],
+                        "どんな研究？": "機械翻訳の研究。"})
+    index.add("keyword", {"Name": "大規模言語モデル", "Keywords": ["Transformer"],
+                          "どんな研究？": "事前学習の研究。"})
+    hits = index.search("transformer")
+    assert [hit["page_id"] for hit in hits][-1] == "body-only"
+    assert {hit["page_id"] for hit in hits[:2]} == {"title", "keyword"}
+    assert "どんな研究？" in hits[-1]["snippets"]
+
+def test_search_is_and_across_terms_and_finds_japanese_substrings(index):
+    index.add("a", {"Name": "自己教師あり学習", "どんな研究？": "画像の表現学習"})
+    index.add("b", {"Name": "教師あり学習の評価", "どんな研究？": "テキスト分類"})
+    assert {hit["page_id"] for hit in index.search("教師")} == {"a", "b"}
+    assert [hit["page_id"] for hit in index.search("教師 画像")] == ["a"]
+    assert index.search("教師 音声") == []
+
+def test_single_character_query_matches_the_last_character_of_a_run(index):
+    index.add("math", {"Name": "数学", "どんな研究？": "証明"})
+    index.add("science", {"Name": "科学者", "どんな研究？": "実験"})
+    # 「学」は「数学」の末尾（ユニグラム）、「学者」の先頭（バイグラム）のどちらにも一致する
+    assert {hit["page_id"] for hit in index.search("学")} == {"math", "science"}
+    assert [hit["page_id"] for hit in index.search("明")] == ["math"]
+
+def test_add_replaces_and_merge_updates_sections(index):
+    index.add("page", {"Name": "古いタイトル", "どんな研究？": "古い本文"})
+    index.add("page", {"Name": "新しいタイトル", "どんな研究？": "新しい本文"})
+    assert index.search("古い") == []
+    assert [hit["page_id"] for hit in index.search("新しい")] == ["page"]
+
+    assert index.merge("page", {"次に読む論文等は？": "拡散モデル"})
+    hit, = index.search("拡散")
+    assert hit["title"] == "新しいタイトル"
+    assert set(hit["snippets"]) == {"次に読む論文等は？"}
+    # 既存のセクションは残る
+    assert [h["page_id"] for h in index.search("新しい本文")] == ["page"]
+    # 未登録のページは追加しない
+    assert not index.merge("missing", {"どんな研究？": "拡散"})
+    assert len(index.search("拡散")) == 1
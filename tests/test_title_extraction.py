@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+from conftest import make_pdf
+
+from src import config
+from src.title_extraction import _font_confidence, extract_title, generate_local_name
+
+BODY = [("We propose a new method and evaluate it on several standard benchmarks.", 10, "Times-Roman")] * 30
+
+def test_ruby_progress_report_joins_lines_in_different_fonts(tmp_path):
+    # ppl2019.pdf: 1行目が太字17pt、2行目が通常の16pt
+    path = make_pdf(tmp_path / "ppl2019.pdf", [
+        ("Progress report: Ruby 3", 17.2, "Helvetica-Bold"),
+        ("and beyond", 15.8, "Helvetica"),
+        ("Yukihiro Matsumoto", 11, "Times-Roman"),
+    ] + BODY)
+    extracted = extract_title(path)
+    assert extracted["title"] == "Progress report: Ruby 3 and beyond"
+    # メタデータで裏付けられないため、ページ上の文字だけではしきい値に届かない
+    assert extracted["method"] == "font"
+    assert extracted["confidence"] < config.TITLE_LOCAL_MIN_CONFIDENCE
+
+def test_bert_title_with_mixed_fonts_and_small_header(tmp_path):
+    path = make_pdf(tmp_path / "bert.pdf", [
+        ("Proceedings of NAACL-HLT 2019, pages 4171-4186", 9, "Times-Roman"),
+        ("BERT: Pre-training of Deep Bidirectional", 15, "Times-Bold"),
+        ("Transformers for Language Understanding", 15, "Helvetica-Bold"),
+        ("Jacob Devlin Ming-Wei Chang Kenton Lee Kristina Toutanova", 12, "Times-Roman"),
+    ] + BODY, metadata_title="BERT: Pre-training of Deep Bidirectional Transformers for Language Understanding")
+    extracted = extract_title(path)
+    assert extracted == {
+        "title": "BERT: Pre-training of Deep Bidirectional Transformers for Language Understanding",
+        "confidence": 0.95,
+        "method": "metadata+font",
+    }
+
+def test_hyphenated_title_line_break(tmp_path):
+    path = make_pdf(tmp_path / "resnet.pdf", [
+        ("Deep Residual Learning for Im-", 17, "Times-Bold"),
+        ("age Recognition", 17, "Times-Bold"),
+        ("Kaiming He Xiangyu Zhang Shaoqing Ren Jian Sun", 11, "Times-Roman"),
+    ] + BODY, metadata_title="Deep Residual Learning for Image Recognition")
+    extracted = extract_title(path)
+    assert extracted["title"] == "Deep Residual Learning for Image Recognition"
+    assert extracted["method"] == "metadata+font"
+
+def test_title_cut_at_size_change_is_not_trusted(tmp_path):
+    # 副題が本文に近い大きさで書かれ、タイトルが "...:" で切れる
+    path = make_pdf(tmp_path / "cut.pdf", [
+        ("Language Models are Few-Shot Learners:", 18, "Helvetica-Bold"),
+        ("a study of in-context learning at scale", 12, "Helvetica"),
+    ] + BODY, metadata_title="Microsoft Word - gpt3_final.docx")
+    extracted = extract_title(path)
+    assert extracted["title"] == "Language Models are Few-Shot Learners:"
+    assert extracted["confidence"] < 0.5
+
+def test_no_text_larger_than_body_falls_back_to_metadata(tmp_path):
+    path = make_pdf(tmp_path / "flat.pdf", BODY, metadata_title="A Flat Layout Paper Without Large Title")
+    assert extract_title(path) == {"title": "A Flat Layout Paper Without Large Title", "confidence": 0.5,
+                                   "method": "metadata"}
+
+@pytest.mark.parametrize("title, penalized", [
+    ("Progress report: Ruby 3 and", True),
+    ("Attention Is All You Need:", True),
+    ("Graph Neural Networks for", True),
+    ("Ruby 3 and beyond", False),
+    ("Attention Is All You Need", False),
+])
+def test_incomplete_endings_lower_confidence(title, penalized):
+    confidence = _font_confidence(title, 18, 10)
+    assert (confidence < 0.5) == penalized
+    assert confidence <= 0.65
+
+class FakeRouter:
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, contents, tier, label, input_tokens=None):
+        self.prompts.append(contents[0])
+        return SimpleNamespace(text="注意機構がすべて")
+
+def test_local_name_needs_metadata_confirmation(tmp_path):
+    lines = [("Attention Is All You Need", 17, "Times-Bold"), ("Ashish Vaswani", 11, "Times-Roman")] + BODY
+    router = FakeRouter()
+    name, info = generate_local_name(make_pdf(tmp_path / "page-only.pdf", lines), router)
+    assert name is None and info["source"] == "model"
+    assert not router.prompts
+
+    name, info = generate_local_name(
+        make_pdf(tmp_path / "confirmed.pdf", lines, metadata_title="Attention Is All You Need"), router)
+    assert name == "Attention Is All You Need (注意機構がすべて)"
+    assert info == {"source": "local", "method": "metadata+font", "confidence": 0.95}
+    assert len(router.prompts) == 1
@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from conftest import FakeModel, FakeNotion, make_pdf
+
+from src import add_notion, batch, config, model_router, watch_folder
+from src.add_notion import NotionSummaryWriter
+from src.job_store import JobStore, hash_file
+from src.keyword_taxonomy import KeywordTaxonomy
+from src.scheduler import JobScheduler, QueueMetrics
+
+# すべてのセクションに同じ応答を返すモデル
+MODEL_TEXT = "\n".join(f"## {name}\n{name}の内容" for name in config.column_configs)
+
+class FailingNotion(Exception):
+    pass
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, quota_scheduler):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    for module in (watch_folder, batch, add_notion):
+        monkeypatch.setattr(module, "get_job_store", lambda: store)
+    scheduler = JobScheduler(background_slots=2, interactive_slots=0,
+                             metrics=QueueMetrics(str(tmp_path / "scheduler.sqlite3")))
+    for module in (watch_folder, add_notion):
+        monkeypatch.setattr(module, "get_scheduler", lambda: scheduler)
+
+    monkeypatch.setattr(config, "MODEL_ROUTING", {"fast": ["fast-model"], "strong": []})
+    monkeypatch.setattr(config, "MODEL_FALLBACKS", [])
+    monkeypatch.setitem(model_router._models, "fast-model", FakeModel("fast-model", text=MODEL_TEXT))
+    monkeypatch.setitem(model_router._models, config.GOOGLE_MODEL, FakeModel(config.GOOGLE_MODEL, text=MODEL_TEXT))
+
+    writer = NotionSummaryWriter(config, job_store=store)
+    writer.notion = FakeNotion()
+    writer.keyword_taxonomy = KeywordTaxonomy(writer.notion, writer.database_id,
+                                              cache_path=str(tmp_path / "keywords.json"))
+    monkeypatch.setattr(batch, "_writer", writer)
+    # 中断したジョブの再開にも同じ書き込み用オブジェクトを使う
+    monkeypatch.setattr(add_notion, "NotionSummaryWriter", lambda config_module, job_store=None: writer)
+    monkeypatch.setattr(config, "WATCH_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(watch_folder, "TICK_SECONDS", 0.05)
+    return store
+
+@pytest.fixture
+def inbox(tmp_path):
+    path = tmp_path / "inbox"
+    path.mkdir()
+    return path
+
+def paper(path, title="Attention Is All You Need"):
+    return make_pdf(path, [(title, 18, "Helvetica-Bold"), ("We propose the Transformer.", 10, "Times-Roman")])
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "タイムアウトしました"
+        time.sleep(0.02)
+
+@contextmanager
+def watching(inbox, settle_seconds=0.1):
+    # テキスト層だけを送る（full ではPDFをアップロードするため）
+    watcher = watch_folder.FolderWatcher(str(inbox), pdf_mode="text", use_inotify=False,
+                                         settle_seconds=settle_seconds)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    try:
+        yield watcher
+    finally:
+        watcher.stop()
+        thread.join(5)
+
+def test_file_being_written_is_not_submitted_until_it_settles(store, inbox, tmp_path):
+    data = open(paper(tmp_path / "source.pdf"), "rb").read()
+    target = inbox / "paper.pdf"
+    with watching(inbox, settle_seconds=0.5):
+        with open(target, "wb") as file:
+            # 書き込みが続いている間は、途中のファイルをジョブにしない
+            for offset in range(0, len(data), len(data) // 10 + 1):
+                file.write(data[offset:offset + len(data) // 10 + 1])
+                file.flush()
+                time.sleep(0.05)
+                assert store.list_jobs() == []
+        wait_for(lambda: (inbox / "done" / "paper.pdf").exists())
+
+    listed, = store.list_jobs()
+    job = store.get_job(listed["id"])
+    assert job["state"] == "completed"
+    assert job["input_hash"] == hash_file(str(inbox / "done" / "paper.pdf"))
+    assert job["submitter"] == watch_folder.SUBMITTER
+    assert not target.exists()
+
+def test_duplicates_share_one_job(store, inbox):
+    original = paper(inbox / "paper.pdf")
+    os.makedirs(inbox / "sub")
+    shutil.copyfile(original, inbox / "sub" / "copy.pdf")
+    with watching(inbox):
+        wait_for(lambda: (inbox / "done" / "paper.pdf").exists() and (inbox / "done" / "sub" / "copy.pdf").exists())
+
+        # 要約済みのPDFはジョブを作らずにそのまま done/ へ移す
+        shutil.copyfile(inbox / "done" / "paper.pdf", inbox / "again.pdf")
+        wait_for(lambda: (inbox / "done" / "again.pdf").exists())
+
+    assert len(store.list_jobs()) == 1
+    assert len(batch._writer.notion.called("pages.create")) == 1
+
+def test_failed_job_moves_to_failed_with_the_reason(store, inbox):
+    batch._writer.notion.fail["pages.create"] = [FailingNotion("Notionに接続できません")]
+    paper(inbox / "paper.pdf")
+    with watching(inbox):
+        wait_for(lambda: (inbox / "failed" / "paper.pdf.error.txt").exists())
+
+    assert (inbox / "failed" / "paper.pdf").exists()
+    assert not (inbox / "done" / "paper.pdf").exists()
+    assert (inbox / "failed" / "paper.pdf.error.txt").read_text(encoding="utf-8").startswith("failed: ")
+    job, = store.list_jobs()
+    assert job["state"] == "failed"
+
+def test_watcher_resumes_only_its_own_jobs(store, inbox):
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    sections = {"Name": "Resumed Paper", "Keywords": [], "どんな研究？": "再開したジョブ",
+                "_debug_info": {"token_counts": {"pdf_content": 10, "prompt": 10, "total_input": 20}}}
+    jobs = {}
+    for submitter in (watch_folder.SUBMITTER, "alice"):
+        jobs[submitter] = store.create_job(f"{submitter}.pdf", submitter=submitter)
+        store.update_job(jobs[submitter], state="summarized", sections=sections, owner_pid=exited.pid)
+
+    with watching(inbox):
+        wait_for(lambda: store.get_job(jobs[watch_folder.SUBMITTER])["state"] == "completed")
+
+    # 画面から投入されたジョブはWebサーバーのワーカーが再開する
+    other = store.get_job(jobs["alice"])
+    assert other["state"] == "summarized"
+    assert other["owner_pid"] == exited.pid